@@ -0,0 +1,152 @@
+"""Load test for semanticizest.aio against a local, in-process server.
+
+Starts an asyncio TCP server that reads one JSON list of tokens per line and
+answers with one JSON list of candidates per line, then hammers it with
+concurrent clients. Each mode is a different way for the server to call the
+semanticizer:
+
+- inline: call Semanticizer.all_candidates in the handler, blocking the loop;
+- unbatched: AsyncSemanticizer with max_batch_size=1;
+- batched: AsyncSemanticizer with micro-batching;
+- processes: batched, with batches run in --processes worker processes.
+
+Batching buys throughput when batches can be run on other cores than the
+event loop's. On a single core, the inline mode is fastest, but it stalls
+every other connection for the duration of each request.
+
+Usage: python benchmarks/bench_async.py [model] [--clients C] [--requests R]
+                                       [--processes P]
+
+Without a model, one is built from the nlwiki sample in the test suite.
+Requires Python 3.7 or later.
+"""
+
+from __future__ import print_function
+
+import argparse
+import asyncio
+from glob import glob
+import json
+from os.path import dirname, join
+from tempfile import NamedTemporaryFile
+import time
+
+from semanticizest import Semanticizer
+from semanticizest._semanticizer import create_model
+from semanticizest.aio import AsyncSemanticizer
+
+TESTS = join(dirname(__file__), '..', 'semanticizest', 'tests')
+
+
+def documents(length=200):
+    docs = []
+    for fname in sorted(glob(join(TESTS, 'nlwiki', 'in', '*'))):
+        with open(fname) as f:
+            tokens = f.read().split()
+        docs.extend(tokens[i:i + length]
+                    for i in range(0, len(tokens), length))
+    return docs
+
+
+async def serve(sem, mode, args):
+    asem = None
+    if mode == 'inline':
+        async def annotate(tokens):
+            return list(sem.all_candidates(tokens))
+    elif mode == 'processes':
+        asem = AsyncSemanticizer.with_processes(
+            args.model, args.processes, max_batch_size=args.max_batch_size,
+            max_delay=args.max_delay)
+        annotate = asem.all_candidates
+    else:
+        batch_size = 1 if mode == 'unbatched' else args.max_batch_size
+        asem = AsyncSemanticizer(sem, max_batch_size=batch_size,
+                                 max_delay=args.max_delay)
+        annotate = asem.all_candidates
+
+    handlers = []
+
+    async def handle(reader, writer):
+        handlers.append(asyncio.current_task())
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            candidates = await annotate(json.loads(line.decode('utf-8')))
+            writer.write(json.dumps(candidates).encode('utf-8') + b'\n')
+            await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(handle, '127.0.0.1', 0)
+    return server, handlers, asem
+
+
+async def client(port, docs, n_requests, latencies):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    for i in range(n_requests):
+        line = json.dumps(docs[i % len(docs)]).encode('utf-8') + b'\n'
+        start = time.time()
+        writer.write(line)
+        await writer.drain()
+        await reader.readline()
+        latencies.append(time.time() - start)
+    writer.close()
+    await writer.wait_closed()
+
+
+async def run(sem, docs, mode, args):
+    server, handlers, asem = await serve(sem, mode, args)
+    port = server.sockets[0].getsockname()[1]
+    if asem is not None:
+        # Don't count the start-up of worker processes.
+        await asem.all_candidates(docs[0])
+
+    latencies = []
+    start = time.time()
+    await asyncio.gather(*[client(port, docs[i::args.clients], args.requests,
+                                  latencies)
+                           for i in range(args.clients)])
+    elapsed = time.time() - start
+    await asyncio.gather(*handlers)
+    server.close()
+    await server.wait_closed()
+    if asem is not None:
+        asem.close()
+
+    latencies.sort()
+    pct = lambda p: 1000 * latencies[int(p * (len(latencies) - 1))]
+    print("%-10s %8.0f req/s   p50 %7.2f ms   p99 %7.2f ms"
+          % (mode, len(latencies) / elapsed, pct(.5), pct(.99)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('model', nargs='?')
+    parser.add_argument('--clients', type=int, default=64)
+    parser.add_argument('--requests', type=int, default=50,
+                        help='requests per client')
+    parser.add_argument('--max-batch-size', type=int, default=32)
+    parser.add_argument('--max-delay', type=float, default=.002)
+    parser.add_argument('--processes', type=int, default=0,
+                        help='also run batches in this many processes')
+    args = parser.parse_args()
+
+    if args.model is None:
+        tmp = NamedTemporaryFile()
+        create_model(join(TESTS, 'nlwiki-20140927-pages-articles-sample.xml'),
+                     tmp.name)
+        args.model = tmp.name
+    sem = Semanticizer(args.model)
+    docs = documents()
+
+    print("%d clients x %d requests, documents of up to 200 tokens"
+          % (args.clients, args.requests))
+    modes = ['inline', 'unbatched', 'batched']
+    if args.processes:
+        modes.append('processes')
+    for mode in modes:
+        asyncio.run(run(sem, docs, mode, args))
+
+
+if __name__ == '__main__':
+    main()
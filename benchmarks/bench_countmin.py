@@ -0,0 +1,71 @@
+"""Measure the errors of count-min sketches against exact n-gram counts.
+
+Usage: python benchmarks/bench_countmin.py [dump] [-N N]
+
+Builds a model of the dump (by default, the nlwiki sample in the test
+suite) with exact n-gram counts, and one with count-min sketches of each
+of several sizes, and reports the errors in term frequency over all
+distinct n-grams and in link probability over the anchors with a nonzero
+term frequency, as in the table in doc/algorithm.rst.
+"""
+
+from __future__ import print_function
+
+import argparse
+from os.path import abspath, dirname, join
+import sqlite3
+
+from semanticizest._countmin import load_sketch
+from semanticizest._semanticizer import createtables_path
+from semanticizest.parse_wikidump import parse_dump
+
+SAMPLE = join(abspath(dirname(__file__)), '..', 'semanticizest', 'tests',
+              'nlwiki-20140927-pages-articles-sample.xml')
+
+SIZES = [(1024, 4), (4096, 4), (16384, 4), (16384, 2), (16384, 8),
+         (65536, 4)]
+
+
+def build(dump, N, countmin=None):
+    db = sqlite3.connect(':memory:')
+    with open(createtables_path()) as create:
+        db.executescript(create.read())
+    parse_dump(dump, db, N=N, countmin=countmin)
+    return db
+
+
+def link_probability(tf, links):
+    return min(1., links / float(tf))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('dump', nargs='?', default=SAMPLE)
+    parser.add_argument('-N', type=int, default=2)
+    args = parser.parse_args()
+
+    db = build(args.dump, args.N)
+    tf = dict(db.execute('select ngram, tf from ngrams'))
+    links = dict(db.execute('select ngram, sum(count) from linkstats, ngrams '
+                            'where ngram_id = ngrams.id group by ngram_id'))
+    anchors = [a for a in links if tf.get(a)]
+    print("%d distinct n-grams, total tf %d; %d anchors with nonzero tf"
+          % (len(tf), sum(tf.values()), len(anchors)))
+
+    print("width  depth  memory  mean tf err  max tf err  exact tf  "
+          "mean P_link err")
+    for width, depth in SIZES:
+        sketch = load_sketch(build(args.dump, args.N, (width, depth)), 'tf')
+        errors = [sketch[ngram] - count for ngram, count in tf.items()]
+        p_errors = [abs(link_probability(sketch[a], links[a]) -
+                        link_probability(tf[a], links[a]))
+                    for a in anchors]
+        print("%-6d %-6d %4dkB  %11.2f  %10d  %7.1f%%  %15.4f"
+              % (width, depth, 2 * sketch.nbytes // 1024,
+                 sum(errors) / float(len(errors)), max(errors),
+                 100. * errors.count(0) / len(errors),
+                 sum(p_errors) / len(p_errors)))
+
+
+if __name__ == '__main__':
+    main()
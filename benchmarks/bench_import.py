@@ -0,0 +1,73 @@
+"""Time imports of semanticizest in fresh interpreters.
+
+Usage: python benchmarks/bench_import.py [--repeat R] [--top K]
+
+Reports the best wall-clock time over R runs of each import statement, minus
+that of an empty interpreter, and, on Python 3.7 or later, the K slowest
+modules imported by ``import semanticizest`` according to -X importtime.
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+from os.path import abspath, dirname, join
+import subprocess
+import sys
+import time
+
+ROOT = abspath(join(dirname(__file__), '..'))
+
+STATEMENTS = [
+    'import semanticizest',
+    'import semanticizest.serve',
+    'import semanticizest.parse_wikidump',
+]
+
+
+def best_time(code, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.time()
+        subprocess.check_call([sys.executable, '-c', code], cwd=ROOT)
+        best = min(best, time.time() - start)
+    return best
+
+
+def slowest_modules(top):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    proc = subprocess.Popen([sys.executable, '-X', 'importtime', '-c',
+                             'import semanticizest'],
+                            cwd=ROOT, env=env, stderr=subprocess.PIPE)
+    _, err = proc.communicate()
+    rows = []
+    for line in err.decode('utf-8').splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append((int(self_us), int(cumulative_us), name.strip()))
+    rows.sort(reverse=True)
+    return rows[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    baseline = best_time('pass', args.repeat)
+    print("empty interpreter: %.1f ms" % (1000 * baseline))
+    for code in STATEMENTS:
+        t = best_time(code, args.repeat) - baseline
+        print("%-40s %7.1f ms" % (code, 1000 * t))
+
+    if sys.version_info >= (3, 7):
+        print("\nslowest modules in 'import semanticizest' (self time):")
+        for self_us, cumulative_us, name in slowest_modules(args.top):
+            print("  %-40s %7.1f ms  (cumulative %.1f ms)"
+                  % (name, self_us / 1000., cumulative_us / 1000.))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""Time loading a model into a Semanticizer.
+
+Usage: python benchmarks/bench_load.py [model] [--anchors A] [--repeat R]
+
+Without a model, a synthetic one is generated with A anchors, each with a
+Zipf-distributed number of senses and link counts. The current loader,
+and the constructor as a whole, are compared with the row-by-row loader
+that it replaced.
+"""
+
+from __future__ import print_function
+
+import argparse
+from collections import defaultdict
+import os
+import random
+import shutil
+import sqlite3
+from tempfile import mkdtemp
+import time
+
+import six
+from six.moves import xrange
+
+from semanticizest import Semanticizer
+from semanticizest._semanticizer import createtables_path
+
+
+def make_model(fname, n_anchors, seed=42):
+    rng = random.Random(seed)
+    db = sqlite3.connect(fname)
+    with open(createtables_path()) as f:
+        db.executescript(f.read())
+    db.execute("insert into parameters values ('N', '7')")
+    db.executemany('insert into ngrams (id, ngram) values (?, ?)',
+                   ((i, u'anchor %d' % i) for i in range(1, n_anchors + 1)))
+
+    def senses():
+        for i in range(1, n_anchors + 1):
+            n = min(int(rng.paretovariate(1.2)), 500)
+            for t in rng.sample(xrange(n_anchors), n):
+                yield i, u'Entity %d' % t, int(rng.paretovariate(1.1))
+    db.executemany('insert or ignore into linkstats values (?, ?, ?)',
+                   senses())
+    db.commit()
+    db.close()
+
+
+def load_row_by_row(sem):
+    """The loader before vectorization, for comparison."""
+    interned = {}
+    commonness = defaultdict(list)
+    for target, anchor, count in sem._cur.execute(
+            'select target, ngram as anchor, count from linkstats, ngrams '
+            'where ngram_id = ngrams.id order by ngram_id;'):
+        target = interned.setdefault(target, target)
+        commonness[anchor].append((target, count))
+    for anchor, targets in six.iteritems(commonness):
+        total = float(sum(count for _, count in targets))
+        commonness[anchor] = tuple((t, interned.setdefault(count / total,
+                                                           count / total))
+                                   for t, count in targets)
+    return dict(commonness)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('model', nargs='?')
+    parser.add_argument('--anchors', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    tmpdir = None
+    if args.model is None:
+        tmpdir = mkdtemp()
+        args.model = os.path.join(tmpdir, 'model.db')
+        make_model(args.model, args.anchors)
+    try:
+        db = sqlite3.connect(args.model)
+        anchors, senses = db.execute('select count(distinct ngram_id), '
+                                     'count(*) from linkstats').fetchone()
+        db.close()
+        print("%d anchors, %d senses" % (anchors, senses))
+
+        sem = Semanticizer(args.model)
+        assert load_row_by_row(sem) == sem.commonness
+
+        for name, load in [('row by row', lambda: load_row_by_row(sem)),
+                           ('grouped', sem._load_commonness),
+                           ('Semanticizer', lambda: Semanticizer(args.model))]:
+            best = float('inf')
+            for _ in range(args.repeat):
+                start = time.time()
+                load()
+                best = min(best, time.time() - start)
+            print("%-16s %8.1f ms" % (name, 1000 * best))
+    finally:
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
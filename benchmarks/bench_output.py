@@ -0,0 +1,85 @@
+"""Compare serializing candidates from tuples and from parallel arrays.
+
+Usage: python benchmarks/bench_output.py [model] [--repeat R]
+
+Without a model, one is built (with N=7) from the nlwiki sample in the test
+suite. Each path annotates all test documents and writes JSON lines, one per
+document, to an in-memory file.
+"""
+
+from __future__ import print_function
+
+import argparse
+from glob import glob
+from io import StringIO
+import json
+from os.path import dirname, join
+from tempfile import NamedTemporaryFile
+import time
+
+from semanticizest import Semanticizer
+from semanticizest._semanticizer import create_model
+from semanticizest.output import write_jsonl, write_tsv
+
+TESTS = join(dirname(__file__), '..', 'semanticizest', 'tests')
+
+
+def tuples_to_jsonl(sem, docs, f):
+    for d, doc in enumerate(docs):
+        cands = [{'start': i, 'end': j, 'entity': target, 'prob': p}
+                 for i, j, target, p in sem.all_candidates(doc)]
+        f.write(json.dumps({'doc': d, 'candidates': cands}) + '\n')
+
+
+def arrays_to_jsonl(sem, docs, f):
+    write_jsonl(sem.candidate_arrays(docs), f)
+
+
+def arrays_to_jsonl_titles(sem, docs, f):
+    write_jsonl(sem.candidate_arrays(docs), f, entities=sem.entities)
+
+
+def arrays_to_tsv(sem, docs, f):
+    write_tsv(sem.candidate_arrays(docs), f)
+
+
+def annotate_only(sem, docs, f):
+    for doc in docs:
+        for _ in sem.all_candidates(doc):
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('model', nargs='?')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    if args.model is None:
+        tmp = NamedTemporaryFile()
+        create_model(join(TESTS, 'nlwiki-20140927-pages-articles-sample.xml'),
+                     tmp.name, N=7)
+        args.model = tmp.name
+    sem = Semanticizer(args.model)
+    sem.entities    # Build the entity index up front.
+
+    docs = []
+    for fname in sorted(glob(join(TESTS, 'nlwiki', 'in', '*'))):
+        with open(fname) as f:
+            docs.append(f.read().split())
+    n = sum(1 for doc in docs for _ in sem.all_candidates(doc))
+    print("%d documents, %d candidates" % (len(docs), n))
+
+    for fn in [annotate_only, tuples_to_jsonl, arrays_to_jsonl,
+               arrays_to_jsonl_titles, arrays_to_tsv]:
+        best = float('inf')
+        for _ in range(args.repeat):
+            f = StringIO()
+            start = time.time()
+            fn(sem, docs, f)
+            best = min(best, time.time() - start)
+        print("%-24s %8.1f ms" % (fn.__name__, 1000 * best))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Compare ways of intersecting inlinks in relatedness_matrix.
+
+Usage: python benchmarks/bench_relatedness.py [--entities E] [--articles W]
+                                              [--repeat R]
+
+Generates E entities with Zipf-distributed numbers of inlinks out of W
+articles, as sorted id arrays like those stored in the inlinks table, and
+times the intersection sizes of all pairs: with a frozenset per entity (as
+relatedness_matrix does), with a merge of the sorted arrays, and with
+``_intersection_size``, which gallops through the larger array for skewed
+pairs. The memory the frozensets take is reported next to the arrays'.
+"""
+
+from __future__ import print_function
+
+import argparse
+from array import array
+import random
+import sys
+import time
+
+from six.moves import xrange
+
+from semanticizest._semanticizer import _intersection_size
+
+
+def make_inlinks(n_entities, n_articles, seed=42):
+    rng = random.Random(seed)
+    return [array('i', sorted(rng.sample(xrange(n_articles),
+                                         min(n_articles,
+                                             100000 // (k + 1) + 5))))
+            for k in xrange(n_entities)]
+
+
+def merge_size(a, b):
+    n = i = j = 0
+    len_a, len_b = len(a), len(b)
+    while i < len_a and j < len_b:
+        x, y = a[i], b[j]
+        if x == y:
+            n += 1
+            i += 1
+            j += 1
+        elif x < y:
+            i += 1
+        else:
+            j += 1
+    return n
+
+
+def frozensets(inlinks):
+    sets = [frozenset(a) for a in inlinks]
+    return [[len(sets[i] & sets[j]) for j in xrange(i)]
+            for i in xrange(len(sets))]
+
+
+def merge(inlinks):
+    return [[merge_size(inlinks[i], inlinks[j]) for j in xrange(i)]
+            for i in xrange(len(inlinks))]
+
+
+def galloping(inlinks):
+    return [[_intersection_size(inlinks[i], inlinks[j]) for j in xrange(i)]
+            for i in xrange(len(inlinks))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--entities', type=int, default=60)
+    parser.add_argument('--articles', type=int, default=2000000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    inlinks = make_inlinks(args.entities, args.articles)
+    array_bytes = sum(a.itemsize * len(a) for a in inlinks)
+    set_bytes = sum(sys.getsizeof(frozenset(a)) for a in inlinks)
+    print("%d entities, %d inlinks: %.1f MB as arrays, %.1f MB as sets"
+          % (len(inlinks), sum(len(a) for a in inlinks), array_bytes / 1e6,
+             set_bytes / 1e6))
+
+    expected = None
+    for fn in [frozensets, merge, galloping]:
+        best = float('inf')
+        for _ in xrange(args.repeat):
+            start = time.time()
+            result = fn(inlinks)
+            best = min(best, time.time() - start)
+        if expected is None:
+            expected = result
+        assert result == expected
+        print("%-12s %8.1f ms" % (fn.__name__, 1000 * best))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""Load test for python -m semanticizest.serve.
+
+Sends batches of documents from concurrent keep-alive connections and
+reports requests/s, documents/s and latency percentiles, followed by the
+server's own metrics.
+
+Usage: python benchmarks/bench_serve.py [URL] [--clients C] [--requests R]
+                                        [--batch B] [--workers W]
+
+Without a URL, a server is started on a free port, with --workers worker
+processes, for a model built from the nlwiki sample in the test suite.
+"""
+
+from __future__ import print_function
+
+import argparse
+from glob import glob
+import json
+from os.path import dirname, join
+import socket
+import subprocess
+import sys
+from tempfile import NamedTemporaryFile
+from threading import Thread
+import time
+
+from six.moves import http_client
+from six.moves.urllib.parse import urlparse
+
+from semanticizest._semanticizer import create_model
+
+TESTS = join(dirname(__file__), '..', 'semanticizest', 'tests')
+
+
+def documents(length=200):
+    docs = []
+    for fname in sorted(glob(join(TESTS, 'nlwiki', 'in', '*'))):
+        with open(fname) as f:
+            tokens = f.read().split()
+        docs.extend(tokens[i:i + length]
+                    for i in range(0, len(tokens), length))
+    return docs
+
+
+def client(host, port, batches, latencies):
+    conn = http_client.HTTPConnection(host, port)
+    for body in batches:
+        start = time.time()
+        conn.request('POST', '/candidates', body)
+        response = conn.getresponse()
+        response.read()
+        latencies.append(time.time() - start)
+        assert response.status == 200, response.status
+    conn.close()
+
+
+def start_server(model, workers):
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+
+    proc = subprocess.Popen([sys.executable, '-m', 'semanticizest.serve',
+                             model, '--port', str(port),
+                             '--workers', str(workers)])
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            break
+        except socket.error:
+            time.sleep(.1)
+    return proc, port
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('url', nargs='?')
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=50,
+                        help='requests per client')
+    parser.add_argument('--batch', type=int, default=8,
+                        help='documents per request')
+    parser.add_argument('--workers', type=int, default=1)
+    args = parser.parse_args()
+
+    proc = None
+    if args.url is None:
+        tmp = NamedTemporaryFile()
+        create_model(join(TESTS, 'nlwiki-20140927-pages-articles-sample.xml'),
+                     tmp.name)
+        proc, port = start_server(tmp.name, args.workers)
+        host = '127.0.0.1'
+    else:
+        url = urlparse(args.url)
+        host, port = url.hostname, url.port or 80
+
+    docs = documents()
+    batches = [json.dumps([docs[(i + j) % len(docs)]
+                           for j in range(args.batch)])
+               for i in range(args.requests)]
+
+    try:
+        latencies = []
+        threads = [Thread(target=client,
+                          args=(host, port, batches[i:] + batches[:i],
+                                latencies))
+                   for i in range(args.clients)]
+        start = time.time()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.time() - start
+
+        conn = http_client.HTTPConnection(host, port)
+        conn.request('GET', '/metrics')
+        metrics = json.loads(conn.getresponse().read().decode('utf-8'))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+
+    latencies.sort()
+    pct = lambda p: 1000 * latencies[int(p * (len(latencies) - 1))]
+    print("%d clients x %d requests x %d documents"
+          % (args.clients, args.requests, args.batch))
+    print("%8.0f req/s  %8.0f docs/s   p50 %7.2f ms   p90 %7.2f ms"
+          "   p99 %7.2f ms"
+          % (len(latencies) / elapsed, args.batch * len(latencies) / elapsed,
+             pct(.5), pct(.9), pct(.99)))
+    print("server metrics:", json.dumps(metrics, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
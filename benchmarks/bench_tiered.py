@@ -0,0 +1,106 @@
+"""Compare memory use and latency of a full and a tiered model.
+
+Usage: python benchmarks/bench_tiered.py [model] [--anchors A] [--hot H]
+                                         [--docs D]
+
+Without a model, a synthetic one is generated with A anchors, as by
+bench_load.py. Documents of 200 tokens mix filler words with anchors,
+drawn from a Zipf distribution over the anchors ranked by link count, so
+that a few of them make up most lookups. Reported are the memory use
+according to ``memory_report`` and the median and 99th percentile time of
+``all_candidates`` per document, after a warm-up pass, for the full model
+and for the H most linked anchors in memory, with and without promotion.
+"""
+
+from __future__ import print_function
+
+import argparse
+from bisect import bisect
+import os
+import random
+import shutil
+import sqlite3
+from tempfile import mkdtemp
+import time
+
+from six.moves import xrange
+
+from bench_load import make_model
+from semanticizest import Semanticizer
+
+
+def make_docs(fname, n_docs, seed=42):
+    rng = random.Random(seed)
+    db = sqlite3.connect(fname)
+    anchors = [anchor for anchor, in db.execute(
+        'select ngram from linkstats, ngrams where ngram_id = ngrams.id '
+        'group by ngram_id order by sum(count) desc')]
+    db.close()
+
+    cumulative = []
+    total = 0.
+    for rank in xrange(1, len(anchors) + 1):
+        total += 1. / rank
+        cumulative.append(total)
+
+    docs = []
+    for _ in xrange(n_docs):
+        doc = []
+        while len(doc) < 200:
+            if rng.random() < .2:
+                k = bisect(cumulative, rng.random() * total)
+                doc.extend(anchors[min(k, len(anchors) - 1)].split())
+            else:
+                doc.append(u'word%d' % rng.randrange(5000))
+        docs.append(doc)
+    return docs
+
+
+def percentile(times, p):
+    times = sorted(times)
+    return times[min(len(times) - 1, int(p / 100. * len(times)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('model', nargs='?')
+    parser.add_argument('--anchors', type=int, default=200000)
+    parser.add_argument('--hot', type=int, default=20000)
+    parser.add_argument('--docs', type=int, default=2000)
+    args = parser.parse_args()
+
+    tmpdir = None
+    if args.model is None:
+        tmpdir = mkdtemp()
+        args.model = os.path.join(tmpdir, 'model.db')
+        make_model(args.model, args.anchors)
+        db = sqlite3.connect(args.model)
+        db.execute('create unique index ngram_text on ngrams(ngram)')
+        db.close()
+    try:
+        docs = make_docs(args.model, args.docs)
+        print("%d documents of %d tokens" % (len(docs), len(docs[0])))
+
+        for name, kwargs in [
+                ('full', {}),
+                ('hot', {'hot_anchors': args.hot, 'promote_after': None}),
+                ('hot, promoting', {'hot_anchors': args.hot})]:
+            sem = Semanticizer(args.model, **kwargs)
+            for doc in docs:
+                list(sem.all_candidates(doc))
+            times = []
+            for doc in docs:
+                start = time.time()
+                list(sem.all_candidates(doc))
+                times.append(time.time() - start)
+            print("%-16s %7.1f MB  p50 %6.2f ms  p99 %6.2f ms  %r"
+                  % (name, sem.memory_report()['total'] / 1e6,
+                     1000 * percentile(times, 50),
+                     1000 * percentile(times, 99), sem.tier_info()))
+    finally:
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Compare the throughput of the tokenizers used when building and querying.
+
+Usage: python benchmarks/bench_tokenize.py [--repeat R]
+
+The text is the running text of the pages in the nlwiki sample in the test
+suite, cleaned as parse_dump cleans it. Besides the shared tokenizer (with
+and without character offsets), this times the paths it replaced: a regex
+compiled per page, as page_statistics used, and whitespace splitting, as
+all_candidates used. Last, candidate generation from the same text as
+token indices and as character spans.
+"""
+
+from __future__ import print_function
+
+import argparse
+from os.path import abspath, dirname, join
+import re
+from tempfile import NamedTemporaryFile
+import time
+
+from semanticizest import Semanticizer
+from semanticizest._semanticizer import create_model
+from semanticizest._util import iter_tokens, tokenize, tokenize_with_offsets
+from semanticizest.parse_wikidump import (clean_text, extract_pages,
+                                          remove_links)
+
+SAMPLE = join(abspath(dirname(__file__)), '..', 'semanticizest', 'tests',
+              'nlwiki-20140927-pages-articles-sample.xml')
+
+
+def regex_per_page(text):
+    return re.compile(r'\w+', re.UNICODE).findall(text)
+
+
+def split(text):
+    return text.split()
+
+
+def offsets(text):
+    return tokenize_with_offsets(text)
+
+
+def lazy(text):
+    return list(iter_tokens(text))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    texts = [remove_links(clean_text(page.content))
+             for page in extract_pages(SAMPLE) if page.redirect is None]
+    size = sum(len(text) for text in texts) / 1e6
+    print("%d pages, %.1f M characters, %d tokens"
+          % (len(texts), size, sum(len(tokenize(text)) for text in texts)))
+
+    tmp = NamedTemporaryFile()
+    create_model(SAMPLE, tmp.name, N=7)
+    sem = Semanticizer(tmp.name)
+
+    def all_candidates(text):
+        return list(sem.all_candidates(text))
+
+    for fn in [split, regex_per_page, tokenize, lazy, offsets,
+               all_candidates, sem.char_candidates]:
+        best = float('inf')
+        for _ in range(args.repeat):
+            start = time.time()
+            for text in texts:
+                fn(text)
+            best = min(best, time.time() - start)
+        print("%-16s %8.1f ms %8.1f M chars/s"
+              % (fn.__name__, 1000 * best, size / best))
+
+
+if __name__ == '__main__':
+    main()
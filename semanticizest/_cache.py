@@ -0,0 +1,75 @@
+"""Bounded LRU cache for per-sentence results."""
+
+from collections import namedtuple, OrderedDict
+import sys
+import threading
+
+
+CacheInfo = namedtuple('CacheInfo', 'hits misses maxsize currsize nbytes')
+
+
+class LRUCache(object):
+    """Thread-safe mapping that evicts the least recently used entries.
+
+    Parameters
+    ----------
+    maxsize : int
+        Maximum number of entries.
+    sizeof : callable, optional
+        Estimates the memory used by a key and a value, for ``info``.
+    """
+
+    def __init__(self, maxsize, sizeof=None):
+        if maxsize < 1:
+            raise ValueError("maxsize should be at least 1, got %r"
+                             % maxsize)
+        self.maxsize = maxsize
+        self._sizeof = sizeof or _sizeof
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._nbytes = 0
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        """Value for key, or None. Counts as a use of key."""
+        with self._lock:
+            try:
+                value, nbytes = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self._entries[key] = value, nbytes
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Store value for key, evicting the least recently used entry."""
+        nbytes = self._sizeof(key, value)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._nbytes -= old[1]
+            elif len(self._entries) >= self.maxsize:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._nbytes -= evicted
+            self._entries[key] = value, nbytes
+            self._nbytes += nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+            self.hits = self.misses = 0
+
+    def info(self):
+        """Hit and miss counts, size and estimated memory use."""
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize,
+                             len(self._entries), self._nbytes)
+
+
+def _sizeof(key, value):
+    """Rough memory use of a tuple of strings and a tuple of tuples."""
+    getsizeof = sys.getsizeof
+    return (getsizeof(key) + sum(getsizeof(k) for k in key) +
+            getsizeof(value) + sum(getsizeof(v) for v in value))
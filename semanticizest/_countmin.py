@@ -0,0 +1,132 @@
+"""Count-min sketches for approximate n-gram counting."""
+
+from array import array
+from hashlib import md5
+import sqlite3
+import struct
+import sys
+
+import six
+from six.moves import xrange
+
+from semanticizest._util import array_frombytes, array_tobytes
+
+
+def _counter_typecode():
+    # Counters are stored as 8-byte integers. Python 2 has no 'q', but its
+    # 'l' is 8 bytes on most 64-bit platforms (not on Windows).
+    for typecode in 'ql':
+        try:
+            if array(typecode).itemsize == 8:
+                return typecode
+        except ValueError:
+            pass
+    return None
+
+_TYPECODE = _counter_typecode()
+
+
+class CountMinSketch(object):
+    """Count-min sketch with conservative update.
+
+    A count-min sketch stores approximate counts for an unbounded set of
+    keys in fixed memory. Estimates are never too low; they are too high
+    by at most ``2 * total / width`` with probability ``1 - 2 ** -depth``,
+    where ``total`` is the sum of all counts. Conservative update makes
+    the overestimates considerably smaller in practice.
+
+    Parameters
+    ----------
+    width : int
+        Number of counters per row.
+    depth : int
+        Number of rows, i.e., of hash functions.
+    counts : bytes, optional
+        Counters, as returned by ``tobytes``.
+    """
+
+    def __init__(self, width, depth, counts=None):
+        if _TYPECODE is None:
+            raise RuntimeError("count-min sketches need 8-byte integer"
+                               " arrays, which this Python does not have")
+        self.width = width
+        self.depth = depth
+        self.counts = array(_TYPECODE)
+        if counts is None:
+            self.counts.extend([0] * (width * depth))
+        else:
+            array_frombytes(self.counts, counts)
+            if sys.byteorder == 'big':
+                self.counts.byteswap()
+            if len(self.counts) != width * depth:
+                raise ValueError("expected %d counters, got %d"
+                                 % (width * depth, len(self.counts)))
+
+    def _cells(self, key):
+        # Double hashing (Kirsch & Mitzenmacher 2006) with the two halves of
+        # an MD5 digest, which, unlike hash(), is the same across processes.
+        if isinstance(key, six.text_type):
+            key = key.encode('utf-8')
+        h1, h2 = struct.unpack('<QQ', md5(key).digest())
+        w = self.width
+        return [i * w + (h1 + i * h2) % w for i in xrange(self.depth)]
+
+    def add(self, key, count=1):
+        """Add count to the count of key."""
+        counts = self.counts
+        cells = self._cells(key)
+        new = min(counts[c] for c in cells) + count
+        for c in cells:
+            if counts[c] < new:
+                counts[c] = new
+
+    def __getitem__(self, key):
+        """Estimated count of key."""
+        counts = self.counts
+        return min(counts[c] for c in self._cells(key))
+
+    def merge(self, other):
+        """Add the counts from another sketch of the same shape."""
+        if (self.width, self.depth) != (other.width, other.depth):
+            raise ValueError("cannot merge %dx%d sketch into %dx%d sketch"
+                             % (other.width, other.depth,
+                                self.width, self.depth))
+        counts = self.counts
+        for i, c in enumerate(other.counts):
+            counts[i] += c
+
+    def scale(self, factor):
+        """Multiply all counts by factor, rounding to integers."""
+        counts = self.counts
+        for i, c in enumerate(counts):
+            counts[i] = int(round(c * factor))
+
+    def tobytes(self):
+        """Counters as little-endian 64-bit integers, for storage."""
+        if sys.byteorder == 'big':
+            counts = array(_TYPECODE, self.counts)
+            counts.byteswap()
+            return array_tobytes(counts)
+        return array_tobytes(self.counts)
+
+    @property
+    def nbytes(self):
+        """Memory used by the counters."""
+        return self.counts.itemsize * len(self.counts)
+
+
+def save_sketch(db, name, sketch):
+    """Store sketch in the countmin table of db under name."""
+    db.execute('''insert or replace into countmin values (?, ?, ?, ?)''',
+               (name, sketch.width, sketch.depth,
+                sqlite3.Binary(sketch.tobytes())))
+
+
+def load_sketch(db, name, table='countmin'):
+    """Load the sketch stored under name from db, or None if there is none."""
+    row = db.execute('''select width, depth, counts from %s
+                        where name = ?''' % table, (name,)).fetchone()
+    if row is None:
+        return None
+    width, depth, counts = row
+    return CountMinSketch(width, depth, counts)
@@ -0,0 +1,284 @@
+"""Deletion-neighbourhood index for approximate anchor matching.
+
+This is the SymSpell approach: two strings are within edit distance d of
+each other only if deleting at most d characters from each can make them
+equal. So every anchor is indexed under all strings obtained by deleting
+up to d characters from it, and a query string is looked up under its own
+deletions; the candidates found are then checked with an actual edit
+distance computation. To keep the index small, deletions are taken from a
+prefix of each string only.
+
+Deletions are stored as CRC-32 hashes, in a sorted array with a parallel
+array of anchor ids, so the index takes 8 bytes per deletion and loads
+without any parsing. Hash collisions only cost a wasted distance check.
+Most deletions of a query are in no anchor's neighbourhood; a bitset of
+about 8 bits per hash rules out most of those without a binary search.
+Lookups are memoized, since the same n-grams keep coming back in text.
+"""
+
+from array import array
+from bisect import bisect_left
+import logging
+import os
+import sqlite3
+from zlib import crc32
+
+from six.moves import xrange
+
+from semanticizest._cache import LRUCache
+from semanticizest._util import array_frombytes, array_tobytes
+
+
+_logger = logging.getLogger(__name__)
+
+# N-grams of fewer than this many characters per edit are not matched
+# approximately: short strings are close to too many anchors.
+CHARS_PER_EDIT = 4
+
+# Number of lookups to memoize.
+_CACHE_SIZE = 1 << 14
+
+
+def fuzzy_index_path(model):
+    """Filename of the fuzzy index stored next to the model file."""
+    return model + '.fuzzy'
+
+
+class FuzzyIndex(object):
+    """Index of anchors by their deletion neighbourhoods.
+
+    Use ``build_fuzzy_index`` to make one and ``load_fuzzy_index`` to
+    load it.
+    """
+
+    def __init__(self, anchors, hashes, ids, max_distance, prefix_length):
+        self.anchors = anchors
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self._hashes = hashes
+        self._ids = ids
+
+        # One bit per hash value modulo a power of two, at least 8 * n.
+        size = 8
+        while size < len(hashes):
+            size *= 2
+        self._mask = 8 * size - 1
+        bits = bytearray(size)
+        for h in hashes:
+            h &= self._mask
+            bits[h >> 3] |= 1 << (h & 7)
+        self._bits = bits
+
+        # First and last tokens of multi-token anchors, for lookup.
+        multi = [a.split(' ') for a in anchors if ' ' in a]
+        self._first = frozenset(tokens[0] for tokens in multi)
+        self._last = frozenset(tokens[-1] for tokens in multi)
+
+        self._cache = LRUCache(_CACHE_SIZE)
+
+    @property
+    def nbytes(self):
+        """Estimated memory use."""
+        return (self._hashes.itemsize * len(self._hashes) +
+                self._ids.itemsize * len(self._ids) + len(self._bits) +
+                sum(map(_sizeof, self.anchors)) +
+                sum(map(_sizeof, self._first)) +
+                sum(map(_sizeof, self._last)) + self._cache.info().nbytes)
+
+    def lookup(self, s, max_distance=None):
+        """Anchors within edit distance max_distance of s.
+
+        Distance is optimal string alignment distance (Levenshtein, plus
+        transpositions of adjacent characters). At distance 1, a string of
+        several tokens is only matched if its first or last token is that
+        of a multi-token anchor; this misses edits of the spaces between
+        tokens, but saves looking up most n-grams of running text.
+
+        Returns
+        -------
+        matches : list of (string, int)
+            Anchors and their distance to s, by distance and anchor.
+        """
+        if max_distance is None or max_distance > self.max_distance:
+            max_distance = self.max_distance
+        if max_distance == 1 and ' ' in s:
+            if (s[:s.index(' ')] not in self._first and
+                    s[s.rindex(' ') + 1:] not in self._last):
+                return []
+        key = s, max_distance
+        matches = self._cache.get(key)
+        if matches is None:
+            matches = self._lookup(s, max_distance)
+            self._cache.put(key, matches)
+        return list(matches)
+
+    def _lookup(self, s, max_distance):
+        hashes, ids = self._hashes, self._ids
+        bits, mask = self._bits, self._mask
+        n = len(hashes)
+
+        candidates = set()
+        for deletion in _deletions(s[:self.prefix_length], max_distance):
+            h = crc32(deletion.encode('utf-8')) & 0xffffffff
+            b = h & mask
+            if not bits[b >> 3] & (1 << (b & 7)):
+                continue
+            k = bisect_left(hashes, h)
+            while k < n and hashes[k] == h:
+                candidates.add(ids[k])
+                k += 1
+
+        matches = []
+        for i in candidates:
+            anchor = self.anchors[i]
+            d = _distance(s, anchor, max_distance)
+            if d <= max_distance:
+                matches.append((d, anchor))
+        matches.sort()
+        return tuple((anchor, d) for d, anchor in matches)
+
+
+def build_fuzzy_index(model, max_distance=1, prefix_length=10):
+    """Build the fuzzy index of the anchors of a stored model.
+
+    The index is stored next to the model (see ``fuzzy_index_path``), for
+    ``Semanticizer(model, fuzzy=True)``.
+
+    Parameters
+    ----------
+    model : string
+        Filename of the stored model.
+    max_distance : int, optional
+        Maximum edit distance that the index supports.
+    prefix_length : int, optional
+        Number of characters at the start of each anchor to take
+        deletions from. Larger values give fewer spurious candidates to
+        check per lookup, but a larger index: each anchor is stored under
+        about prefix_length ** max_distance / max_distance! deletions.
+    """
+    db = sqlite3.connect(model)
+    anchors = [anchor for anchor, in db.execute(
+        'select ngram from ngrams '
+        'where id in (select ngram_id from linkstats) order by id;')]
+    db.close()
+
+    fname = fuzzy_index_path(model)
+    _logger.info("Building fuzzy index of %d anchors in %r",
+                 len(anchors), fname)
+    db = sqlite3.connect(fname)
+    db.executescript('''
+        drop table if exists parameters;
+        drop table if exists arrays;
+        create table parameters (key text primary key, value text);
+        create table arrays (name text primary key, data blob);
+        create temp table deletions (hash integer, anchor_id integer);
+    ''')
+    # Let SQLite do the sorting, which it can do out of core.
+    for i, anchor in enumerate(anchors):
+        db.executemany('insert into deletions values (?, ?)',
+                       ((h, i) for h in set(
+                           _hash(d) for d in
+                           _deletions(anchor[:prefix_length], max_distance))))
+    hashes, ids = array('I'), array('i')
+    for h, i in db.execute('select hash, anchor_id from deletions '
+                           'order by hash, anchor_id;'):
+        hashes.append(h)
+        ids.append(i)
+
+    db.executemany('insert into parameters values (?, ?)',
+                   [('max_distance', str(max_distance)),
+                    ('prefix_length', str(prefix_length))])
+    db.executemany('insert into arrays values (?, ?)',
+                   [('anchors', sqlite3.Binary(
+                       u'\n'.join(anchors).encode('utf-8'))),
+                    ('hashes', sqlite3.Binary(array_tobytes(hashes))),
+                    ('ids', sqlite3.Binary(array_tobytes(ids)))])
+    db.commit()
+    db.execute('drop table deletions')
+    db.execute('vacuum')
+    db.close()
+    _logger.info("Fuzzy index has %d deletions", len(hashes))
+
+
+def load_fuzzy_index(model):
+    """Load the fuzzy index stored next to a model.
+
+    Raises
+    ------
+    IOError
+        If there is no fuzzy index for the model.
+    """
+    fname = fuzzy_index_path(model)
+    if not os.path.exists(fname):
+        raise IOError("no fuzzy index for %r; use build_fuzzy_index"
+                      % model)
+    db = sqlite3.connect(fname)
+    params = dict(db.execute('select key, value from parameters'))
+    data = dict(db.execute('select name, data from arrays'))
+    db.close()
+
+    hashes, ids = array('I'), array('i')
+    array_frombytes(hashes, data['hashes'])
+    array_frombytes(ids, data['ids'])
+    anchors = bytes(data['anchors']).decode('utf-8')
+    anchors = anchors.split(u'\n') if anchors else []
+    return FuzzyIndex(anchors, hashes, ids, int(params['max_distance']),
+                      int(params['prefix_length']))
+
+
+def _hash(s):
+    # crc32 is signed on Python 2.
+    return crc32(s.encode('utf-8')) & 0xffffffff
+
+
+def _sizeof(s):
+    # Rough, but without calling sys.getsizeof a million times.
+    return 50 + 2 * len(s)
+
+
+def _deletions(s, max_distance):
+    """s and all strings made by deleting up to max_distance chars."""
+    found = set([s])
+    last = found
+    for _ in xrange(max_distance):
+        last = set(w[:i] + w[i + 1:] for w in last for i in xrange(len(w)))
+        found |= last
+    return found
+
+
+def _distance(a, b, max_distance):
+    """Optimal string alignment distance, or max_distance + 1 if larger."""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    # Only the part between the common prefix and suffix needs aligning.
+    n = min(len(a), len(b))
+    start = 0
+    while start < n and a[start] == b[start]:
+        start += 1
+    end = 0
+    while end < n - start and a[-1 - end] == b[-1 - end]:
+        end += 1
+    a, b = a[start:len(a) - end], b[start:len(b) - end]
+    if not a or not b:
+        return min(len(a) + len(b), max_distance + 1)
+
+    too_far = max_distance + 1
+    before = None
+    prev = list(xrange(len(b) + 1))
+    for i in xrange(1, len(a) + 1):
+        ai = a[i - 1]
+        cur = [i] + [0] * len(b)
+        lowest = i
+        for j in xrange(1, len(b) + 1):
+            d = min(prev[j] + 1, cur[j - 1] + 1,
+                    prev[j - 1] + (ai != b[j - 1]))
+            if (i > 1 and j > 1 and ai == b[j - 2] and a[i - 2] == b[j - 1]
+                    and before[j - 2] + 1 < d):
+                d = before[j - 2] + 1
+            cur[j] = d
+            if d < lowest:
+                lowest = d
+        if lowest > max_distance:
+            return too_far
+        before, prev = prev, cur
+    return min(prev[-1], too_far)
@@ -1,11 +1,47 @@
-from collections import defaultdict
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict
+import gc
+from functools import partial
+from itertools import groupby, repeat
+import logging
+from math import log
+from operator import itemgetter
+import os
 import sqlite3
+import sys
 from os.path import join, dirname, abspath
+import threading
 
 import six
+from six.moves import xrange
 
-from semanticizest._util import ngrams_with_pos, tosequence
-from semanticizest.parse_wikidump import parse_dump
+from semanticizest._cache import CacheInfo, LRUCache
+from semanticizest._countmin import load_sketch
+from semanticizest._util import (fold, ids_frombytes, iter_tokens,
+                                 ngrams_with_pos, ngrams_with_pos_iter,
+                                 sentence_ends, text_sentence_ends, tokenize,
+                                 tokenize_with_offsets, tosequence)
+from semanticizest.output import CandidateArrays
+
+# This is what urllib.request uses, without the cost of importing it (and
+# with it, http.client and email).
+if os.name == 'nt':
+    from nturl2path import pathname2url
+else:
+    from six.moves.urllib.parse import quote as pathname2url
+
+
+_logger = logging.getLogger(__name__)
+
+# Sizes for max_memory: a (target, probability) tuple and its slot in the
+# anchor's tuple of senses, and an empty tuple of senses.
+_SENSE_SIZE = sys.getsizeof((None, None)) + sys.getsizeof([None]) - \
+    sys.getsizeof([])
+_EMPTY_TUPLE_SIZE = sys.getsizeof(())
+
+# Rows per fetchmany call when loading a model.
+_FETCH_SIZE = 8192
 
 
 class Semanticizer(object):
@@ -20,30 +56,154 @@ class Semanticizer(object):
         Filename of the stored model from which to load the Wikipedia
         statistics. Loading is lazy; the underlying file should not be
         modified while any Semanticizer is using it.
+    cache_size : int, optional
+        If positive, ``all_candidates`` caches the candidates of up to this
+        many distinct sentences, which pays off for input that repeats
+        itself (boilerplate, quotes, retweets). See ``cache_info``.
+    max_memory : int, optional
+        Budget, in bytes, for the in-memory model as estimated by
+        ``memory_report``. Senses are loaded in order of decreasing link
+        count until the budget is used up; the rest are left out, and
+        logged. Commonness is still relative to all links of an anchor.
+    fold : boolean, optional
+        Match case- and diacritics-insensitively. An index from folded
+        anchors (see ``semanticizest._util.fold``) to the merged senses of
+        all their forms is built at load time; candidates then have the
+        commonness of those merged senses.
+    allowed_entities : {collection of string, callable}, optional
+        Restrict the model to these entities: a collection of titles, or a
+        predicate that takes a title and returns whether to keep it. Senses
+        of other entities are dropped at load time, and so are anchors left
+        without senses.
+    renormalize : boolean, optional
+        With ``allowed_entities``, make the commonness of each anchor's
+        remaining senses sum to one. By default, it is kept relative to all
+        links of the anchor, as without restriction.
+    fuzzy : boolean, optional
+        Load the fuzzy index stored next to the model by
+        ``semanticizest._fuzzy.build_fuzzy_index``, for
+        ``fuzzy_candidates``.
+    hot_anchors : int, optional
+        Keep the senses of only this many anchors in memory, in
+        ``commonness``, and look up those of the others in the stored model
+        when they occur (see ``semanticizest._tiered``). The anchors kept
+        are the ones looked up most according to `access_log`, if given,
+        and then those with the most links. Cannot be combined with
+        `max_memory` or `fold`. ``link``, ``candidate_arrays`` and
+        ``entities`` need all anchors in memory, and are not available.
+        See ``tier_info``.
+    access_log : string, optional
+        Filename of a log of anchor lookups, written by
+        ``save_access_log``. With `hot_anchors`, the anchors most looked up
+        in earlier runs are kept in memory.
+    promote_after : int, optional
+        With `hot_anchors`, keep the senses of an anchor in memory from its
+        this many-th lookup in the stored model on. None to never do so.
+    max_promoted : int, optional
+        Keep the senses of at most this many such anchors in memory,
+        demoting the least recently used ones.
 
+    Notes
+    -----
+    A Semanticizer may be shared between threads. The in-memory model is
+    never modified after construction (except for promotions with
+    `hot_anchors`, which are kept apart), and each thread that queries the
+    stored model gets its own read-only connection to it.
     """
 
-    def __init__(self, fname):
+    def __init__(self, fname, cache_size=0, max_memory=None, fold=False,
+                 allowed_entities=None, renormalize=False, fuzzy=False,
+                 hot_anchors=None, access_log=None, promote_after=2,
+                 max_promoted=10000):
         """Create a semanticizer from a stored model."""
-        commonness = defaultdict(list)
+        if hot_anchors is not None and (max_memory is not None or fold):
+            raise ValueError("hot_anchors cannot be combined with max_memory"
+                             " or fold")
 
-        self.db = sqlite3.connect(fname)
-        self._cur = self.db.cursor()
+        self._fname = fname
+        self._local = threading.local()
 
-        for target, anchor, count in self._get_senses_counts():
-            commonness[anchor].append((target, count))
+        # SQL conditions on linkstats rows for the senses to load, and for
+        # those that count towards an anchor's total.
+        self._sense_filter = self._total_filter = ''
+        allowed = None
+        if allowed_entities is not None:
+            allowed = _entity_filter(allowed_entities)
+            self.db.create_function('allowed_entity', 1, allowed)
+            self._sense_filter = ' and allowed_entity(target)'
+            if renormalize:
+                self._total_filter = self._sense_filter
 
-        for anchor, targets in six.iteritems(commonness):
-            # targets.sort(key=operator.itemgetter(1), reverse=True)
+        # Anchor lookups since loading, if they are to be logged.
+        self._access_log = access_log
+        self._access = None
+        self._access_lock = threading.Lock()
+        if access_log is not None:
+            self._access = Counter()
 
-            # Turn counts into probabilities.
-            # XXX should we preserve the counts as well?
-            total = float(sum(count for _, count in targets))
-            commonness[anchor] = [(t, count / total) for t, count in targets]
+        self._cold = None
+        if max_memory is not None:
+            self.commonness = self._load_commonness_within(max_memory)
+        elif hot_anchors is not None:
+            from semanticizest._tiered import ColdTier, read_access_log
+            logged = (read_access_log(access_log)
+                      if access_log is not None else {})
+            cold = []
+            self.commonness = self._load_commonness(
+                self._get_hot_anchors(hot_anchors, logged), cold)
+            # The predicate is kept, for the senses of cold anchors.
+            self._cold = ColdTier(cold, partial(_connect_readonly, fname),
+                                  allowed, renormalize, promote_after,
+                                  max_promoted)
+            _logger.info("Loaded %d anchors; %d more are looked up on disk",
+                         len(self.commonness), len(self._cold))
+        else:
+            self.commonness = self._load_commonness()
 
-        self.commonness = commonness
+        # The index that n-grams are looked up in.
+        self._fold = fold
+        if fold:
+            self._index = self._load_folded_index()
+        else:
+            self._index = self.commonness
         self.N = self._get_ngram_max_length()
 
+        if allowed_entities is not None:
+            # Release the predicate, and whatever it has memoized.
+            self.db.create_function('allowed_entity', 1, None)
+
+        # Term frequencies for models built with approximate counting.
+        self._tf_sketch = load_sketch(self.db, 'tf')
+
+        self._cache = LRUCache(cache_size) if cache_size > 0 else None
+
+        self._fuzzy = None
+        if fuzzy:
+            from semanticizest._fuzzy import load_fuzzy_index
+            self._fuzzy = load_fuzzy_index(fname)
+
+        # Entity ids and per-anchor arrays for candidate_arrays, and best
+        # senses for link, built on first use.
+        self._arrays = None
+        self._arrays_lock = threading.Lock()
+        self._best = None
+
+    def _thread_local(self):
+        local = self._local
+        if not hasattr(local, 'db'):
+            local.db = _connect_readonly(self._fname)
+            local.cur = local.db.cursor()
+        return local
+
+    @property
+    def db(self):
+        """The calling thread's connection to the stored model."""
+        return self._thread_local().db
+
+    @property
+    def _cur(self):
+        return self._thread_local().cur
+
     def _get_ngram_max_length(self):
         self._cur.execute("select value "
                           "from parameters "
@@ -56,10 +216,337 @@ class Semanticizer(object):
         return N
 
     def _get_senses_counts(self):
-        """Return all senses and their counts."""
-        return self._cur.execute('select target, ngram as anchor, count '
-                                 'from linkstats, ngrams '
-                                 'where ngram_id = ngrams.id;')
+        """Return all senses to load and their counts.
+
+        Senses are returned in the order of the clustered linkstats table,
+        i.e., grouped by anchor, and fetched in blocks of _FETCH_SIZE rows.
+        """
+        return _fetch_blocks(self._cur.execute(
+            'select target, ngram as anchor, count '
+            'from linkstats, ngrams '
+            'where ngram_id = ngrams.id%s '
+            'order by ngram_id;' % self._sense_filter))
+
+    def _get_anchor_totals(self, anchors=None):
+        """Return the total link count of each anchor, or of anchors.
+
+        Only anchors with senses to load are counted.
+        """
+        restrict = ''
+        if self._sense_filter != self._total_filter:
+            restrict = (' and ngram_id in (select ngram_id from linkstats '
+                        'where 1%s)' % self._sense_filter)
+        query = ('select ngram, sum(count) from linkstats, ngrams '
+                 'where ngram_id = ngrams.id%s%s%s group by ngram_id;')
+        if anchors is None:
+            return dict(self._cur.execute(query % (self._total_filter,
+                                                   restrict, '')))
+
+        anchors = list(anchors)
+        totals = {}
+        # Stay below SQLite's default limit on query parameters.
+        for k in xrange(0, len(anchors), 500):
+            chunk = anchors[k:k + 500]
+            totals.update(self._cur.execute(
+                query % (self._total_filter, restrict,
+                         ' and ngram in (%s)' % ','.join('?' * len(chunk))),
+                chunk))
+        return totals
+
+    def _get_hot_anchors(self, n, logged):
+        """The n anchors to keep in memory with hot_anchors.
+
+        These are the anchors with the most lookups in logged, a dict, and
+        then those with the most links. Logged anchors that the model does
+        not (or no longer) have senses for are passed over.
+        """
+        hot = set()
+        cur = self._cur
+        for anchor in sorted(logged, key=logged.get, reverse=True):
+            if len(hot) >= n:
+                break
+            if cur.execute('select 1 from linkstats '
+                           'where ngram_id = (select id from ngrams '
+                           '                  where ngram = ?)%s '
+                           'limit 1;' % self._sense_filter,
+                           (anchor,)).fetchone():
+                hot.add(anchor)
+        if len(hot) < n:
+            for anchor, in self._cur.execute(
+                    'select ngram from linkstats, ngrams '
+                    'where ngram_id = ngrams.id%s '
+                    'group by ngram_id order by sum(count) desc;'
+                    % self._sense_filter):
+                hot.add(anchor)
+                if len(hot) >= n:
+                    break
+        return hot
+
+    def _load_commonness(self, hot=None, cold=None):
+        """Load the senses of all anchors, or of those in hot.
+
+        The hashes of the other anchors are appended to cold, for ColdTier.
+        """
+        if hot is not None:
+            from semanticizest._tiered import anchor_hash
+
+        # Commonness relative to links to left-out entities, too.
+        totals = {}
+        if self._sense_filter != self._total_filter:
+            totals = self._get_anchor_totals(hot)
+
+        # Many senses share a target, and many a probability; keep one copy
+        # of each.
+        interned = {}
+        intern = interned.setdefault
+        commonness = {}
+
+        # Build each anchor's senses in one go as its rows come by, instead
+        # of collecting lists of counts and converting them afterwards. The
+        # collector would run over and over on the growing, all-young
+        # structure without ever finding garbage, so it is paused. Only if
+        # this is the only thread, though: pausing is process-wide, and
+        # other threads may be serving requests while a model loads in the
+        # background (see ModelRegistry and ModelHandle).
+        gc_enabled = gc.isenabled() and threading.active_count() == 1
+        if gc_enabled:
+            gc.disable()
+        try:
+            for anchor, rows in groupby(self._get_senses_counts(),
+                                        itemgetter(1)):
+                if hot is not None and anchor not in hot:
+                    cold.append(anchor_hash(anchor))
+                    continue
+                rows = list(rows)
+                # XXX should we preserve the counts as well?
+                total = float(totals.get(anchor) or
+                              sum([count for _, _, count in rows]))
+                commonness[anchor] = tuple([
+                    (intern(target, target), intern(count / total,
+                                                     count / total))
+                    for target, _, count in rows])
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+        return commonness
+
+    def _load_commonness_within(self, max_memory):
+        """Load the most linked senses that fit in max_memory bytes."""
+        getsizeof = sys.getsizeof
+        interned = {}
+        commonness = {}
+        used = n_senses = n_links = 0
+
+        for target, anchor, count, total in self._cur.execute(
+                'select target, ngram, count, (select sum(count) '
+                '                              from linkstats '
+                '                              where ngram_id = ngrams.id%s) '
+                'from linkstats as l, ngrams '
+                'where l.ngram_id = ngrams.id%s '
+                'order by count desc, l.ngram_id, l.target;'
+                % (self._total_filter,
+                   self._sense_filter.replace('target', 'l.target'))):
+            p = count / float(total)
+            size = _SENSE_SIZE
+            if target not in interned:
+                size += getsizeof(target)
+            if p not in interned:
+                size += getsizeof(p)
+            if anchor in commonness:
+                senses = commonness[anchor]
+            else:
+                size += getsizeof(anchor) + _EMPTY_TUPLE_SIZE
+                senses = commonness[anchor] = []
+            if used + size + getsizeof(commonness) > max_memory:
+                if not senses:
+                    del commonness[anchor]
+                break
+
+            used += size
+            n_senses += 1
+            n_links += count
+            senses.append((interned.setdefault(target, target),
+                           interned.setdefault(p, p)))
+        else:
+            count = None
+
+        if count is not None:
+            all_senses, all_links, all_anchors = self._cur.execute(
+                'select count(*), sum(count), count(distinct ngram_id) '
+                'from linkstats where 1%s;' % self._sense_filter).fetchone()
+            _logger.warning("max_memory=%d: left out %d of %d senses and %d"
+                            " of %d anchors, with %.1f%% of all links;"
+                            " the link count of left-out senses is at most %d",
+                            max_memory, all_senses - n_senses, all_senses,
+                            all_anchors - len(commonness), all_anchors,
+                            100. * (all_links - n_links) / all_links, count)
+
+        # Same order of senses as when loading everything.
+        return dict((anchor, tuple(sorted(senses)))
+                    for anchor, senses in six.iteritems(commonness))
+
+    def _load_folded_index(self):
+        """Merge the senses of anchors that are equal after folding."""
+        commonness = self.commonness
+        forms = defaultdict(list)
+        for anchor in commonness:
+            forms[fold(anchor)].append(anchor)
+
+        folded = {}
+        to_merge = {}
+        for key, anchors in six.iteritems(forms):
+            if len(anchors) == 1:
+                # Nothing to merge; share senses (and key) with commonness.
+                anchor = anchors[0]
+                folded[anchor if anchor == key else key] = commonness[anchor]
+            else:
+                to_merge[key] = anchors
+        if not to_merge:
+            return folded
+
+        # Merge link counts, which are commonness times the anchor's total.
+        needed = set(a for anchors in six.itervalues(to_merge)
+                     for a in anchors)
+        totals = self._get_anchor_totals(needed)
+
+        interned = {}
+        for key, anchors in six.iteritems(to_merge):
+            counts = {}
+            for anchor in anchors:
+                total = totals[anchor]
+                for t, p in commonness[anchor]:
+                    counts[t] = counts.get(t, 0) + int(round(p * total))
+                if anchor == key:
+                    # Share the string with commonness.
+                    key = anchor
+            total = float(sum(totals[anchor] for anchor in anchors))
+            folded[key] = tuple((t, interned.setdefault(c / total, c / total))
+                                for t, c in sorted(six.iteritems(counts)))
+        return folded
+
+    def link_probability(self, ngram):
+        """Estimate the link probability of an n-gram.
+
+        This is the number of times `ngram` is used as the anchor text of a
+        link, divided by the number of times it occurs in Wikipedia. For
+        models built with approximate n-gram counting, the latter number
+        comes from a count-min sketch and may be an overestimate.
+
+        Parameters
+        ----------
+        ngram : string
+
+        Returns
+        -------
+        p : float or None
+            Link probability, or None if the model has no count for `ngram`,
+            e.g., because it is longer than the model's N.
+        """
+        row = self._cur.execute('select tf, (select sum(count) '
+                                '            from linkstats '
+                                '            where ngram_id = ngrams.id) '
+                                'from ngrams where ngram = ?;',
+                                (ngram,)).fetchone()
+        tf, links = row or (0, None)
+        if self._tf_sketch is not None:
+            tf = self._tf_sketch[ngram]
+        if not tf:
+            return None
+        # The tokenizer may not find all anchors in the running text.
+        return min(1., (links or 0) / float(tf))
+
+    def relatedness(self, a, b):
+        """Milne-Witten relatedness of two entities.
+
+        This is one minus the normalized distance between the sets of
+        articles that link to `a` and to `b` (Milne and Witten, 2008).
+        The model must have been built with ``link_graph=True``.
+
+        Parameters
+        ----------
+        a, b : string
+            Entity titles.
+
+        Returns
+        -------
+        r : float
+            Relatedness between 0 and 1. Zero if no article links to both.
+        """
+        inlinks = self._get_inlinks([a, b])
+        in_a, in_b = inlinks.get(a, ()), inlinks.get(b, ())
+        return _milne_witten(len(in_a), len(in_b),
+                             _intersection_size(in_a, in_b),
+                             self._log_n_articles())
+
+    def relatedness_matrix(self, entities):
+        """Milne-Witten relatedness of all pairs of entities.
+
+        Equivalent to calling ``relatedness`` for every pair, but the
+        inlinks of each entity are fetched and indexed only once. Use this
+        to score the candidates of a document, e.g.::
+
+            entities = sorted(set(e for _, _, e, _ in sem.all_candidates(d)))
+            r = sem.relatedness_matrix(entities)
+
+        Parameters
+        ----------
+        entities : sequence of string
+            Entity titles.
+
+        Returns
+        -------
+        r : list of list of float
+            Symmetric matrix; ``r[i][j]`` is the relatedness of
+            ``entities[i]`` and ``entities[j]``.
+        """
+        entities = tosequence(entities)
+        log_w = self._log_n_articles()
+        inlinks = self._get_inlinks(entities)
+        # Sets, rather than _intersection_size on the sorted arrays: they
+        # take up to ten times the memory while the matrix is computed,
+        # but intersect in C, several times faster even counting the time
+        # to build them (see benchmarks/bench_relatedness.py).
+        sets = [frozenset(inlinks.get(e, ())) for e in entities]
+
+        n = len(entities)
+        r = [[0.] * n for _ in xrange(n)]
+        for i in xrange(n):
+            in_i = sets[i]
+            r[i][i] = 1. if in_i else 0.
+            for j in xrange(i):
+                in_j = sets[j]
+                r[i][j] = r[j][i] = _milne_witten(len(in_i), len(in_j),
+                                                  len(in_i & in_j), log_w)
+        return r
+
+    def _get_inlinks(self, entities):
+        """Map entities to the sorted ids of the articles linking to them.
+
+        Entities without inlinks are left out.
+        """
+        entities = list(set(entities))
+        inlinks = {}
+        # Stay below SQLite's default limit on query parameters.
+        for k in xrange(0, len(entities), 500):
+            chunk = entities[k:k + 500]
+            inlinks.update((target, ids_frombytes(sources))
+                           for target, sources in self._cur.execute(
+                               'select target, sources from inlinks '
+                               'where target in (%s);'
+                               % ','.join('?' * len(chunk)), chunk))
+        return inlinks
+
+    def _log_n_articles(self):
+        if not hasattr(self, '_log_articles'):
+            params = dict(self._cur.execute(
+                "select key, value from parameters "
+                "where key in ('link_graph', 'articles');"))
+            if 'link_graph' not in params:
+                raise ValueError("model %r was built without link graph"
+                                 % self._fname)
+            self._log_articles = log(int(params['articles']))
+        return self._log_articles
 
     def all_candidates(self, s):
         """Retrieve all candidate entities from a piece of text.
@@ -67,7 +554,8 @@ class Semanticizer(object):
         Parameters
         ----------
         s : {string, iterable over string}
-            Tokens. If a string, it will be tokenized using a naive heuristic.
+            Tokens. If a string, it is split into runs of word characters,
+            as the text of Wikipedia was when the model was built.
 
         Returns
         -------
@@ -76,21 +564,645 @@ class Semanticizer(object):
             `end` (both in tokenized input, and both start at 1),
             `target entity` (title of the Wikipedia article) and
             `probability` (commonness.)
+
+        See Also
+        --------
+        char_candidates : for character offsets into a string.
+        """
+
+        ends = None
+        if isinstance(s, six.string_types):
+            if self._cache is None:
+                s = tokenize(s)
+            else:
+                # Tokens have no punctuation left to find sentences by.
+                text = s
+                s, starts, token_ends = tokenize_with_offsets(text)
+                ends = text_sentence_ends(text, starts, token_ends)
+        else:
+            s = tosequence(s)
+        if self._fold:
+            s = [fold(t) for t in s]
+
+        if self._cache is None:
+            return self._candidates(s)
+        return self._cached_candidates(s, ends)
+
+    def char_candidates(self, text):
+        """Retrieve all candidate entities from a string, by character span.
+
+        The text is tokenized as by ``all_candidates``, keeping the offsets
+        of the tokens, so the spans need no aligning with the text.
+
+        Returns
+        -------
+        candidates : list of (int, int, string, float)
+            As for ``all_candidates``, but `start` and `end` are character
+            offsets, such that ``text[start:end]`` is the anchor as it
+            occurs in text.
+        """
+        tokens, starts, ends = tokenize_with_offsets(text)
+        if self._fold:
+            tokens = [fold(t) for t in tokens]
+
+        if self._cache is None:
+            candidates = self._candidates(tokens)
+        else:
+            candidates = self._cached_candidates(
+                tokens, text_sentence_ends(text, starts, ends))
+        return [(starts[i], ends[j - 1], target, prob)
+                for i, j, target, prob in candidates]
+
+    def fuzzy_candidates(self, s, max_distance=None):
+        """Retrieve candidate entities, allowing for misspelled anchors.
+
+        N-grams that are anchors give the same candidates as with
+        ``all_candidates``. Other n-grams give the senses of the anchors
+        within edit distance `max_distance` of them, if they have at least
+        four characters per edit. Requires ``fuzzy=True``. With `fold`,
+        n-grams and the anchors found for them are folded before their
+        senses are looked up, as in ``all_candidates``; edit distances are
+        between the n-grams and anchors as they are.
+
+        Parameters
+        ----------
+        s : {string, iterable over string}
+            Tokens, as for ``all_candidates``.
+        max_distance : int, optional
+            Maximum edit distance; defaults to, and may not be more than,
+            that of the fuzzy index.
+
+        Returns
+        -------
+        candidates : iterable over (int, int, string, float, int)
+            As for ``all_candidates``, with the edit distance between the
+            n-gram and the anchor added.
+        """
+        index = self._fuzzy
+        if index is None:
+            raise ValueError("fuzzy index not loaded; use fuzzy=True")
+        if max_distance is None:
+            max_distance = index.max_distance
+        if isinstance(s, six.string_types):
+            s = tokenize(s)
+        return self._fuzzy_candidates(tosequence(s), max_distance)
+
+    def _fuzzy_candidates(self, tokens, max_distance):
+        from semanticizest._fuzzy import CHARS_PER_EDIT
+
+        index = self._fuzzy
+        lookup = self._lookup
+        if self._fold:
+            def lookup(ngram):
+                return self._lookup(fold(ngram))
+        for i, j, ngram in ngrams_with_pos(tokens, self.N):
+            senses = lookup(ngram)
+            if senses is not None:
+                for target, prob in senses:
+                    yield i, j, target, prob, 0
+                continue
+            d = min(max_distance, len(ngram) // CHARS_PER_EDIT)
+            if d == 0:
+                continue
+            for anchor, distance in index.lookup(ngram, d):
+                for target, prob in lookup(anchor) or ():
+                    yield i, j, target, prob, distance
+
+    def _candidates(self, tokens):
+        if self._cold is not None or self._access is not None:
+            for i, j, senses in self._find(ngrams_with_pos(tokens, self.N)):
+                for target, prob in senses:
+                    yield i, j, target, prob
+            return
+
+        index = self._index
+        for i, j, s in ngrams_with_pos(tokens, self.N):
+            if s in index:
+                for target, prob in index[s]:
+                    yield i, j, target, prob
+
+    def _find(self, ngrams):
+        """Senses of the anchors among ngrams, from memory or from disk.
+
+        Like ``_lookup`` for each (start, end, n-gram) in ngrams, but
+        without a call per n-gram; generates (start, end, senses).
+        """
+        index = self._index
+        counting = self._access is not None
+        access_lock = self._access_lock
+        cold = self._cold
+        if cold is not None:
+            bits, mask, cold_get = cold.bits, cold.mask, cold.get
+        for i, j, s in ngrams:
+            senses = index.get(s)
+            if senses is None:
+                if cold is None:
+                    continue
+                # Most n-grams are not anchors; rule them out quickly.
+                b = hash(s) & mask
+                if not bits[b >> 3] & (1 << (b & 7)):
+                    continue
+                senses = cold_get(s)
+                if senses is None:
+                    continue
+            if counting:
+                # save_access_log may have swapped the Counter.
+                with access_lock:
+                    self._access[s] += 1
+            yield i, j, senses
+
+    def _lookup(self, s):
+        """Senses of the n-gram s, or None, from memory or from disk.
+
+        Lookups are counted for the access log, if there is one.
+        """
+        senses = self._index.get(s)
+        if senses is None and self._cold is not None:
+            senses = self._cold.get(s)
+        if senses is not None and self._access is not None:
+            with self._access_lock:
+                self._access[s] += 1
+        return senses
+
+    def _cached_candidates(self, tokens, ends=None):
+        """all_candidates, looking up sentences in the cache.
+
+        Candidates that span a sentence boundary are found separately, so
+        the result is the same as without caching. The sentences end at
+        ends, if given, else where ``sentence_ends`` says.
+        """
+        cache = self._cache
+        n = self._window_size()
+        candidates = []
+        prev = start = 0
+        if ends is None:
+            ends = sentence_ends(tokens)
+        for end in ends:
+            if start > 0:
+                crossing = list(self._crossing_candidates(tokens, prev, start,
+                                                          n))
+                if crossing:
+                    # Only the candidates starting at most n - 1 tokens
+                    # before the boundary need to be merged with these.
+                    k = len(candidates)
+                    while k > 0 and candidates[k - 1][0] > start - n:
+                        k -= 1
+                    candidates[k:] = sorted(candidates[k:] + crossing,
+                                            key=lambda c: (c[0], c[1]))
+
+            sentence = tuple(tokens[start:end])
+            found = cache.get(sentence)
+            if found is None:
+                found = tuple(self._candidates(sentence))
+                cache.put(sentence, found)
+            if start == 0:
+                candidates.extend(found)
+            else:
+                candidates.extend([(i + start, j + start, target, prob)
+                                   for i, j, target, prob in found])
+            prev, start = start, end
+
+        return iter(candidates)
+
+    def _crossing_candidates(self, tokens, start, boundary, n):
+        """Candidates of at most n tokens that cross boundary.
+
+        Only spans that begin in the sentence tokens[start:boundary] are
+        considered, so that a span crossing several boundaries is found once.
         """
+        join = " ".join
+        spans = ((i, j, join(tokens[i:j]))
+                 for i in xrange(max(start, boundary - n + 1), boundary)
+                 for j in xrange(boundary + 1, min(i + n, len(tokens)) + 1))
+        for i, j, senses in self._find(spans):
+            for target, prob in senses:
+                yield i, j, target, prob
 
+    def link(self, s, min_commonness=0., min_link_probability=None):
+        """Link non-overlapping spans of text to their most common sense.
+
+        Scanning from left to right, the longest anchor starting at each
+        position is linked, and scanning continues after it. Unlike
+        ``all_candidates``, this gives at most one entity per token.
+
+        Parameters
+        ----------
+        s : {string, iterable over string}
+            Tokens, as for ``all_candidates``.
+        min_commonness : float, optional
+            Only link anchors whose most common sense has at least this
+            commonness.
+        min_link_probability : float, optional
+            Only link anchors with at least this link probability (see
+            ``link_probability``). This takes a lookup in the stored model
+            per anchor that passes the other criteria.
+
+        Returns
+        -------
+        links : list of (int, int, string, float)
+            Spans and their senses, as in ``all_candidates``, in order.
+        """
         if isinstance(s, six.string_types):
-            # XXX need a smarter tokenizer!
-            s = s.split()
+            s = tokenize(s)
         else:
             s = tosequence(s)
+        if self._fold:
+            s = [fold(t) for t in s]
+
+        best, max_length = self._get_best()
+        join = " ".join
+        links = []
+        n = len(s)
+        i = 0
+        while i < n:
+            # Longest anchor length starting with this token, if any.
+            j = i + max_length.get(s[i], 0)
+            if j > n:
+                j = n
+            while j > i:
+                anchor = join(s[i:j])
+                sense = best.get(anchor)
+                if sense is not None and sense[1] >= min_commonness and (
+                        min_link_probability is None or
+                        (self.link_probability(anchor) or 0.) >=
+                        min_link_probability):
+                    links.append((i, j, sense[0], sense[1]))
+                    break
+                j -= 1
+            i = j if j > i else i + 1
+        return links
+
+    def _get_best(self):
+        """Most common sense of each anchor, and longest anchor length (in
+        tokens) per first token, for link."""
+        self._check_all_in_memory()
+        if self._best is None:
+            with self._arrays_lock:
+                if self._best is None:
+                    best = {}
+                    max_length = {}
+                    # Like all_candidates, look at n-grams up to N only.
+                    N = self.N or float('inf')
+                    for anchor, senses in six.iteritems(self._index):
+                        # Ties go to the first, i.e., smallest, title.
+                        best[anchor] = max(senses, key=lambda s: s[1])
+                        tokens = anchor.split(' ')
+                        first = tokens[0]
+                        length = min(len(tokens), N)
+                        if length > max_length.get(first, 0):
+                            max_length[first] = length
+                    self._best = best, max_length
+        return self._best
+
+    def candidate_arrays(self, docs, out=None):
+        """Retrieve all candidate entities from a batch of documents.
+
+        Unlike ``all_candidates``, this does not make a tuple per
+        candidate, but appends to parallel arrays. Use the writers in
+        ``semanticizest.output`` to serialize them.
+
+        Parameters
+        ----------
+        docs : iterable over {string, iterable over string}
+            Documents, each tokens as for ``all_candidates``.
+        out : CandidateArrays, optional
+            Arrays to append to; document indices continue from
+            ``out.n_docs``.
+
+        Returns
+        -------
+        candidates : CandidateArrays
+            Entities are given as ids, i.e., indices into ``entities``.
+        """
+        if out is None:
+            out = CandidateArrays()
+        senses = self._get_arrays()[1]
+        doc, start, end = out.doc, out.start, out.end
+        entity, prob = out.entity, out.prob
+
+        n = out.n_docs
+        for d in docs:
+            if isinstance(d, six.string_types):
+                d = tokenize(d)
+            else:
+                d = tosequence(d)
+            if self._fold:
+                d = [fold(t) for t in d]
+            for i, j, s in ngrams_with_pos(d, self.N):
+                found = senses.get(s)
+                if found is None:
+                    continue
+                ids, probs = found
+                entity.extend(ids)
+                prob.extend(probs)
+                k = len(ids)
+                if k == 1:
+                    doc.append(n)
+                    start.append(i)
+                    end.append(j)
+                else:
+                    doc.extend(repeat(n, k))
+                    start.extend(repeat(i, k))
+                    end.extend(repeat(j, k))
+            n += 1
+        out.n_docs = n
+
+        return out
+
+    @property
+    def entities(self):
+        """Titles of the entities in the model, indexed by entity id.
+
+        Ids are assigned in sorted order of title, so they depend only on
+        the stored model.
+        """
+        return self._get_arrays()[0]
+
+    def _get_arrays(self):
+        self._check_all_in_memory()
+        if self._arrays is None:
+            with self._arrays_lock:
+                if self._arrays is None:
+                    entities = sorted(set(t for senses in
+                                          six.itervalues(self._index)
+                                          for t, _ in senses))
+                    ids = dict((t, i) for i, t in enumerate(entities))
+                    senses = dict((anchor, (array('i', [ids[t] for t, _ in s]),
+                                            array('d', [p for _, p in s])))
+                                  for anchor, s in
+                                  six.iteritems(self._index))
+                    self._arrays = entities, senses
+        return self._arrays
+
+    def _check_all_in_memory(self):
+        if self._cold is not None:
+            raise ValueError("not available with hot_anchors, since it"
+                             " needs all anchors in memory")
+
+    def memory_report(self):
+        """Estimate the memory used by the in-memory model.
+
+        Returns
+        -------
+        report : dict
+            Bytes used by the anchor strings (``anchors``), the sense tuples
+            and probabilities (``senses``), the target titles (``targets``)
+            and the dict holding it all (``containers``), as well as by the
+            folded index (``folded``, beyond what it shares), the
+            ``entities`` index, per-anchor arrays and best senses for
+            ``link`` (``arrays``), if they have been built, the sentence
+            cache (``cache``), the n-gram count sketch (``sketch``), the
+            fuzzy index (``fuzzy``) and, with `hot_anchors`, the index of
+            anchors on disk and the senses promoted from there (``cold``),
+            and the ``total``.
+        """
+        getsizeof = sys.getsizeof
+        anchors = senses = targets = 0
+        seen = set()
+        for anchor, cands in six.iteritems(self.commonness):
+            anchors += getsizeof(anchor)
+            senses += getsizeof(cands)
+            for sense in cands:
+                senses += getsizeof(sense)
+                t, p = sense
+                if id(p) not in seen:
+                    seen.add(id(p))
+                    senses += getsizeof(p)
+                if id(t) not in seen:
+                    seen.add(id(t))
+                    targets += getsizeof(t)
+
+        folded = 0
+        if self._index is not self.commonness:
+            commonness = self.commonness
+            shared = set(id(cands) for cands in six.itervalues(commonness))
+            folded = getsizeof(self._index)
+            for key, cands in six.iteritems(self._index):
+                if key not in commonness:
+                    folded += getsizeof(key)
+                if id(cands) in shared:
+                    continue
+                folded += getsizeof(cands)
+                for sense in cands:
+                    folded += getsizeof(sense)
+                    if id(sense[1]) not in seen:
+                        seen.add(id(sense[1]))
+                        folded += getsizeof(sense[1])
+
+        arrays = 0
+        if self._arrays is not None:
+            entities, sense_arrays = self._arrays
+            arrays = getsizeof(entities) + getsizeof(sense_arrays)
+            for found in six.itervalues(sense_arrays):
+                ids, probs = found
+                arrays += getsizeof(found) + getsizeof(ids) + getsizeof(probs)
+        if self._best is not None:
+            best, max_length = self._best
+            arrays += getsizeof(best) + getsizeof(max_length)
+            arrays += sum(getsizeof(first) for first in max_length)
 
-        for i, j, s in ngrams_with_pos(s, self.N):
-            if s in self.commonness:
-                for target, prob in self.commonness[s]:
+        report = {'anchors': anchors,
+                  'senses': senses,
+                  'targets': targets,
+                  'containers': getsizeof(self.commonness),
+                  'folded': folded,
+                  'arrays': arrays,
+                  'cache': self.cache_info().nbytes,
+                  'sketch': (self._tf_sketch.nbytes
+                             if self._tf_sketch is not None else 0),
+                  'fuzzy': (self._fuzzy.nbytes
+                            if self._fuzzy is not None else 0),
+                  'cold': (self._cold.nbytes
+                           if self._cold is not None else 0)}
+        report['total'] = sum(six.itervalues(report))
+        return report
+
+    def cache_info(self):
+        """Statistics of the sentence cache used by ``all_candidates``.
+
+        Returns
+        -------
+        info : CacheInfo
+            Named tuple of the number of cache ``hits`` and ``misses``, the
+            ``maxsize`` and current size (``currsize``) in sentences, and
+            an estimate of the memory used by the cache (``nbytes``).
+            All zero if the cache is disabled.
+        """
+        if self._cache is None:
+            return CacheInfo(0, 0, 0, 0, 0)
+        return self._cache.info()
+
+    def tier_info(self):
+        """Statistics of the anchors in memory and on disk.
+
+        Returns
+        -------
+        info : TierInfo
+            Named tuple of the number of anchors in memory (``hot``) and on
+            disk (``cold``), the number of ``promoted`` ones and of those
+            ``demoted`` again to stay within `max_promoted`, the number of
+            lookups of promoted anchors (``hits``) and of anchors on disk
+            (``lookups``), and the estimated memory used for anchors on
+            disk (``nbytes``). Without `hot_anchors`, all anchors are hot.
+        """
+        if self._cold is None:
+            from semanticizest._tiered import TierInfo
+            return TierInfo(len(self.commonness), 0, 0, 0, 0, 0, 0)
+        return self._cold.info(len(self.commonness))
+
+    def save_access_log(self):
+        """Add the anchor lookups since loading to the access log.
+
+        Only lookups by ``all_candidates``, ``char_candidates``,
+        ``stream_candidates`` and ``fuzzy_candidates`` are counted. Requires
+        `access_log`.
+        """
+        from semanticizest._tiered import read_access_log, write_access_log
+
+        if self._access_log is None:
+            raise ValueError("no access log; use access_log=filename")
+        with self._access_lock:
+            access, self._access = self._access, Counter()
+        counts = read_access_log(self._access_log)
+        counts.update(access)
+        write_access_log(self._access_log, counts)
+
+    def stream_candidates(self, s):
+        """Retrieve all candidate entities from a stream of tokens.
+
+        Like ``all_candidates``, but consumes its input lazily, keeping only
+        a window of the last `N` tokens in memory. Candidates are produced
+        as soon as their span is complete, so this is suitable for unbounded
+        input such as book-length texts or log streams.
+
+        Parameters
+        ----------
+        s : {string, iterable over string}
+            Tokens. If a string, it will be tokenized lazily, as by
+            ``all_candidates``.
+
+        Returns
+        -------
+        candidates : iterable over (int, int, string, float)
+            Same as ``all_candidates``, in the same order.
+        """
+
+        if isinstance(s, six.string_types):
+            s = iter_tokens(s)
+        if self._fold:
+            s = (fold(t) for t in s)
+
+        if self._cold is not None or self._access is not None:
+            for i, j, senses in self._find(
+                    ngrams_with_pos_iter(s, self._window_size())):
+                for target, prob in senses:
+                    yield i, j, target, prob
+            return
+
+        index = self._index
+        for i, j, s in ngrams_with_pos_iter(s, self._window_size()):
+            if s in index:
+                for target, prob in index[s]:
                     yield i, j, target, prob
 
+    def _window_size(self):
+        """Window size for stream_candidates.
+
+        This is N, or if the model was built without n-gram counts, the
+        length in tokens of the longest anchor.
+        """
+        if self.N is not None:
+            return self.N
+        if not hasattr(self, '_max_anchor_length'):
+            if self._cold is not None:
+                longest, = self._cur.execute(
+                    "select max(length(ngram) - length(replace(ngram, ' ',"
+                    " ''))) + 1 from ngrams "
+                    "where id in (select ngram_id from linkstats);").fetchone()
+                self._max_anchor_length = longest or 1
+            else:
+                self._max_anchor_length = max([len(anchor.split())
+                                               for anchor in self._index]
+                                              or [1])
+        return self._max_anchor_length
+
+
+def _intersection_size(a, b):
+    """Number of items in both of the sorted sequences a and b."""
+    if len(a) > len(b):
+        a, b = b, a
+    if len(a) * 16 >= len(b):
+        return len(set(a).intersection(b))
+
+    # Binary search for the few items of a in b.
+    n = i = 0
+    hi = len(b)
+    for x in a:
+        i = bisect_left(b, x, i)
+        if i == hi:
+            break
+        if b[i] == x:
+            n += 1
+    return n
+
+
+def _milne_witten(n_a, n_b, n_common, log_w):
+    """Relatedness from inlink counts and log of the number of articles."""
+    if n_common == 0:
+        return 0.
+    smaller, larger = min(n_a, n_b), max(n_a, n_b)
+    if log(smaller) >= log_w:
+        return 1.
+    distance = (log(larger) - log(n_common)) / (log_w - log(smaller))
+    return max(0., 1. - distance)
+
+
+def _entity_filter(allowed):
+    """Predicate on titles for Semanticizer's allowed_entities."""
+    if not callable(allowed):
+        return frozenset(allowed).__contains__
 
-def create_model(dump, db_file=':memory:', N=2):
+    # Called per sense, but many senses share a target.
+    keep = {}
+
+    def allowed_entity(title):
+        k = keep.get(title)
+        if k is None:
+            k = keep[title] = bool(allowed(title))
+        return k
+    return allowed_entity
+
+
+def _fetch_blocks(cursor, size=_FETCH_SIZE):
+    """Iterate over the rows of cursor, fetching size rows at a time."""
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            return
+        for row in rows:
+            yield row
+
+
+# Memory-map up to this many bytes of a stored model, so that threads and
+# processes using the same model share its pages through the OS page cache.
+_MMAP_SIZE = 1 << 30
+
+
+def _connect_readonly(fname):
+    """Open a read-only connection to an SQLite model file."""
+    if six.PY3 and fname != ':memory:':
+        # immutable=1 disables locking and change detection; the file must
+        # not be modified while it is in use (see Semanticizer).
+        uri = 'file:%s?mode=ro&immutable=1' % pathname2url(abspath(fname))
+        db = sqlite3.connect(uri, uri=True)
+    else:
+        db = sqlite3.connect(fname)
+    db.execute('pragma mmap_size = %d' % _MMAP_SIZE)
+    db.execute('pragma query_only = 1')
+    return db
+
+
+def create_model(dump, db_file=':memory:', N=2, **kwargs):
     """Create a semanticizer model from a wikidump and store it in a DB.
 
     Parameters
@@ -103,24 +1215,30 @@ def create_model(dump, db_file=':memory:', N=2):
        db will be created, otherwise it is the filename of the
        disk-based db.
 
+    Further keyword arguments are passed to ``parse_dump``.
+
     Returns
     ------
     db : sqlite3.Connection
         The handle to the newly created db containing the model.
     """
     db = sqlite3.connect(db_file)
-    _parse_stuff_to_db(dump, db, N=N)
+    _parse_stuff_to_db(dump, db, N=N, **kwargs)
     return db
 
 
-def _parse_stuff_to_db(fname, db, N=2):
+def _parse_stuff_to_db(fname, db, N=2, **kwargs):
     """Parses a wikidump, stores the model supplied db."""
+    # The dump parser is only needed for building models, so it is not
+    # imported along with the Semanticizer.
+    from semanticizest.parse_wikidump import parse_dump
+
     cur = db.cursor()
     with open(createtables_path()) as create:
         cur.executescript(create.read())
     dump = join(dirname(abspath(__file__)),
                 fname)
-    parse_dump(dump, db, N=N)
+    parse_dump(dump, db, N=N, **kwargs)
 
     return db
 
@@ -0,0 +1,237 @@
+"""Anchors of a stored model that are looked up on disk, not in memory.
+
+Lookups follow a Zipf distribution: a small part of the anchors of a
+model is looked up most of the time. A semanticizer with ``hot_anchors``
+keeps only that part in memory, and leaves the long tail of the model on
+disk, where ``ColdTier`` finds it through the unique index on the n-gram
+text.
+
+Most n-grams of running text are not anchors at all, and should not cost
+a query each. So the cold anchors are also held in memory, as a sorted
+array of their hashes, at 4 bytes per anchor; only n-grams whose hash is
+in it are looked up on disk. A hash collision only costs a query that
+finds nothing. A bitset of 16 bits per anchor rules out most other n-grams
+without a binary search. Hashes are those of Python strings, which are
+computed once per string, and are never stored: they may differ between
+processes.
+
+Cold anchors that keep being looked up are promoted: their senses are
+then kept in memory, too, up to a maximum number of anchors; beyond that,
+the least recently used promoted anchor is demoted again. Lookup counts of
+anchors not (yet) promoted are halved when there are too many of them, so
+that anchors looked up only now and then are forgotten.
+"""
+
+from array import array
+from bisect import bisect_left
+from collections import Counter, namedtuple, OrderedDict
+import io
+import logging
+import os
+import sys
+import threading
+
+import six
+
+
+_logger = logging.getLogger(__name__)
+
+
+TierInfo = namedtuple('TierInfo',
+                      'hot cold promoted demoted hits lookups nbytes')
+
+
+class ColdTier(object):
+    """Anchors of a stored model that are looked up on disk.
+
+    Parameters
+    ----------
+    hashes : iterable over int
+        Hashes (see ``anchor_hash``) of the cold anchors.
+    connect : callable
+        Returns a new connection to the stored model. Each thread that
+        looks up anchors gets its own.
+    allowed : callable, optional
+        Predicate on target titles; other senses are dropped.
+    renormalize : boolean, optional
+        With allowed, make commonness relative to the allowed senses only.
+    promote_after : int, optional
+        Keep the senses of an anchor in memory once it has been looked up
+        on disk this many times. None to never do so.
+    max_promoted : int, optional
+        Maximum number of promoted anchors; the least recently used is
+        demoted to make room for another. Lookup counts are kept for at
+        most four times as many anchors not promoted.
+    """
+
+    def __init__(self, hashes, connect, allowed=None, renormalize=False,
+                 promote_after=None, max_promoted=10000):
+        if max_promoted < 1:
+            raise ValueError("max_promoted should be at least 1, got %r"
+                             % max_promoted)
+        hashes = array('I', sorted(hashes))
+        self._hashes = hashes
+
+        # One bit per hash value modulo a power of two, at least 16 * n.
+        # Public, so that callers can test many n-grams without a call.
+        size = 16
+        while size < 2 * len(hashes):
+            size *= 2
+        self.mask = 8 * size - 1
+        bits = bytearray(size)
+        for h in hashes:
+            h &= self.mask
+            bits[h >> 3] |= 1 << (h & 7)
+        self.bits = bits
+
+        self._connect = connect
+        self._local = threading.local()
+        self._allowed = allowed
+        self._renormalize = renormalize
+        self.promote_after = promote_after
+        self.max_promoted = max_promoted
+
+        # Promoted anchors, least recently used first.
+        self._promoted = OrderedDict()
+        # Disk lookups of anchors not promoted.
+        self._lookups = Counter()
+        self._lock = threading.Lock()
+        self.hits = self.lookups = self.demoted = 0
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def get(self, anchor):
+        """Senses of anchor, as in ``Semanticizer.commonness``, or None."""
+        h = anchor_hash(anchor)
+        b = h & self.mask
+        if not self.bits[b >> 3] & (1 << (b & 7)):
+            return None
+
+        if self._promoted:
+            with self._lock:
+                senses = self._promoted.pop(anchor, None)
+                if senses is not None:
+                    self._promoted[anchor] = senses
+                    self.hits += 1
+                    return senses
+
+        hashes = self._hashes
+        k = bisect_left(hashes, h)
+        if k == len(hashes) or hashes[k] != h:
+            return None
+
+        senses = self._load(anchor)
+        with self._lock:
+            self.lookups += 1
+            if senses is None or self.promote_after is None:
+                return senses
+            lookups = self._lookups
+            n = lookups[anchor] = lookups[anchor] + 1
+            if n >= self.promote_after:
+                del lookups[anchor]
+                self._promote(anchor, senses)
+            elif len(lookups) > 4 * self.max_promoted:
+                self._decay()
+        return senses
+
+    def _decay(self):
+        """Halve lookup counts until at most 2 * max_promoted are left.
+
+        Must be called with the lock held.
+        """
+        lookups = self._lookups
+        while len(lookups) > 2 * self.max_promoted:
+            lookups = Counter(dict((a, k // 2) for a, k
+                                   in six.iteritems(lookups) if k > 1))
+        self._lookups = lookups
+
+    def _promote(self, anchor, senses):
+        """Keep senses in memory. Must be called with the lock held."""
+        promoted = self._promoted
+        promoted.pop(anchor, None)
+        if len(promoted) >= self.max_promoted:
+            promoted.popitem(last=False)
+            self.demoted += 1
+        promoted[anchor] = senses
+
+    def _load(self, anchor):
+        local = self._local
+        if not hasattr(local, 'cur'):
+            local.cur = self._connect().cursor()
+        rows = local.cur.execute(
+            'select target, count from linkstats '
+            'where ngram_id = (select id from ngrams where ngram = ?) '
+            'order by target;', (anchor,)).fetchall()
+        if not rows:
+            return None
+        total = float(sum(count for _, count in rows))
+        allowed = self._allowed
+        if allowed is not None:
+            rows = [(t, count) for t, count in rows if allowed(t)]
+            if not rows:
+                return None
+            if self._renormalize:
+                total = float(sum(count for _, count in rows))
+        return tuple((t, count / total) for t, count in rows)
+
+    @property
+    def nbytes(self):
+        """Estimated memory use."""
+        getsizeof = sys.getsizeof
+        with self._lock:
+            promoted = list(six.iteritems(self._promoted))
+            n_lookups = len(self._lookups)
+        # Roughly 100 bytes per lookup count.
+        nbytes = (self._hashes.itemsize * len(self._hashes) +
+                  len(self.bits) + getsizeof(self._promoted) +
+                  n_lookups * 100)
+        for anchor, senses in promoted:
+            nbytes += getsizeof(anchor) + getsizeof(senses)
+            for sense in senses:
+                nbytes += getsizeof(sense) + getsizeof(sense[1])
+        return nbytes
+
+    def info(self, hot):
+        with self._lock:
+            promoted, demoted, hits, lookups = (len(self._promoted),
+                                                self.demoted, self.hits,
+                                                self.lookups)
+        return TierInfo(hot, len(self._hashes), promoted, demoted, hits,
+                        lookups, self.nbytes)
+
+
+def anchor_hash(anchor):
+    """Hash of an anchor for ColdTier, in this process."""
+    return hash(anchor) & 0xffffffff
+
+
+def read_access_log(fname):
+    """Counts of anchor lookups logged by ``write_access_log``.
+
+    Returns an empty Counter if there is no log yet.
+    """
+    counts = Counter()
+    if not os.path.exists(fname):
+        return counts
+    with io.open(fname, encoding='utf-8') as f:
+        for line in f:
+            count, anchor = line.rstrip(u'\n').split(u'\t', 1)
+            counts[anchor] += int(count)
+    return counts
+
+
+def write_access_log(fname, counts):
+    """Write counts of anchor lookups, most frequent first.
+
+    The log is replaced atomically, so a process that is killed while
+    writing leaves the previous one.
+    """
+    tmp = fname + '.tmp'
+    with io.open(tmp, 'w', encoding='utf-8') as f:
+        for anchor, count in counts.most_common():
+            f.write(u'%d\t%s\n' % (count, anchor))
+    if os.name == 'nt' and os.path.exists(fname):
+        os.remove(fname)
+    os.rename(tmp, fname)
+    _logger.info("Wrote %d anchors to access log %r", len(counts), fname)
@@ -1,4 +1,13 @@
-from collections import Sequence
+from array import array
+from collections import deque
+import re
+import sys
+try:
+    from collections.abc import Sequence
+except ImportError:
+    from collections import Sequence
+import unicodedata
+
 from six.moves import xrange
 from six.moves.urllib.parse import quote
 
@@ -48,6 +57,61 @@ def ngrams_with_pos(lst, N=None):
             yield start, start + n, join(lst[start:start + n])
 
 
+def ngrams_with_pos_iter(tokens, N):
+    """Generate n-grams with indices from an iterable of strings, lazily.
+
+    Unlike ``ngrams_with_pos``, this never materializes its input: it keeps
+    a window of the last `N` tokens and yields the n-grams starting at a
+    position as soon as the window extends `N` tokens beyond it. Memory use
+    is O(N), regardless of the length of `tokens`.
+
+    Parameters
+    ----------
+    tokens : iterable over strings
+    N : int
+        Maximum n-gram length. Unlike for ``ngrams_with_pos``, this is
+        required, since the input length is not known in advance.
+
+    Returns
+    -----
+    tuple (start, end, n-gram)
+        Same as ``ngrams_with_pos``, in the same order.
+
+    Raises
+    ------
+    TypeError
+        If `N` is not an integer.
+    ValueError
+        If `N` is not at least 1.
+    """
+    if not isinstance(N, int):
+        raise TypeError("n-gram order N should be an integer, was %s" %
+                        type(N))
+
+    if N < 1:
+        raise ValueError("n-gram order N should be 1 or greater %s" % N)
+
+    join = " ".join
+    window = deque(maxlen=N)
+    start = 0
+
+    for token in tokens:
+        window.append(token)
+        if len(window) == N:
+            w = list(window)
+            for n in xrange(1, N + 1):
+                yield start, start + n, join(w[:n])
+            start += 1
+
+    # Flush the tail: the positions whose n-grams were cut short by the end
+    # of the input. If the window ever filled up, its first token has been
+    # handled already.
+    w = list(window)[1:] if start > 0 else list(window)
+    for i in xrange(len(w)):
+        for n in xrange(1, len(w) - i + 1):
+            yield start + i, start + i + n, join(w[i:i + n])
+
+
 def ngrams(lst, N=None):
     """Generate bare n-grams from a list of strings.
 
@@ -59,11 +123,144 @@ def ngrams(lst, N=None):
     return (ng for _, _, ng in ngrams_with_pos(lst, N))
 
 
+# Tokens are maximal runs of word characters. Models are built with this
+# tokenizer (unless parse_dump is given another one), so text must be
+# tokenized the same way to find the n-grams that were counted.
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(s):
+    """Split text into tokens, as parse_dump does by default."""
+    return _TOKEN.findall(s)
+
+
+def iter_tokens(s):
+    """Generate the tokens of text lazily; see ``tokenize``."""
+    return (m.group() for m in _TOKEN.finditer(s))
+
+
+def tokenize_with_offsets(s):
+    """Split text into tokens, keeping their character offsets.
+
+    Returns
+    -------
+    tokens : list of string
+        Same as ``tokenize(s)``.
+    starts, ends : list of int
+        Character offsets such that ``tokens[i] == s[starts[i]:ends[i]]``.
+    """
+    spans = [m.span() for m in _TOKEN.finditer(s)]
+    tokens = [s[i:j] for i, j in spans]
+    return tokens, [i for i, _ in spans], [j for _, j in spans]
+
+
+_SENTENCE_END = re.compile(r'[.!?]+["\')\]]*$')
+
+
+def sentence_ends(tokens):
+    """Generate the end indices of the sentences in a list of tokens.
+
+    A sentence ends after a token that ends in a full stop, question mark or
+    exclamation mark, possibly followed by closing quotes or brackets. The
+    last index generated is always ``len(tokens)``, unless `tokens` is empty.
+    """
+    end = 0
+    for end, token in enumerate(tokens, 1):
+        if _SENTENCE_END.search(token) and end < len(tokens):
+            yield end
+    if end:
+        yield len(tokens)
+
+
+_SENTENCE_STOP = re.compile(r'[.!?]')
+
+
+def text_sentence_ends(s, starts, ends):
+    """Like ``sentence_ends``, for tokens with offsets into the text s.
+
+    Tokens do not include punctuation, so a sentence ends after a token
+    that is followed by a full stop, question mark or exclamation mark
+    before the next token.
+    """
+    search = _SENTENCE_STOP.search
+    for k in xrange(1, len(starts)):
+        if search(s, ends[k - 1], starts[k]):
+            yield k
+    if starts:
+        yield len(starts)
+
+
+_ASCII = re.compile(r'^[\x00-\x7f]*$')
+_WHITESPACE = re.compile(r'\s', re.UNICODE)
+
+
+def fold(s):
+    """Fold case and strip diacritics, for matching noisy text.
+
+    Whitespace is kept, but no whitespace is added: compatibility
+    characters such as a diaeresis on its own (U+00A8) decompose into a
+    space and a combining mark, and are dropped whole.
+
+    >>> fold(u'Caf\xe9 M\xfcNCHEN') == u'cafe munchen'
+    True
+    """
+    if isinstance(s, bytes):
+        s = s.decode('utf-8')
+    if _ASCII.match(s):
+        return s.lower()
+    decomposed = unicodedata.normalize('NFKD', s)
+    if _WHITESPACE.search(decomposed):
+        decomposed = u''.join(_decompose(c) for c in s)
+    return u''.join(c for c in decomposed
+                    if not unicodedata.combining(c)).lower()
+
+
+def _decompose(c):
+    """NFKD of the character c, without whitespace unless c is whitespace."""
+    d = unicodedata.normalize('NFKD', c)
+    return d if c.isspace() else _WHITESPACE.sub(u'', d)
+
+
 def tosequence(x):
     """Cast x to sequence. Returns x if at all possible."""
     return x if isinstance(x, Sequence) else list(x)
 
 
+if hasattr(array, 'tobytes'):
+    def array_frombytes(a, b):
+        """Append the items in the bytes b to the array a."""
+        a.frombytes(b)
+
+    def array_tobytes(a):
+        """The items of the array a as bytes."""
+        return a.tobytes()
+else:
+    def array_frombytes(a, b):
+        """Append the items in the bytes b to the array a."""
+        a.fromstring(bytes(b))
+
+    def array_tobytes(a):
+        """The items of the array a as bytes."""
+        return a.tostring()
+
+
+def ids_tobytes(ids):
+    """Sorted integer ids as little-endian 32-bit integers, for storage."""
+    a = array('i', ids)
+    if sys.byteorder == 'big':
+        a.byteswap()
+    return array_tobytes(a)
+
+
+def ids_frombytes(b):
+    """Inverse of ids_tobytes: an array('i') of the ids in b."""
+    a = array('i')
+    array_frombytes(a, b)
+    if sys.byteorder == 'big':
+        a.byteswap()
+    return a
+
+
 def url_from_title(title, wiki):
     """Turn an article title into a Wikipedia URL.
 
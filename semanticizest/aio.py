@@ -0,0 +1,172 @@
+"""asyncio front end to the semanticizer, with micro-batching.
+
+Calling ``Semanticizer.all_candidates`` from a coroutine blocks the event
+loop for as long as it takes to process the document. ``AsyncSemanticizer``
+instead collects concurrent requests into small batches, bounded in size
+and in the time the first request in a batch may wait, and runs each batch
+in an executor. Requires Python 3.7 or later.
+"""
+
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+import multiprocessing
+
+from semanticizest._semanticizer import Semanticizer
+
+
+class AsyncSemanticizer(object):
+    """Micro-batching asyncio wrapper around a Semanticizer.
+
+    Parameters
+    ----------
+    semanticizer : Semanticizer
+        The semanticizer to run batches with. Ignored (may be None) when
+        the executor is set up by ``with_processes``.
+    max_batch_size : int
+        Maximum number of requests per batch.
+    max_delay : float
+        Maximum time, in seconds, that a request waits for its batch to
+        fill up before the batch is run anyway.
+    executor : concurrent.futures.Executor, optional
+        Executor to run batches in. Defaults to a single thread, which
+        keeps the event loop responsive; since matching holds the GIL,
+        more threads don't buy throughput (use ``with_processes`` for that).
+    loop : asyncio event loop, optional
+        Defaults to the loop that is running when the first request comes
+        in.
+
+    Examples
+    --------
+    >>> asem = AsyncSemanticizer(Semanticizer('nlwiki.model'))  # doctest: +SKIP
+    >>> candidates = await asem.all_candidates(tokens)          # doctest: +SKIP
+    """
+
+    def __init__(self, semanticizer, max_batch_size=32, max_delay=.002,
+                 executor=None, loop=None):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size should be at least 1, got %r"
+                             % max_batch_size)
+
+        self.semanticizer = semanticizer
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+
+        self._owns_executor = executor is None
+        if executor is None:
+            executor = ThreadPoolExecutor(1)
+        self._executor = executor
+        self._run_batch = partial(_annotate_batch, semanticizer)
+
+        self._loop = loop
+        self._pending = []
+        self._timer = None
+
+        self.n_requests = 0
+        self.n_batches = 0
+
+    @classmethod
+    def with_processes(cls, fname, n_workers, **kwargs):
+        """Run batches in worker processes, each with its own Semanticizer.
+
+        Parameters
+        ----------
+        fname : string
+            Filename of the stored model, loaded once in every worker.
+        n_workers : int
+            Number of worker processes.
+
+        Further keyword arguments are passed to the constructor.
+        """
+        # Forking a process that has threads or open SQLite connections
+        # can deadlock the child, so workers start from a fresh interpreter.
+        executor = ProcessPoolExecutor(n_workers,
+                                       mp_context=multiprocessing.get_context(
+                                           'spawn'),
+                                       initializer=_init_worker,
+                                       initargs=(fname,))
+        self = cls(None, executor=executor, **kwargs)
+        self._owns_executor = True
+        self._run_batch = _annotate_batch_in_worker
+        return self
+
+    def all_candidates(self, s):
+        """Retrieve all candidate entities from a piece of text.
+
+        Parameters
+        ----------
+        s : {string, list of string}
+            Tokens; see ``Semanticizer.all_candidates``.
+
+        Returns
+        -------
+        future : asyncio.Future
+            Resolves to the list of candidates.
+        """
+        if self._loop is None:
+            self._loop = asyncio.get_event_loop()
+        future = self._loop.create_future()
+        self._pending.append((s, future))
+        self.n_requests += 1
+
+        if len(self._pending) >= self.max_batch_size:
+            self.flush()
+        elif self._timer is None:
+            self._timer = self._loop.call_later(self.max_delay, self.flush)
+        return future
+
+    def flush(self):
+        """Start processing the pending requests now."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        self.n_batches += 1
+        docs = [s for s, _ in batch]
+        job = self._loop.run_in_executor(self._executor, self._run_batch, docs)
+        job.add_done_callback(partial(_resolve, [f for _, f in batch]))
+
+    def close(self):
+        """Process pending requests, then shut down our own executor."""
+        self.flush()
+        if self._owns_executor:
+            self._executor.shutdown(wait=False)
+
+
+def _annotate_batch(semanticizer, docs):
+    return [list(semanticizer.all_candidates(s)) for s in docs]
+
+
+_worker_semanticizer = None
+
+
+def _init_worker(fname):
+    global _worker_semanticizer
+    _worker_semanticizer = Semanticizer(fname)
+
+
+def _annotate_batch_in_worker(docs):
+    return _annotate_batch(_worker_semanticizer, docs)
+
+
+def _resolve(futures, job):
+    """Hand the results of a batch job to the requests' futures."""
+    if job.cancelled():
+        for f in futures:
+            f.cancel()
+        return
+
+    exc = job.exception()
+    if exc is not None:
+        for f in futures:
+            if not f.done():
+                f.set_exception(exc)
+        return
+
+    for f, result in zip(futures, job.result()):
+        # The requester may have given up (e.g., on a timeout).
+        if not f.done():
+            f.set_result(result)
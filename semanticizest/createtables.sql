@@ -4,15 +4,25 @@ pragma synchronous = off;
 
 drop table if exists linkstats;
 drop table if exists ngrams;
+drop table if exists redirects;
+drop table if exists countmin;
+drop table if exists inlinks;
+drop table if exists page_links;
+drop table if exists pages;
+drop table if exists link_counts;
+drop table if exists ngram_counts;
 
 create table parameters (
     key text primary key not NULL,
     value text default NULL
 );
 
+-- The unique index on ngrams(ngram) and the index on linkstats(target) are
+-- only built after loading, by parse_dump. Ids are assigned in n-gram order
+-- and linkstats is clustered by anchor, so loading a model is sequential.
 create table ngrams (
     id integer primary key default NULL,
-    ngram text unique not NULL,
+    ngram text not NULL,
     tf integer default 0,
     df integer default 0
 );
@@ -21,7 +31,62 @@ create table linkstats (
     ngram_id integer not NULL,
     target text not NULL,
     count integer not NULL,
+    primary key (ngram_id, target),
     foreign key(ngram_id) references ngrams(id)
+) without rowid;
+
+-- Redirects as found in the dump. Links to redirects are counted as links
+-- to their (final) targets in linkstats; this table is kept so that models
+-- built from parts of a dump can be merged.
+create table redirects (
+    title text primary key not NULL,
+    target text not NULL
+);
+
+-- Count-min sketches of n-gram tf and df, for models built with approximate
+-- n-gram counting. The ngrams table then only holds anchors, with zero counts.
+create table countmin (
+    name text primary key not NULL,
+    width integer not NULL,
+    depth integer not NULL,
+    counts blob not NULL
+);
+
+-- Link graph of models built with link_graph=True: the ids of the articles
+-- linking to each entity (after resolving redirects), as a sorted array of
+-- little-endian 32-bit integers. Only entities in linkstats are stored.
+create table inlinks (
+    target text primary key not NULL,
+    sources blob not NULL
+) without rowid;
+
+-- Unindexed staging tables, appended to per page while parsing a dump and
+-- aggregated into ngrams, linkstats and inlinks at the end. Models built
+-- with incremental=True keep them, indexed by page, to be updated from
+-- newer dumps; page_id is NULL in shards, where they are summed.
+create table ngram_counts (
+    page_id integer,
+    ngram text not NULL,
+    tf integer not NULL,
+    df integer not NULL
 );
 
-create index link_target on linkstats(target);
+create table link_counts (
+    page_id integer,
+    anchor text not NULL,
+    target text not NULL,
+    count integer not NULL
+);
+
+create table page_links (
+    source integer not NULL,
+    target text not NULL
+);
+
+-- Pages of incremental models, with a digest of what was parsed from them.
+create table pages (
+    page_id integer primary key,
+    title text not NULL,
+    redirect text default NULL,
+    digest blob not NULL
+);
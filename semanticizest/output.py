@@ -0,0 +1,157 @@
+"""Candidates as parallel arrays, and writers for them.
+
+``Semanticizer.candidate_arrays`` fills a ``CandidateArrays`` for a batch of
+documents. The writers in this module go from those arrays to JSON lines,
+TSV or a compact binary format, without making a tuple per candidate.
+"""
+
+from array import array
+from bisect import bisect_left
+import json
+import struct
+import sys
+
+from six.moves import xrange
+
+from semanticizest._util import array_frombytes, array_tobytes
+
+
+class CandidateArrays(object):
+    """Candidate entities of a batch of documents, as parallel arrays.
+
+    Candidate ``k`` is found in document ``doc[k]`` (its index in the batch)
+    at token positions ``start[k]`` to ``end[k]``, and refers to entity
+    ``entity[k]`` (an index into ``Semanticizer.entities``) with probability
+    (commonness) ``prob[k]``. Candidates are in the order in which
+    ``Semanticizer.all_candidates`` produces them.
+
+    The arrays are ``array.array`` objects, of 32-bit integers and doubles.
+    Use ``numpy.frombuffer`` to view them as NumPy arrays without copying.
+    """
+
+    def __init__(self):
+        self.doc = array('i')
+        self.start = array('i')
+        self.end = array('i')
+        self.entity = array('i')
+        self.prob = array('d')
+        # Number of documents, including those without candidates.
+        self.n_docs = 0
+
+    def __len__(self):
+        return len(self.entity)
+
+    def _columns(self):
+        return [self.doc, self.start, self.end, self.entity, self.prob]
+
+    def document(self, d):
+        """Slice bounds (lo, hi) of the candidates of document d."""
+        return bisect_left(self.doc, d), bisect_left(self.doc, d + 1)
+
+
+def write_jsonl(candidates, f, entities=None):
+    """Write one JSON object per document to the text file f.
+
+    Each object has the document's index as ``doc`` and its candidates as
+    lists ``start``, ``end``, ``entity`` and ``prob``.
+
+    Parameters
+    ----------
+    candidates : CandidateArrays
+    f : file
+    entities : list of string, optional
+        ``Semanticizer.entities``. If given, entities are written as titles
+        rather than as ids.
+    """
+    if entities is not None:
+        encoded = {}
+
+        def entity_list(ids):
+            titles = []
+            for e in ids:
+                title = encoded.get(e)
+                if title is None:
+                    title = encoded[e] = json.dumps(entities[e])
+                titles.append(title)
+            return ','.join(titles)
+    else:
+        def entity_list(ids):
+            return ','.join(map(str, ids))
+
+    lo = 0
+    doc = candidates.doc
+    for d in xrange(candidates.n_docs):
+        hi = bisect_left(doc, d + 1, lo)
+        f.write('{"doc":%d,"start":[%s],"end":[%s],"entity":[%s],'
+                '"prob":[%s]}\n'
+                % (d, ','.join(map(str, candidates.start[lo:hi])),
+                   ','.join(map(str, candidates.end[lo:hi])),
+                   entity_list(candidates.entity[lo:hi]),
+                   ','.join(map(repr, candidates.prob[lo:hi]))))
+        lo = hi
+
+
+def write_tsv(candidates, f, entities=None):
+    """Write one line per candidate to the text file f.
+
+    Columns are doc, start, end, entity and probability, separated by tabs.
+
+    Parameters
+    ----------
+    candidates : CandidateArrays
+    f : file
+    entities : list of string, optional
+        ``Semanticizer.entities``. If given, entities are written as titles
+        rather than as ids.
+    """
+    entity = candidates.entity
+    if entities is not None:
+        entity = [entities[e] for e in entity]
+        line = '%d\t%d\t%d\t%s\t%r\n'
+    else:
+        line = '%d\t%d\t%d\t%d\t%r\n'
+    f.writelines(line % row
+                 for row in zip(candidates.doc, candidates.start,
+                                candidates.end, entity, candidates.prob))
+
+
+# Magic, version, number of documents and number of candidates.
+_HEADER = struct.Struct('<4sIIQ')
+_MAGIC = b'SZCA'
+
+
+def write_binary(candidates, f):
+    """Write candidates to the binary file f.
+
+    The format is a header followed by the columns doc, start, end and
+    entity as little-endian 32-bit integers, and prob as little-endian
+    doubles. Read it back with ``read_binary``.
+    """
+    f.write(_HEADER.pack(_MAGIC, 1, candidates.n_docs, len(candidates)))
+    for column in candidates._columns():
+        if sys.byteorder == 'big':
+            column = array(column.typecode, column)
+            column.byteswap()
+        f.write(array_tobytes(column))
+
+
+def read_binary(f):
+    """Read candidates written by ``write_binary`` from the binary file f.
+
+    Returns
+    -------
+    candidates : CandidateArrays
+    """
+    magic, version, n_docs, n = _HEADER.unpack(f.read(_HEADER.size))
+    if magic != _MAGIC or version != 1:
+        raise ValueError("not a semanticizest candidates file")
+
+    candidates = CandidateArrays()
+    candidates.n_docs = n_docs
+    for column in candidates._columns():
+        array_frombytes(column, f.read(n * column.itemsize))
+        if len(column) != n:
+            raise ValueError("truncated candidates file")
+        if sys.byteorder == 'big':
+            column.byteswap()
+    return candidates
@@ -2,18 +2,25 @@
 
 from __future__ import print_function
 
-from os.path import basename
+import os
+from os.path import basename, join, splitext
 from bz2 import BZ2File
 from collections import Counter, namedtuple
 import gzip
-from HTMLParser import HTMLParser
-from itertools import chain
+from hashlib import md5
+from itertools import chain, groupby
 import logging
 import re
+import sqlite3
+import struct
+from subprocess import PIPE, Popen
+from threading import Thread
 import xml.etree.ElementTree as etree   # don't use LXML, it's slower (!)
 
 import six
-from semanticizest._util import ngrams
+from six.moves.queue import Empty, Queue
+from semanticizest._countmin import CountMinSketch, load_sketch, save_sketch
+from semanticizest._util import ids_tobytes, ngrams, tokenize
 from semanticizest._version import __version__
 
 
@@ -164,7 +171,11 @@ _UNWANTED = re.compile(r"""
 """, re.DOTALL | re.MULTILINE | re.UNICODE | re.VERBOSE)
 
 
-_unescape_entities = HTMLParser().unescape
+try:
+    from html import unescape as _unescape_entities
+except ImportError:
+    from HTMLParser import HTMLParser
+    _unescape_entities = HTMLParser().unescape
 
 
 def clean_text(page):
@@ -205,8 +216,17 @@ def page_statistics(page, N, sentence_splitter=None, tokenizer=None):
     if N is not None and not isinstance(N, int):
         raise TypeError("expected integer or None for N, got %r" % N)
 
+    if tokenizer is None:
+        tokenizer = tokenize
+
     clean = clean_text(page)
-    link_counts = Counter(extract_links(clean))
+    # Anchors are tokenized like the running text, so that they are found
+    # among the n-grams of any text tokenized this way.
+    link_counts = Counter()
+    for target, anchor in extract_links(clean):
+        anchor = u' '.join(tokenizer(anchor))
+        if anchor:
+            link_counts[target, anchor] += 1
 
     if N:
         no_links = remove_links(clean)
@@ -219,8 +239,6 @@ def page_statistics(page, N, sentence_splitter=None, tokenizer=None):
                          for paragraph in re.split('\n+', no_links)
                          for sentence in paragraph]
 
-        if tokenizer is None:
-            tokenizer = re.compile(r'\w+', re.UNICODE).findall
         all_ngrams = chain.from_iterable(ngrams(tokenizer(sentence), N)
                                          for sentence in sentences)
         ngram_counts = Counter(all_ngrams)
@@ -231,17 +249,129 @@ def page_statistics(page, N, sentence_splitter=None, tokenizer=None):
     return link_counts, ngram_counts
 
 
-def _open(f):
-    if isinstance(f, six.string_types):
-        if f.endswith('.gz'):
+# Multi-threaded drop-in replacements for bzip2 and gzip, in order of
+# preference. These must support the -d and -c flags.
+_PARALLEL_DECOMPRESSORS = {'.bz2': ['lbzip2', 'pbzip2'], '.gz': ['pigz']}
+
+
+def _which(names):
+    """Return the full path of the first of names found on the PATH."""
+    for name in names:
+        for d in os.environ.get('PATH', '').split(os.pathsep):
+            path = join(d, name)
+            if os.path.isfile(path) and os.access(path, os.X_OK):
+                return path
+    return None
+
+
+class _ThreadedReader(object):
+    """Read-only file-like that reads from f in a background thread.
+
+    Chunks are handed over through a bounded queue, so the reader thread can
+    run at most max_chunks * chunk_size bytes ahead of the consumer.
+    If proc is given, it is the subprocess writing to f; its exit status is
+    checked at EOF.
+    """
+
+    def __init__(self, f, proc=None, chunk_size=1 << 20, max_chunks=16):
+        self._f = f
+        self._proc = proc
+        self._queue = Queue(max_chunks)
+        self._closed = False
+        self._chunk = b''
+        self._pos = 0
+        self._eof = False
+
+        self._thread = Thread(target=self._fill, args=(chunk_size,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _fill(self, chunk_size):
+        try:
+            while not self._closed:
+                chunk = self._f.read(chunk_size)
+                if not chunk and self._proc is not None:
+                    status = self._proc.wait()
+                    if status != 0:
+                        raise IOError("decompressor exited with status %d"
+                                      % status)
+                self._queue.put(chunk)
+                if not chunk:
+                    break
+        except Exception as e:
+            self._queue.put(e)
+
+    def read(self, size=-1):
+        parts = []
+        while size != 0 and not self._eof:
+            if self._pos == len(self._chunk):
+                chunk = self._queue.get()
+                if isinstance(chunk, Exception):
+                    raise chunk
+                self._chunk, self._pos = chunk, 0
+                if not chunk:
+                    self._eof = True
+                    break
+            end = len(self._chunk)
+            if size > 0:
+                end = min(end, self._pos + size)
+                size -= end - self._pos
+            parts.append(self._chunk[self._pos:end])
+            self._pos = end
+        return b''.join(parts)
+
+    def close(self):
+        self._closed = True
+        if self._proc is not None and self._proc.poll() is None:
+            self._proc.terminate()
+        # Unblock the reader thread if it's waiting for room in the queue.
+        while self._thread.is_alive():
+            try:
+                self._queue.get(timeout=.1)
+            except Empty:
+                pass
+        self._f.close()
+
+
+def _open(f, decompressor=None):
+    """Open a (possibly compressed) dump file.
+
+    See ``parse_dump`` for the decompressor argument.
+    """
+    if not isinstance(f, six.string_types):
+        return f
+
+    ext = splitext(f)[1]
+    if ext not in _PARALLEL_DECOMPRESSORS or decompressor is None:
+        if ext == '.gz':
             return gzip.open(f)
-        elif f.endswith('.bz2'):
+        elif ext == '.bz2':
             return BZ2File(f)
         return open(f)
-    return f
 
+    if decompressor == 'auto':
+        command = _which(_PARALLEL_DECOMPRESSORS[ext])
+    elif decompressor == 'thread':
+        command = None
+    else:
+        command = _which([decompressor])
+        if command is None:
+            raise ValueError("decompressor %r not found" % decompressor)
+
+    if command is None:
+        _logger.info("Decompressing %r in background thread", f)
+        return _ThreadedReader(gzip.open(f) if ext == '.gz' else BZ2File(f))
+
+    _logger.info("Decompressing %r using %r", f, command)
+    proc = Popen([command, '-d', '-c', f], stdout=PIPE)
+    return _ThreadedReader(proc.stdout, proc=proc)
 
-def parse_dump(dump, db, N=7, sentence_splitter=None, tokenizer=None):
+
+def parse_dump(dump, db, N=7, sentence_splitter=None, tokenizer=None,
+               min_link_count=1, min_anchor_links=1, min_target_inlinks=1,
+               page_ids=None, finalize=True, decompressor='auto',
+               countmin=None, link_graph=False, incremental=False,
+               sample=None, scale=False):
     """Parse Wikipedia database dump, return n-gram and link statistics.
 
     Parameters
@@ -259,13 +389,81 @@ def parse_dump(dump, db, N=7, sentence_splitter=None, tokenizer=None):
         Sentence splitter. Called on output of paragraph splitter
         (strings).
     tokenizer : callable, optional
-        Tokenizer. Called on output of sentence splitter (strings).
-        Must return iterable over strings.
+        Tokenizer. Called on output of sentence splitter (strings), and
+        on link anchors. Must return iterable over strings. Defaults to
+        the tokenizer that ``Semanticizer`` applies to strings; with any
+        other, pass tokens rather than strings to the semanticizer.
+    min_link_count : integer, optional
+        Minimum number of times an (anchor, target) pair must occur for
+        it to be stored.
+    min_anchor_links : integer, optional
+        Minimum total number of links with an anchor for its senses to be
+        stored.
+    min_target_inlinks : integer, optional
+        Minimum total number of links to a target for it to be stored as a
+        sense of any anchor.
+
+    page_ids : (int, int), optional
+        Only process pages with ids in the half-open range [start, stop).
+        Either bound may be None.
+    finalize : boolean, optional
+        If false, don't aggregate the statistics into a usable model, but
+        leave them in the staging tables (summed per n-gram and per link)
+        with redirects unresolved. Such a shard can be merged with others
+        using ``merge_shards``; the pruning thresholds are then ignored.
+    decompressor : {'auto', 'thread', None, str}, optional
+        How to decompress a .bz2 or .gz dump given by filename. 'thread'
+        decompresses in a background thread, so that decompression and
+        parsing can use separate cores. 'auto' uses a parallel
+        decompressor (lbzip2 or pbzip2 for bzip2, pigz for gzip) if one is
+        found on the PATH, and a background thread otherwise. Any other
+        string is taken to be the name of such a decompressor. None
+        decompresses in the parsing thread.
+    countmin : (int, int), optional
+        Width and depth of count-min sketches. If given, n-gram term and
+        document frequencies are counted approximately in two such
+        sketches, using ``2 * width * depth`` counters of 8 bytes, instead
+        of exactly in the ngrams table. That table then only holds the
+        anchors, with zero counts. Link counts are always exact.
+    link_graph : boolean, optional
+        Record which articles link to which entities, for
+        ``Semanticizer.relatedness``. This stores the page ids of the
+        articles linking to each entity in the model.
+    incremental : boolean, optional
+        Keep each page's contribution to the statistics, and a digest of
+        its content, so that the model can later be brought up to date
+        with a newer dump using ``update_model``. The staging tables are
+        then kept, which makes the model several times larger. Requires
+        `finalize` and exact n-gram counting.
+    sample : float, optional
+        Only process this fraction of the articles, e.g., to build a small
+        model for development. Articles are picked by a hash of their page
+        id, so the same ones are picked every time (and by every shard);
+        all redirects are kept.
+    scale : boolean, optional
+        With `sample`, divide n-gram and link counts by the sample rate to
+        estimate those of the full dump, before the thresholds are applied.
+        The link graph and the number of articles are not scaled.
+
+    The thresholds are applied after links to redirects have been merged
+    into links to their targets. By default, nothing is pruned.
+
+    Returns
+    -------
+    report : dict
+        Pruning report; see ``prune_linkstats``. None if not `finalize`.
     """
 
-    f = _open(dump)
+    if incremental and (countmin is not None or not finalize):
+        raise ValueError("incremental requires finalize and exact counts")
+    if sample is not None and not 0 < sample <= 1:
+        raise ValueError("sample must be in (0, 1], got %r" % sample)
+    if scale and sample is None:
+        raise ValueError("scale requires sample")
 
-    redirects = {}
+    f = _open(dump, decompressor)
+
+    start, stop = page_ids or (None, None)
 
     c = db.cursor()
 
@@ -280,96 +478,579 @@ def parse_dump(dump, db, N=7, sentence_splitter=None, tokenizer=None):
     # Store the maximum ngram length, so we can use it later on
     c.execute('''insert into parameters values ('N', ?);''', (str(N),))
 
-    # Temporary index to speed up insertion
-    c.execute('''create unique index target_anchor
-                 on linkstats(ngram_id, target)''')
+    if page_ids is not None:
+        c.execute('''insert into parameters values ('page_ids', ?);''',
+                  ('%s:%s' % (start, stop),))
+
+    if countmin is not None:
+        c.execute('''insert into parameters values ('countmin', ?);''',
+                  ('%dx%d' % countmin,))
+        tf, df = CountMinSketch(*countmin), CountMinSketch(*countmin)
+
+    if link_graph:
+        c.execute('''insert into parameters values ('link_graph', 'True');''')
+
+    if incremental:
+        c.execute('''insert into parameters values ('incremental', 'True');''')
+
+    if sample is not None:
+        c.execute('''insert into parameters values ('sample', ?);''',
+                  (repr(sample),))
+        if scale:
+            c.execute('''insert into parameters values ('scale', 'True');''')
+        in_sample = _sampler(sample)
 
     _logger.info("Processing articles")
-    for i, page in enumerate(extract_pages(f), 1):
-        if i % 10000 == 0:
-            _logger.info("%d articles done", i)
-        if page.redirect is not None:
-            redirects[page.title] = page.redirect
-            continue
+    n_articles = 0
+    c.execute('''create temp table seen_pages
+                 (page_id integer primary key)''')
+    try:
+        for i, page in enumerate(extract_pages(f), 1):
+            if i % 10000 == 0:
+                _logger.info("%d articles done", i)
+            if ((start is not None and page.page_id < start) or
+                    (stop is not None and page.page_id >= stop)):
+                continue
+            if (sample is not None and page.redirect is None and
+                    not in_sample(page.page_id)):
+                continue
+            if not _first_seen(c, page):
+                continue
+            if page.redirect is None:
+                n_articles += 1
+            _store_page(c, page, N, sentence_splitter, tokenizer,
+                        None if countmin is None else (tf, df), link_graph,
+                        incremental)
+            db.commit()
+    finally:
+        if f is not dump:
+            f.close()
+    c.execute('''drop table seen_pages''')
+
+    if countmin is not None:
+        save_sketch(db, 'tf', tf)
+        save_sketch(db, 'df', df)
+        db.commit()
+
+    # The number of articles, for relatedness.
+    c.execute('''insert into parameters values ('articles', ?);''',
+              (str(n_articles),))
+    db.commit()
+
+    if finalize:
+        if incremental:
+            _index_staging(db)
+        report = _finalize(db, keep_staging=incremental,
+                           min_link_count=min_link_count,
+                           min_anchor_links=min_anchor_links,
+                           min_target_inlinks=min_target_inlinks)
+    else:
+        _compact_staging(db)
+        report = None
+    _logger.info("Dump parsing done: processed %d articles", i)
+
+    return report
+
+
+def _sampler(rate):
+    """Predicate on page ids that holds for a fraction rate of them."""
+    # MD5, unlike hash(), is the same across processes and platforms.
+    threshold = int(rate * 2 ** 64)
+
+    def in_sample(page_id):
+        h, = struct.unpack('<Q', md5(str(page_id).encode('ascii'))
+                           .digest()[:8])
+        return h < threshold
+    return in_sample
+
+
+def _first_seen(c, page):
+    """Record page in seen_pages; False if a page with its id already was.
+
+    Dumps should not have two pages with the same id. If one does, both
+    parse_dump and update_model keep the first.
+    """
+    try:
+        c.execute('''insert into seen_pages values (?)''', (page.page_id,))
+    except sqlite3.IntegrityError:
+        _logger.warning("Skipping second page with id %d", page.page_id)
+        return False
+    return True
+
+
+def _store_page(c, page, N, sentence_splitter, tokenizer, sketches,
+                link_graph, incremental):
+    """Add the statistics of page to the staging tables."""
+    if incremental:
+        c.execute('''insert or replace into pages values (?, ?, ?, ?)''',
+                  (page.page_id, page.title, page.redirect,
+                   sqlite3.Binary(_page_digest(page))))
+    if page.redirect is not None:
+        c.execute('''insert or replace into redirects values (?, ?)''',
+                  (page.title, page.redirect))
+        return
+
+    link, ngram = page_statistics(page.content, N=N, tokenizer=tokenizer,
+                                  sentence_splitter=sentence_splitter)
+    page_id = page.page_id
+
+    # We don't count the n-grams within the links, but we need them
+    # in the table, so add them with zero count.
+    tokens = chain(six.iteritems(ngram or {}),
+                   ((anchor, 0) for _, anchor in six.iterkeys(link)))
+    if sketches is None:
+        c.executemany('''insert into ngram_counts values (?, ?, ?, 1)''',
+                      ((page_id, token, count) for token, count in tokens))
+    else:
+        tf, df = sketches
+        for token, count in tokens:
+            tf.add(token, count)
+            df.add(token)
+        c.executemany('''insert into ngram_counts values (?, ?, 0, 0)''',
+                      ((page_id, anchor) for _, anchor in six.iterkeys(link)))
+    c.executemany('''insert into link_counts values (?, ?, ?, ?)''',
+                  ((page_id, anchor, target, count)
+                   for (target, anchor), count in six.iteritems(link)))
+    if link_graph:
+        c.executemany('''insert into page_links values (?, ?)''',
+                      ((page_id, target) for target
+                       in set(target for target, _ in link)))
+
+
+def _page_digest(page):
+    """Digest of everything parse_dump uses from page."""
+    h = md5()
+    for s in (page.title, page.redirect or u'', page.content):
+        h.update(s.encode('utf-8'))
+        h.update(b'\0')
+    return h.digest()
+
+
+def _index_staging(db):
+    """Index the staging tables of an incremental model by page."""
+    db.cursor().executescript('''
+        create index if not exists ngram_counts_page
+            on ngram_counts(page_id);
+        create index if not exists link_counts_page on link_counts(page_id);
+        create index if not exists page_links_source on page_links(source);
+    ''')
+    db.commit()
+
+
+def update_model(dump, db, sentence_splitter=None, tokenizer=None,
+                 decompressor='auto'):
+    """Update a model built with incremental=True from a newer dump.
+
+    Only pages that were added, deleted or changed since the dump the
+    model was last built or updated from are parsed. Their old
+    contributions are removed from the staging tables, their new ones
+    added, and the model is then finalized again, with redirects resolved
+    anew and the pruning thresholds it was built with. The result is the
+    same as that of building a model from the newer dump with the same
+    arguments.
+
+    Only the parsing is incremental: finalizing aggregates the staging
+    tables of all pages again, so an update still takes as long as the
+    last step of a full build, however few pages changed.
+
+    Parameters
+    ----------
+    dump : {file-like, str}
+        Path to or handle on the newer Wikipedia page dump.
+    db : SQLite connection
+        Connection to the model, which is modified in place.
 
-        link, ngram = page_statistics(page.content, N=N, tokenizer=tokenizer,
-                                      sentence_splitter=sentence_splitter)
-
-        # We don't count the n-grams within the links, but we need them
-        # in the table, so add them with zero count.
-        tokens = chain(six.iteritems(ngram or {}),
-                       ((anchor, 0) for _, anchor in six.iterkeys(link)))
-        tokens = list(tokens)
-        c.executemany('''insert or ignore into ngrams (ngram) values (?)''',
-                      ((g,) for g, _ in tokens))
-        c.executemany('''update ngrams set tf = tf + ?, df = df + 1
-                         where ngram = ?''',
-                      ((count, token) for token, count in tokens))
-
-        c.executemany('''insert or ignore into linkstats values
-                         ((select id from ngrams where ngram = ?), ?, 0)''',
-                      ((anchor, target)
-                       for target, anchor in six.iterkeys(link)))
-        c.executemany('''update linkstats set count = count + ?
-                         where ngram_id = (select rowid from ngrams
-                                           where ngram = ?)''',
-                      ((count, anchor)
-                       for (_, anchor), count in six.iteritems(link)))
+    The sentence splitter and tokenizer must be those the model was built
+    with. See ``parse_dump`` for the parameters.
 
+    Returns
+    -------
+    report : dict
+        The number of pages ``added``, ``changed``, ``deleted`` and
+        ``unchanged``, and the pruning report (see ``prune_linkstats``) as
+        ``pruning``.
+    """
+    c = db.cursor()
+    params = dict(c.execute('''select key, value from parameters'''))
+    if 'incremental' not in params:
+        raise ValueError("model was not built with incremental=True")
+    N = None if params['N'] == 'None' else int(params['N'])
+    start, stop = [None if x == 'None' else int(x)
+                   for x in params.get('page_ids', 'None:None').split(':')]
+    link_graph = 'link_graph' in params
+    in_sample = (_sampler(float(params['sample'])) if 'sample' in params
+                 else None)
+    thresholds = dict((key, int(params[key]))
+                      for key in ['min_anchor_links', 'min_link_count',
+                                  'min_target_inlinks'])
+
+    f = _open(dump, decompressor)
+    c.execute('''create temp table seen_pages
+                 (page_id integer primary key)''')
+    report = dict.fromkeys(['added', 'changed', 'deleted', 'unchanged'], 0)
+
+    _logger.info("Comparing pages")
+    try:
+        for i, page in enumerate(extract_pages(f), 1):
+            if i % 10000 == 0:
+                _logger.info("%d articles done", i)
+            if ((start is not None and page.page_id < start) or
+                    (stop is not None and page.page_id >= stop)):
+                continue
+            if (in_sample is not None and page.redirect is None and
+                    not in_sample(page.page_id)):
+                continue
+            if not _first_seen(c, page):
+                continue
+            row = c.execute('''select digest from pages where page_id = ?''',
+                            (page.page_id,)).fetchone()
+            if row is not None:
+                if bytes(row[0]) == _page_digest(page):
+                    report['unchanged'] += 1
+                    continue
+                _remove_page(c, page.page_id)
+                report['changed'] += 1
+            else:
+                report['added'] += 1
+            _store_page(c, page, N, sentence_splitter, tokenizer, None,
+                        link_graph, True)
+            db.commit()
+    finally:
+        if f is not dump:
+            f.close()
+
+    deleted = [page_id for page_id, in c.execute('''
+        select page_id from pages
+        where page_id not in (select page_id from seen_pages)''').fetchall()]
+    for page_id in deleted:
+        _remove_page(c, page_id)
+    report['deleted'] = len(deleted)
+    c.execute('''drop table seen_pages''')
+    _logger.info("%(added)d pages added, %(changed)d changed, "
+                 "%(deleted)d deleted, %(unchanged)d unchanged", report)
+
+    n_articles, = next(c.execute('''select count(*) from pages
+                                    where redirect is null'''))
+    c.executemany('''insert or replace into parameters values (?, ?)''',
+                  [('version', __version__), ('dump', basename(dump)),
+                   ('articles', str(n_articles))])
+
+    # Start over from the staging tables.
+    c.executescript('''
+        delete from inlinks;
+        delete from linkstats;
+        delete from ngrams;
+        drop index ngram_text;
+        drop index link_target;
+    ''')
+    db.commit()
+    report['pruning'] = _finalize(db, keep_staging=True, **thresholds)
+    return report
+
+
+def _remove_page(c, page_id):
+    """Remove the contributions of a page from the staging tables."""
+    title, redirect = c.execute('''select title, redirect from pages
+                                   where page_id = ?''', (page_id,)).fetchone()
+    if redirect is not None:
+        c.execute('''delete from redirects where title = ?''', (title,))
+    for table, column in [('ngram_counts', 'page_id'),
+                          ('link_counts', 'page_id'),
+                          ('page_links', 'source'),
+                          ('pages', 'page_id')]:
+        c.execute('''delete from %s where %s = ?''' % (table, column),
+                  (page_id,))
+
+
+def merge_shards(shards, db, min_link_count=1, min_anchor_links=1,
+                 min_target_inlinks=1):
+    """Merge models built by parse_dump with finalize=False.
+
+    N-gram and link counts are summed and redirects are unioned, then the
+    model is finalized as in ``parse_dump``. The result is the same as
+    that of building the model from all the shards' pages in one go.
+
+    Parameters
+    ----------
+    shards : iterable over str
+        Filenames of the shard databases.
+    db : SQLite connection
+        Connection to an initialized, empty database that will hold the
+        merged model.
+
+    See ``parse_dump`` for the remaining parameters.
+
+    Returns
+    -------
+    report : dict
+        Pruning report; see ``prune_linkstats``.
+    """
+    c = db.cursor()
+    dumps = []
+    n_articles = 0
+    # Parameters that must be the same for all shards.
+    settings = None
+    for shard in shards:
+        _logger.info("Merging shard %r", shard)
+        c.execute('''attach database ? as shard''', (shard,))
+        params = dict(c.execute('''select key, value
+                                     from shard.parameters'''))
+        shard_settings = [(key, params[key])
+                          for key in ['N', 'countmin', 'link_graph',
+                                      'sample', 'scale']
+                          if key in params]
+        if settings is None:
+            settings = shard_settings
+        elif shard_settings != settings:
+            raise ValueError("shard %r built with %r, expected %r"
+                             % (shard, shard_settings, settings))
+        dumps.append(params['dump'])
+        n_articles += int(params.get('articles', 0))
+        c.executescript('''
+            insert into ngram_counts select * from shard.ngram_counts;
+            insert into link_counts select * from shard.link_counts;
+            insert or replace into redirects select * from shard.redirects;
+        ''')
+        if 'link_graph' in params:
+            c.execute('''insert into page_links
+                         select * from shard.page_links''')
+        db.commit()
+
+        for name in ['tf', 'df']:
+            sketch = load_sketch(c, name, table='shard.countmin')
+            if sketch is None:
+                continue
+            merged = load_sketch(c, name)
+            if merged is not None:
+                sketch.merge(merged)
+            save_sketch(c, name, sketch)
         db.commit()
 
+        c.execute('''detach database shard''')
+
+    _compact_staging(db)
+
+    c.executemany('''insert into parameters values (?, ?);''',
+                  [('version', __version__),
+                   ('dump', ','.join(sorted(set(dumps)))),
+                   ('articles', str(n_articles))] + settings)
+
+    return _finalize(db, min_link_count=min_link_count,
+                     min_anchor_links=min_anchor_links,
+                     min_target_inlinks=min_target_inlinks)
+
+
+def _compact_staging(db):
+    """Sum the rows in the staging tables per n-gram and per link."""
+    _logger.info("Compacting staging tables")
+    c = db.cursor()
+    c.executescript('''
+        create temp table compact_ngrams as
+            select null, ngram, sum(tf), sum(df) from ngram_counts
+            group by ngram;
+        delete from ngram_counts;
+        insert into ngram_counts select * from compact_ngrams;
+        drop table compact_ngrams;
+
+        create temp table compact_links as
+            select null, anchor, target, sum(count) from link_counts
+            group by anchor, target;
+        delete from link_counts;
+        insert into link_counts select * from compact_links;
+        drop table compact_links;
+    ''')
+    db.commit()
+    c.execute('vacuum')
+    db.commit()
+
+
+def _resolve_redirects(redirects):
+    """Follow chains of redirects to their final targets.
+
+    Returns a dict mapping each redirect to its final target, or to None if
+    the redirect is part of a cycle.
+    """
+    resolved = {}
+    for title, target in six.iteritems(redirects):
+        seen = set([title])
+        while target in redirects and target not in seen:
+            seen.add(target)
+            target = redirects[target]
+        resolved[title] = None if target in seen else target
+    return resolved
+
+
+def _finalize(db, keep_staging=False, **thresholds):
+    """Aggregate the staging tables into ngrams and linkstats.
+
+    Links to redirects are counted as links to the redirects' targets.
+    The linkstats table is then pruned according to `thresholds`.
+    Indexes are built only after the tables have been filled.
+    The staging tables are dropped unless `keep_staging`.
+
+    Returns the pruning report.
+    """
+    c = db.cursor()
+
+    # Store the pruning thresholds
+    c.executemany('''insert or replace into parameters values (?, ?);''',
+                  [(key, str(value))
+                   for key, value in sorted(six.iteritems(thresholds))])
+
+    # Scale counts of sampled models up to full-corpus estimates.
+    params = dict(c.execute('''select key, value from parameters'''))
+    factor = 1.
+    if 'scale' in params:
+        factor = 1. / float(params['sample'])
+        for name in ['tf', 'df']:
+            sketch = load_sketch(c, name)
+            if sketch is not None:
+                sketch.scale(factor)
+                save_sketch(c, name, sketch)
+
+    _logger.info("Aggregating n-gram counts")
+    c.execute('''
+        insert into ngrams (ngram, tf, df)
+            select ngram, cast(round(sum(tf) * :f) as integer),
+                   cast(round(sum(df) * :f) as integer)
+            from ngram_counts
+            group by ngram order by ngram
+    ''', {'f': factor})
+    c.execute('''create unique index ngram_text on ngrams(ngram)''')
+
+    redirects = dict(c.execute('''select title, target from redirects'''))
     _logger.info("Processing %d redirects", len(redirects))
-    for redir, target in redirects.items():
-        for anchor, count in c.execute('''select ngram_id, count from linkstats
-                                          where target = ?''', [redir]):
-            # TODO: combine the next two execute statements
-            c.execute('''insert or ignore into linkstats values (?, ?, 0)''',
-                      [anchor, target])
-            c.execute('''update linkstats
-                         set count = count + ?
-                         where target = ? and ngram_id = ?''',
-                      (count, target, anchor))
-
-    c.executemany('delete from linkstats where target = ?',
-                  ([redir] for redir in redirects))
+    c.execute('''create temp table resolved_redirects
+                 (title text primary key, target text)''')
+    c.executemany('''insert into resolved_redirects values (?, ?)''',
+                  six.iteritems(_resolve_redirects(redirects)))
+
+    _logger.info("Aggregating link counts")
+    c.execute('''
+        insert into linkstats (ngram_id, target, count)
+            select ngrams.id, coalesce(r.target, l.target) as t,
+                   cast(round(sum(l.count) * :f) as integer)
+            from link_counts as l
+                join ngrams on ngrams.ngram = l.anchor
+                left join resolved_redirects as r on r.title = l.target
+            where r.title is null or r.target is not null
+            group by ngrams.id, t
+            order by ngrams.id, t
+    ''', {'f': factor})
+    report = prune_linkstats(db, **thresholds)
+    c.execute('''create index link_target on linkstats(target)''')
+
+    _build_inlinks(db)
 
     _logger.info("Finalizing database")
-    c.executescript('''drop index target_anchor; vacuum;''')
-    _logger.info("Dump parsing done: processed %d articles", i)
+    c.execute('''drop table resolved_redirects''')
+    if not keep_staging:
+        c.executescript('''
+            drop table ngram_counts;
+            drop table link_counts;
+            drop table page_links;
+        ''')
+    db.commit()
+    c.execute('vacuum')
+    db.commit()
+
+    return report
+
 
+def _build_inlinks(db):
+    """Aggregate the page_links staging table into inlinks.
+
+    Links to redirects are resolved as in linkstats, and only entities
+    that are still in linkstats after pruning are kept.
+    """
+    c = db.cursor()
+    if next(c.execute('''select count(*) from page_links'''))[0] == 0:
+        return
+    _logger.info("Aggregating link graph")
+
+    edges = db.cursor().execute('''
+        select coalesce(r.target, p.target) as t, p.source
+        from page_links as p
+            left join resolved_redirects as r on r.title = p.target
+        where (r.title is null or r.target is not null)
+          and t in (select target from linkstats)
+        order by t, p.source
+    ''')
+    # An article may link to an entity through several redirects.
+    c.executemany('''insert into inlinks values (?, ?)''',
+                  ((target, sqlite3.Binary(ids_tobytes(
+                      sorted(set(source for _, source in group)))))
+                   for target, group in groupby(edges, lambda e: e[0])))
     db.commit()
 
 
-class Db(object):
-    def __init__(self, fname):
-        self.db_fname = fname
-        self.db = ""
-        
-    
-    def connect(self):
-        try:
-            self.db = sqlite3.connect(self.db_fname)
-        except sqlite3.OperationalError as e:
-            if 'unable to open' in str(e):
-                # This exception doesn't store the path.
-                die("%s: %r" % (e, self.db_fname))
-            else:
-                raise
-    
-    def disconnect(self):
-        if self.db:
-            self.db.close()
-    
-    def setup(self):
-        logger.info("Creating database at %r" % self.db_fname)
-        with open(createtables_path()) as f:
-            create = f.read()
-
-            c = self.db.cursor()
-            try:
-                c.executescript(create)
-            except sqlite3.OperationalError as e:
-                if re.search(r'table .* already exists', str(e)):
-                    die("database %r already populated" % self.db_fname)
-                else:
-                    raise
+def prune_linkstats(db, min_link_count=1, min_anchor_links=1,
+                    min_target_inlinks=1):
+    """Remove rare anchors and senses from the linkstats table.
+
+    A row is removed if its count is below `min_link_count`, if the total
+    number of links with its anchor is below `min_anchor_links`, or if the
+    total number of links to its target is below `min_target_inlinks`.
+    All totals are computed before anything is removed.
+
+    Returns
+    -------
+    report : dict
+        The number of rows before pruning (``rows``), the number of rows
+        removed in total (``removed``) and per criterion (``link_count``,
+        ``anchor_links``, ``target_inlinks``; these may overlap), and the
+        approximate number of bytes of row data removed (``bytes``).
+    """
+    c = db.cursor()
+    c.executescript('''
+        create temp table anchor_links as
+            select ngram_id, sum(count) as total from linkstats
+            group by ngram_id;
+        create temp table target_inlinks as
+            select target, sum(count) as total from linkstats
+            group by target;
+        create unique index temp.target_inlinks_target
+            on target_inlinks(target);
+        create temp table pruned (ngram_id integer, target text,
+                                  link_count, anchor_links, target_inlinks,
+                                  primary key (ngram_id, target));
+    ''')
+    c.execute('''
+        insert into pruned
+            select l.ngram_id, l.target, l.count < :link,
+                   a.total < :anchor, t.total < :target
+            from linkstats as l
+                join anchor_links as a on a.ngram_id = l.ngram_id
+                join target_inlinks as t on t.target = l.target
+            where l.count < :link or a.total < :anchor or t.total < :target
+    ''', {'link': min_link_count, 'anchor': min_anchor_links,
+          'target': min_target_inlinks})
+
+    report = {'rows': next(c.execute('select count(*) from linkstats'))[0]}
+    row = next(c.execute('''
+        select count(*), total(link_count), total(anchor_links),
+               total(target_inlinks),
+               -- two 8-byte integers plus the target string
+               total(16 + length(cast(target as blob)))
+        from pruned
+    '''))
+    report.update(zip(['removed', 'link_count', 'anchor_links',
+                       'target_inlinks', 'bytes'], map(int, row)))
+
+    c.executescript('''
+        delete from linkstats
+            where exists (select 1 from pruned as p
+                          where p.ngram_id = linkstats.ngram_id
+                            and p.target = linkstats.target);
+        drop table anchor_links;
+        drop table target_inlinks;
+        drop table pruned;
+    ''')
+    db.commit()
+
+    _logger.info("Pruned %(removed)d of %(rows)d linkstats rows "
+                 "(~%(bytes)d bytes): %(link_count)d below min_link_count, "
+                 "%(anchor_links)d below min_anchor_links, "
+                 "%(target_inlinks)d below min_target_inlinks", report)
+    return report
+
@@ -4,6 +4,16 @@ Parse Wikidump
 Reads in a Wikipedia snapshot file, or downloads it if it doesn't exist locally.
 Then it attempts to parse it and store it in an SQL3 database, which it first
 initializes.
+
+With --page-ids, only a range of pages is processed and the result is a shard
+that can be merged with other shards using
+
+    python -m semanticizest.parse_wikidump merge <model> <shard>...
+
+With --incremental, the model can later be updated from a newer dump,
+reparsing only the pages that changed, using
+
+    python -m semanticizest.parse_wikidump update <model> <snapshot>
 """
 from __future__ import print_function
 
@@ -17,9 +27,8 @@ from six.moves.urllib.error import HTTPError
 from six.moves.urllib.request import urlretrieve
 
 import argparse
-from docopt import docopt
 
-from . import parse_dump, Db
+from . import merge_shards, parse_dump, update_model
 from .._semanticizer import createtables_path
 
 
@@ -48,23 +57,147 @@ def die(msg):
     sys.exit(1)
 
 
-if __name__ == '__main__':
+class Db(object):
+    def __init__(self, fname):
+        self.db_fname = fname
+        self.db = ""
+
+    def connect(self):
+        try:
+            self.db = sqlite3.connect(self.db_fname)
+        except sqlite3.OperationalError as e:
+            if 'unable to open' in str(e):
+                # This exception doesn't store the path.
+                die("%s: %r" % (e, self.db_fname))
+            else:
+                raise
+
+    def disconnect(self):
+        if self.db:
+            self.db.close()
+
+    def setup(self):
+        logger.info("Creating database at %r" % self.db_fname)
+        with open(createtables_path()) as f:
+            create = f.read()
+
+            c = self.db.cursor()
+            try:
+                c.executescript(create)
+            except sqlite3.OperationalError as e:
+                if re.search(r'table .* already exists', str(e)):
+                    die("database %r already populated" % self.db_fname)
+                else:
+                    raise
+
+
+def _sketch_size(s):
+    width, depth = s.split('x')
+    return int(width), int(depth)
+
+
+def _page_range(s):
+    start, stop = s.split(':')
+    return (int(start) if start else None, int(stop) if stop else None)
+
+
+def merge_main(argv):
+    parser = argparse.ArgumentParser(prog="semanticizer.parse_wikidump merge", description="Merge shards built with --page-ids")
+    parser.add_argument('model',
+                        help='File to store the merged model.')
+    parser.add_argument('shards', nargs='+',
+                        help='Shard files to merge.')
+    _add_pruning_arguments(parser)
+    args = parser.parse_args(argv)
+
+    db = Db(args.model)
+    db.connect()
+    db.setup()
+
+    merge_shards(args.shards, db.db,
+                 min_link_count=args.min_link_count,
+                 min_anchor_links=args.min_anchor_links,
+                 min_target_inlinks=args.min_target_inlinks)
+
+    db.disconnect()
+
+
+def update_main(argv):
+    parser = argparse.ArgumentParser(prog="semanticizer.parse_wikidump update", description="Update a model built with --incremental from a newer snapshot")
+    parser.add_argument('model',
+                        help='Model to update in place.')
+    parser.add_argument('snapshot',
+                        help='Local Wikipedia snapshot to update from.')
+    parser.add_argument('--decompressor', dest='decompressor', default='auto',
+                        help='How to decompress the snapshot; see the main command [default: auto].')
+    args = parser.parse_args(argv)
+    if args.decompressor == 'none':
+        args.decompressor = None
+
+    db = Db(args.model)
+    db.connect()
+    try:
+        update_model(args.snapshot, db.db, decompressor=args.decompressor)
+    except ValueError as e:
+        die("%s: %r" % (e, args.model))
+    db.disconnect()
+
+
+def _add_pruning_arguments(parser):
+    parser.add_argument('--min-link-count', dest='min_link_count',
+                        default=1, type=int,
+                        help='Drop anchor/target pairs seen fewer times [default: 1].')
+    parser.add_argument('--min-anchor-links', dest='min_anchor_links',
+                        default=1, type=int,
+                        help='Drop anchors with fewer links in total [default: 1].')
+    parser.add_argument('--min-target-inlinks', dest='min_target_inlinks',
+                        default=1, type=int,
+                        help='Drop targets with fewer inlinks in total [default: 1].')
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv[:1] == ['merge']:
+        return merge_main(argv[1:])
+    if argv[:1] == ['update']:
+        return update_main(argv[1:])
+
     parser = argparse.ArgumentParser(prog="semanticizer.parse_wikidump", description="Semanticizest Wiki parser")
-    parser.add_argument('snapshot', 
+    parser.add_argument('snapshot',
                         help='Local Wikipedia snapshot to use.')
-    parser.add_argument('model', 
+    parser.add_argument('model',
                         help='File to store the model.')
     parser.add_argument('--download', dest='download', action="store_true",
                         help='Download snapshot if it does not exist as snapshot.xml.bz2. The corpus file name should match that of snapshot.')
     parser.add_argument('-N', '--ngram', dest='ngram', default=7, type=int,
                         help='Maximum order of ngrams, set to None to disable [default: 7].')
-    args = parser.parse_args()
+    parser.add_argument('--page-ids', dest='page_ids', type=_page_range,
+                        help='Build a shard from the pages with ids in START:STOP (half-open, either may be empty).')
+    parser.add_argument('--decompressor', dest='decompressor', default='auto',
+                        help='How to decompress the snapshot: auto, thread, none, or the name of a parallel decompressor such as lbzip2, pbzip2 or pigz [default: auto].')
+    parser.add_argument('--countmin', dest='countmin', type=_sketch_size,
+                        help='Count n-grams approximately in count-min sketches of WIDTHxDEPTH counters.')
+    parser.add_argument('--sample', dest='sample', type=float,
+                        help='Only process this fraction of the articles, picked deterministically by page id; redirects are all kept.')
+    parser.add_argument('--scale', dest='scale', action='store_true',
+                        help='With --sample, scale counts up to estimates for the full snapshot.')
+    parser.add_argument('--incremental', dest='incremental', action='store_true',
+                        help='Keep per-page statistics, so that the model can be updated from newer snapshots.')
+    parser.add_argument('--link-graph', dest='link_graph', action='store_true',
+                        help='Store which articles link to each entity, for relatedness.')
+    _add_pruning_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.decompressor == 'none':
+        args.decompressor = None
+    if args.scale and args.sample is None:
+        parser.error("--scale requires --sample")
 
     try:
         fh = open(args.snapshot, 'r')
     except (IOError, OSError) as e:
         if e.errno == errno.ENOENT and args.download:
-            m = re.match(r"(.+?)\.xml")
+            m = re.match(r"(.+?)\.xml", args.snapshot)
             if m:
                 args.snapshot = m.group(1)
             url = DUMP_TEMPLATE.format(args.snapshot)
@@ -78,15 +211,25 @@ if __name__ == '__main__':
             raise
     else:
         fh.close()
-    
+
     # Init, connect to DB and setup db schema
     db = Db(args.model)
     db.connect()
     db.setup()
-    
+
     # Parse wiki snapshot and store it to DB
-    parse_dump(args.snapshot, db.db, N=args.ngram)
-    
+    parse_dump(args.snapshot, db.db, N=args.ngram,
+               min_link_count=args.min_link_count,
+               min_anchor_links=args.min_anchor_links,
+               min_target_inlinks=args.min_target_inlinks,
+               page_ids=args.page_ids, finalize=args.page_ids is None,
+               decompressor=args.decompressor, countmin=args.countmin,
+               link_graph=args.link_graph, incremental=args.incremental,
+               sample=args.sample, scale=args.scale)
+
     # Close connection to DB and exit
     db.disconnect()
-    
+
+
+if __name__ == '__main__':
+    main()
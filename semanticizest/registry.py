@@ -0,0 +1,345 @@
+"""Registry of semanticizers for several models, within a memory budget.
+
+A service that links entities in many languages needs a model per
+language, but may not have the memory to keep all of them loaded, while
+loading a model per request is far too slow. ``ModelRegistry`` loads
+models on demand, keeps as many as fit in a memory budget, and evicts the
+least recently used ones to make room.
+
+A long-running process also needs to pick up new models, such as a new
+monthly dump, without a restart that leaves it unable to serve while it
+loads. ``ModelHandle`` loads a new model in the background, while the
+current one keeps serving, and then switches to it.
+"""
+
+from collections import namedtuple, OrderedDict
+import logging
+import threading
+import time
+import weakref
+
+from semanticizest._semanticizer import Semanticizer
+
+
+_logger = logging.getLogger(__name__)
+
+
+RegistryInfo = namedtuple('RegistryInfo',
+                          'hits loads load_time evictions models nbytes '
+                          'max_memory')
+
+SwapInfo = namedtuple('SwapInfo',
+                      'fname loads load_time last_load_time swaps failures '
+                      'retired')
+
+
+class ModelRegistry(object):
+    """Thread-safe registry of semanticizers, loaded on demand.
+
+    Parameters
+    ----------
+    models : dict
+        Filenames of stored models, by key (e.g., language code).
+    max_memory : int, optional
+        Budget, in bytes, for all loaded models together, as estimated by
+        ``Semanticizer.memory_report`` when each is loaded. When a model
+        is loaded, the least recently used ones are evicted until the rest
+        fit. A model larger than the budget is still loaded, on its own.
+        Without a budget, models are never evicted.
+
+        Loads in progress count towards the budget at the size their model
+        had when it was last loaded; a load that would not fit next to the
+        others waits for them. A model that was not loaded before is
+        loaded on its own, since its size is not known until then.
+
+    Further keyword arguments are passed to ``Semanticizer`` for every
+    model.
+
+    Notes
+    -----
+    Evicting a model only drops the registry's reference to it; threads
+    that got it from ``get`` can keep using it. Memory used by structures
+    that a semanticizer builds after loading (such as its sentence cache,
+    or ``entities``) is not counted.
+    """
+
+    def __init__(self, models, max_memory=None, **kwargs):
+        self.models = dict(models)
+        self.max_memory = max_memory
+        self._kwargs = kwargs
+
+        # Loaded semanticizers and their sizes, least recently used first.
+        self._loaded = OrderedDict()
+        # Sizes of models seen before, to make room before reloading them.
+        self._sizes = {}
+        # Loads in progress, by key: (event, [semanticizer or exception]),
+        # and the memory reserved for them.
+        self._loading = {}
+        self._reserved = {}
+        self._lock = threading.Lock()
+        # Notified whenever a load finishes.
+        self._load_done = threading.Condition(self._lock)
+
+        self.hits = self.loads = self.evictions = 0
+        self.load_time = 0.
+
+    def __contains__(self, key):
+        return key in self.models
+
+    def get(self, key):
+        """The semanticizer for key, loading it if necessary.
+
+        If another thread is already loading it, waits for that load
+        rather than starting another. Waits, too, if loading it now would
+        exceed ``max_memory`` together with other loads in progress.
+
+        Raises
+        ------
+        KeyError
+            If key is not in ``models``.
+        """
+        fname = self.models[key]
+        with self._lock:
+            while True:
+                found = self._loaded.pop(key, None)
+                if found is not None:
+                    self._loaded[key] = found
+                    self.hits += 1
+                    return found[0]
+                loading = self._loading.get(key)
+                if loading is not None:
+                    owner = False
+                    break
+                nbytes = self._sizes.get(key)
+                if self._can_start(nbytes):
+                    loading = self._loading[key] = threading.Event(), []
+                    self._make_room(nbytes or 0)
+                    self._reserved[key] = (self.max_memory if nbytes is None
+                                           else nbytes)
+                    owner = True
+                    break
+                self._load_done.wait()
+
+        event, result = loading
+        if not owner:
+            event.wait()
+            if isinstance(result[0], Exception):
+                raise result[0]
+            return result[0]
+
+        try:
+            start = time.time()
+            sem = Semanticizer(fname, **self._kwargs)
+            nbytes = sem.memory_report()['total']
+            elapsed = time.time() - start
+        except Exception as e:
+            result.append(e)
+            with self._lock:
+                del self._loading[key]
+                del self._reserved[key]
+                self._load_done.notify_all()
+            event.set()
+            raise
+
+        _logger.info("Loaded model %r from %r in %.1f s (%d bytes)",
+                     key, fname, elapsed, nbytes)
+        with self._lock:
+            self.loads += 1
+            self.load_time += elapsed
+            self._sizes[key] = nbytes
+            del self._reserved[key]
+            self._make_room(nbytes)
+            self._loaded[key] = sem, nbytes
+            del self._loading[key]
+            self._load_done.notify_all()
+        result.append(sem)
+        event.set()
+        return sem
+
+    __getitem__ = get
+
+    def _can_start(self, nbytes):
+        """Whether a load of nbytes (None if unknown) can start now.
+
+        Must be called with the lock held.
+        """
+        if self.max_memory is None or not self._reserved:
+            return True
+        return (nbytes is not None and
+                sum(self._reserved.values()) + nbytes <= self.max_memory)
+
+    def _make_room(self, nbytes):
+        """Evict models until nbytes more fit in the budget.
+
+        Memory reserved for loads in progress is counted as used. Must be
+        called with the lock held.
+        """
+        if self.max_memory is None:
+            return
+        used = (sum(size for _, size in self._loaded.values()) +
+                sum(self._reserved.values()))
+        while self._loaded and used + nbytes > self.max_memory:
+            key, (_, size) = self._loaded.popitem(last=False)
+            used -= size
+            self.evictions += 1
+            _logger.info("Evicted model %r (%d bytes)", key, size)
+
+    def evict(self, key):
+        """Drop the semanticizer for key, if it is loaded."""
+        with self._lock:
+            if self._loaded.pop(key, None) is not None:
+                self.evictions += 1
+
+    def loaded(self):
+        """Keys of the loaded models, least recently used first."""
+        with self._lock:
+            return list(self._loaded)
+
+    def info(self):
+        """Statistics of the registry.
+
+        Returns
+        -------
+        info : RegistryInfo
+            Named tuple of the number of ``get`` calls served by a loaded
+            model (``hits``), the number of ``loads`` and the total time
+            they took in seconds (``load_time``), the number of
+            ``evictions``, the number of loaded ``models`` and their
+            estimated memory use (``nbytes``), and ``max_memory``.
+        """
+        with self._lock:
+            return RegistryInfo(self.hits, self.loads, self.load_time,
+                                self.evictions, len(self._loaded),
+                                sum(size for _, size in
+                                    self._loaded.values()),
+                                self.max_memory)
+
+
+class ModelHandle(object):
+    """Handle on the current semanticizer of a long-running process.
+
+    The current semanticizer can be replaced by one for a new model (or the
+    same model file, replaced on disk) at any time, atomically: ``get``
+    returns either the old or the new one, never a half-loaded one.
+
+    Parameters
+    ----------
+    fname : string
+        Filename of the stored model to load first. It is loaded before
+        the constructor returns.
+
+    Further keyword arguments are passed to ``Semanticizer`` for every
+    model.
+
+    Notes
+    -----
+    Callers should call ``get`` once per request and use that semanticizer
+    throughout, so that a request in progress when the model is swapped
+    finishes on the old one. The old model's memory is released when the
+    last such request is done; ``info`` reports how many replaced models
+    are still in memory.
+
+    A stored model must not be modified while it is in use (see
+    ``Semanticizer``). To update a model file in place, move the new one
+    over it, then swap.
+    """
+
+    def __init__(self, fname, **kwargs):
+        self._kwargs = kwargs
+        self._lock = threading.Lock()
+        # Only one load at a time; a swap requested during a load waits.
+        self._load_lock = threading.Lock()
+        # Replaced semanticizers that are still referenced somewhere.
+        self._retired = weakref.WeakValueDictionary()
+
+        self.loads = self.swaps = self.failures = 0
+        self.load_time = 0.
+        self.last_load_time = None
+        self.fname = fname
+        self._current = self._load(fname)
+
+    def get(self):
+        """The current semanticizer."""
+        return self._current
+
+    def swap(self, fname=None, background=True):
+        """Load a model and make it the current one.
+
+        Parameters
+        ----------
+        fname : string, optional
+            Filename of the stored model. Defaults to that of the current
+            one, so that a model file replaced on disk is reloaded.
+        background : boolean, optional
+            Load in a new thread and return at once. Otherwise, load in
+            the calling thread and raise any exception from loading. Either
+            way, the current semanticizer is used until the new one is
+            ready, and kept if loading fails.
+
+        Returns
+        -------
+        result : {threading.Thread, Semanticizer}
+            The loading thread, which can be joined to wait for the swap,
+            or, if not background, the new semanticizer.
+        """
+        if fname is None:
+            fname = self.fname
+        if not background:
+            return self._swap(fname)
+
+        def swap():
+            try:
+                self._swap(fname)
+            except Exception:
+                _logger.exception("Failed to load model %r; keeping %r",
+                                  fname, self.fname)
+        thread = threading.Thread(target=swap)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def _swap(self, fname):
+        with self._load_lock:
+            try:
+                sem = self._load(fname)
+            except Exception:
+                with self._lock:
+                    self.failures += 1
+                raise
+            with self._lock:
+                old, old_fname = self._current, self.fname
+                self._current, self.fname = sem, fname
+                self.swaps += 1
+                self._retired[id(old)] = old
+            del old
+        _logger.info("Swapped model %r for %r", old_fname, fname)
+        return sem
+
+    def _load(self, fname):
+        start = time.time()
+        sem = Semanticizer(fname, **self._kwargs)
+        elapsed = time.time() - start
+        _logger.info("Loaded model %r in %.1f s", fname, elapsed)
+        with self._lock:
+            self.loads += 1
+            self.load_time += elapsed
+            self.last_load_time = elapsed
+        return sem
+
+    def info(self):
+        """Statistics of the handle.
+
+        Returns
+        -------
+        info : SwapInfo
+            Named tuple of the filename of the current model (``fname``),
+            the number of ``loads``, their total time and that of the last
+            one in seconds (``load_time``, ``last_load_time``), the number
+            of ``swaps`` and of loads that failed (``failures``), and the
+            number of replaced semanticizers that are still in memory
+            (``retired``), because a request is still using them.
+        """
+        with self._lock:
+            return SwapInfo(self.fname, self.loads, self.load_time,
+                            self.last_load_time, self.swaps, self.failures,
+                            len(self._retired))
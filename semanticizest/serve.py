@@ -0,0 +1,438 @@
+"""
+HTTP server for semanticizest models.
+
+Usage: python -m semanticizest.serve <model> [--host HOST] [--port PORT]
+                                             [--workers N] [--cache-size C]
+
+The model is loaded once, before forking the worker processes, so that they
+share its memory. Workers accept HTTP/1.1 keep-alive connections.
+
+On SIGHUP, every worker reloads the model file in the background and
+switches to it once it is loaded; requests in progress finish on the old
+model. To roll out a new model, move it over the model file (don't modify
+the file in place), then send SIGHUP to the server. After a reload, the
+workers no longer share the model's memory.
+
+POST /candidates
+    The request body is a JSON list of documents, each either a string or a
+    list of tokens. The response is streamed as JSON lines, one per document,
+    each a list of candidates [start, end, target, probability] as returned
+    by ``Semanticizer.all_candidates``. If a document cannot be processed,
+    the response ends with a line {"error": message} in its place.
+
+GET /metrics
+    Request and document counts, errors, latency statistics, sentence
+    cache statistics (see --cache-size) and model load and swap statistics,
+    summed over all workers, as a JSON object.
+"""
+
+from __future__ import print_function
+
+import argparse
+from bisect import bisect_left
+import errno
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+
+import six
+from six.moves import BaseHTTPServer, socketserver, xrange
+
+from semanticizest.registry import ModelHandle
+
+
+logger = logging.getLogger('semanticizest')
+
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+_LATENCY_BUCKETS = (.001, .002, .005, .01, .02, .05, .1, .2, .5, 1., 2., 5.,
+                    float('inf'))
+
+_COUNTERS = ('requests', 'documents', 'errors', 'latency_sum', 'loads',
+             'load_time_sum', 'swaps', 'swap_errors')
+# Per-worker values, overwritten rather than incremented.
+_GAUGES = ('cache_hits', 'cache_misses', 'cache_size', 'cache_bytes')
+
+
+class Metrics(object):
+    """Request metrics, kept in shared memory.
+
+    Every worker process counts in its own slot, so that workers never
+    contend for a lock; ``snapshot`` sums over the slots.
+
+    Parameters
+    ----------
+    n_workers : int
+        Number of worker processes that will record metrics.
+    """
+
+    def __init__(self, n_workers=1):
+        self._width = len(_COUNTERS) + len(_GAUGES) + len(_LATENCY_BUCKETS)
+        self._counts = multiprocessing.RawArray('d', n_workers * self._width)
+        self._lock = threading.Lock()
+        self.start_time = time.time()
+        # Slot of the current process; set by the worker after forking.
+        self.worker = 0
+
+    def record(self, n_documents, latency, error=False, cache_info=None):
+        """Count a request for n_documents that took latency seconds.
+
+        cache_info, if given, is the worker's current
+        ``Semanticizer.cache_info()``.
+        """
+        counts = self._counts
+        offset = self.worker * self._width
+        histogram = offset + len(_COUNTERS) + len(_GAUGES)
+        bucket = bisect_left(_LATENCY_BUCKETS, latency)
+        with self._lock:
+            counts[offset] += 1
+            counts[offset + 1] += n_documents
+            counts[offset + 2] += bool(error)
+            counts[offset + 3] += latency
+            counts[histogram + bucket] += 1
+            if cache_info is not None:
+                gauges = offset + len(_COUNTERS)
+                counts[gauges] = cache_info.hits
+                counts[gauges + 1] = cache_info.misses
+                counts[gauges + 2] = cache_info.currsize
+                counts[gauges + 3] = cache_info.nbytes
+
+    def record_load(self, load_time, swap=False, error=False):
+        """Count a model load that took load_time seconds.
+
+        swap means that it replaced the current model; error, that it
+        failed, so that the current model is still in use.
+        """
+        counts = self._counts
+        offset = self.worker * self._width
+        with self._lock:
+            if error:
+                counts[offset + 7] += 1
+                return
+            counts[offset + 4] += 1
+            counts[offset + 5] += load_time
+            counts[offset + 6] += bool(swap)
+
+    def snapshot(self):
+        """Metrics summed over all workers, as a dict."""
+        width = self._width
+        totals = [sum(self._counts[i::width]) for i in xrange(width)]
+        counters = dict(zip(_COUNTERS + _GAUGES, totals))
+        histogram = totals[len(_COUNTERS) + len(_GAUGES):]
+
+        n = counters['requests']
+        latency = {'mean': counters.pop('latency_sum') / n if n else None,
+                   'buckets': [[_bound(b), int(c)] for b, c
+                               in zip(_LATENCY_BUCKETS, histogram)]}
+        for p in (50, 90, 99):
+            latency['p%d' % p] = _percentile(histogram, p / 100.)
+
+        loads = counters['loads']
+        load_time = counters.pop('load_time_sum') / loads if loads else None
+
+        metrics = dict((k, int(v)) for k, v in six.iteritems(counters))
+        metrics['latency'] = latency
+        metrics['load_time_mean'] = load_time
+        lookups = metrics['cache_hits'] + metrics['cache_misses']
+        metrics['cache_hit_rate'] = (metrics['cache_hits'] / float(lookups)
+                                     if lookups else None)
+        metrics['uptime'] = time.time() - self.start_time
+        return metrics
+
+
+def _bound(b):
+    # JSON has no infinity.
+    return None if b == float('inf') else b
+
+
+def _percentile(histogram, p):
+    """Upper bound of the histogram bucket holding the p'th quantile."""
+    total = sum(histogram)
+    if not total:
+        return None
+    seen = 0
+    for bound, count in zip(_LATENCY_BUCKETS, histogram):
+        seen += count
+        if seen >= p * total:
+            return _bound(bound)
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Responses are streamed in small writes.
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self._send_json(200, self.server.metrics.snapshot())
+        else:
+            self._send_json(404, {'error': 'not found: %s' % self.path})
+
+    def do_POST(self):
+        if self.path != '/candidates':
+            # Read the body, or it would be taken for the next request.
+            self._read_body()
+            self._send_json(404, {'error': 'not found: %s' % self.path})
+            return
+
+        metrics = self.server.metrics
+        start = time.time()
+        try:
+            docs = self._read_documents()
+        except ValueError as e:
+            metrics.record(0, time.time() - start, error=True)
+            self._send_json(400, {'error': str(e)})
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        # The model to use throughout, even if another is swapped in.
+        sem = self.server.get_semanticizer()
+        done = 0
+        try:
+            for doc in docs:
+                line = json.dumps(list(sem.all_candidates(doc))) + '\n'
+                self._write_chunk(line.encode('utf-8'))
+                done += 1
+        except Exception as e:
+            # Too late for an error status; end the stream with the error.
+            logger.exception("Error on document %d of %d", done + 1,
+                             len(docs))
+            metrics.record(done, time.time() - start, error=True)
+            try:
+                line = json.dumps({'error': str(e)}) + '\n'
+                self._write_chunk(line.encode('utf-8'))
+                self._write_chunk(b'')
+            except (IOError, OSError):
+                self.close_connection = True
+            return
+        # Record before the final chunk, so that a client that has read the
+        # full response sees its request in the metrics.
+        metrics.record(len(docs), time.time() - start,
+                       cache_info=sem.cache_info())
+        self._write_chunk(b'')
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length)
+
+    def _read_documents(self):
+        try:
+            docs = json.loads(self._read_body().decode('utf-8'))
+        except UnicodeDecodeError:
+            raise ValueError("request body is not UTF-8")
+        if not isinstance(docs, list):
+            raise ValueError("expected a list of documents")
+        for doc in docs:
+            if not (isinstance(doc, six.string_types) or
+                    isinstance(doc, list) and
+                    all(isinstance(t, six.string_types) for t in doc)):
+                raise ValueError("a document should be a string or a list"
+                                 " of strings, got %r" % (doc,))
+        return docs
+
+    def _send_json(self, code, obj):
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data):
+        self.wfile.write(('%x\r\n' % len(data)).encode('ascii') + data
+                         + b'\r\n')
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+class _Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def make_server(semanticizer, host='127.0.0.1', port=8080, metrics=None):
+    """Create an HTTP server for a semanticizer, without starting it.
+
+    Parameters
+    ----------
+    semanticizer : {Semanticizer, ModelHandle}
+        The semanticizer to serve, or a handle on it, through which it can
+        be swapped for another while serving.
+    host : string
+    port : int
+        Port to listen on; 0 picks a free port (see ``server_address``).
+    metrics : Metrics, optional
+
+    Returns
+    -------
+    server : socketserver.TCPServer
+        Call its ``serve_forever`` method to handle requests. Every
+        connection is handled in a thread of its own.
+    """
+    server = _Server((host, port), _Handler)
+    if isinstance(semanticizer, ModelHandle):
+        server.get_semanticizer = semanticizer.get
+    else:
+        server.get_semanticizer = lambda: semanticizer
+    server.metrics = Metrics() if metrics is None else metrics
+    return server
+
+
+def _reload(handle, metrics):
+    """Swap in a fresh load of the model in the background.
+
+    Returns the loading thread.
+    """
+    def reload():
+        start = time.time()
+        try:
+            handle.swap(background=False)
+        except Exception:
+            metrics.record_load(time.time() - start, error=True)
+            logger.exception("Reloading %r failed; serving the old model",
+                             handle.fname)
+        else:
+            metrics.record_load(handle.info().last_load_time, swap=True)
+    logger.info("Reloading %r", handle.fname)
+    thread = threading.Thread(target=reload)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def serve(fname, host='127.0.0.1', port=8080, n_workers=1, cache_size=0):
+    """Serve a stored model over HTTP until interrupted.
+
+    Parameters
+    ----------
+    fname : string
+        Filename of the stored model.
+    host : string
+    port : int
+    n_workers : int
+        Number of worker processes. The model is loaded before forking, so
+        the workers share its memory. Platforms without fork get one.
+    cache_size : int
+        Size of the sentence cache of each worker; see ``Semanticizer``.
+    """
+    handle = ModelHandle(fname, cache_size=cache_size)
+    if n_workers > 1 and not hasattr(os, 'fork'):
+        logger.warning("cannot fork worker processes on this platform")
+        n_workers = 1
+
+    metrics = Metrics(n_workers)
+    metrics.record_load(handle.info().last_load_time)
+    server = make_server(handle, host, port, metrics)
+    logger.info("Serving %r on http://%s:%d/ with %d worker(s)",
+                fname, server.server_address[0], server.server_address[1],
+                n_workers)
+
+    if n_workers == 1:
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP,
+                          lambda signum, frame: _reload(handle, metrics))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return
+
+    children = []
+    for i in xrange(n_workers):
+        pid = os.fork()
+        if pid == 0:
+            metrics.worker = i
+            # SQLite connections must not be shared with the parent.
+            handle.get()._local = threading.local()
+            signal.signal(signal.SIGHUP,
+                          lambda signum, frame: _reload(handle, metrics))
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                os._exit(0)
+        children.append(pid)
+
+    # The parent doesn't serve; once the workers have swapped models, its
+    # reference would be all that keeps the old one in memory.
+    server.get_semanticizer = handle = None
+
+    # Have the workers reload on SIGHUP, and take them down with us on
+    # SIGTERM, too.
+    signal.signal(signal.SIGHUP, lambda signum, frame: _forward(children,
+                                                                 signum))
+    signal.signal(signal.SIGTERM, _exit)
+    try:
+        for pid in children:
+            _waitpid(pid)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        server.server_close()
+
+
+def _exit(signum, frame):
+    sys.exit(0)
+
+
+def _waitpid(pid):
+    # Python 2 doesn't retry system calls interrupted by a signal (SIGHUP).
+    while True:
+        try:
+            return os.waitpid(pid, 0)
+        except OSError as e:
+            if e.errno != errno.EINTR:
+                raise
+
+
+def _forward(children, signum):
+    for pid in children:
+        try:
+            os.kill(pid, signum)
+        except OSError:
+            pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="semanticizest.serve",
+                                     description="Serve a semanticizest"
+                                                 " model over HTTP")
+    parser.add_argument('model',
+                        help='Stored model to serve.')
+    parser.add_argument('--host', dest='host', default='127.0.0.1',
+                        help='Address to listen on [default: 127.0.0.1].')
+    parser.add_argument('--port', dest='port', default=8080, type=int,
+                        help='Port to listen on [default: 8080].')
+    parser.add_argument('--workers', dest='workers', default=1, type=int,
+                        help='Number of worker processes [default: 1].')
+    parser.add_argument('--cache-size', dest='cache_size', default=0,
+                        type=int,
+                        help='Number of sentences to cache per worker'
+                             ' [default: 0].')
+    args = parser.parse_args(argv)
+
+    logger.addHandler(logging.StreamHandler(sys.stderr))
+    logger.setLevel('INFO')
+    serve(args.model, args.host, args.port, args.workers, args.cache_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+from os.path import dirname, join
+from tempfile import NamedTemporaryFile
+
+from nose import SkipTest
+from nose.tools import assert_equal, assert_less
+import six
+
+from semanticizest import Semanticizer
+from semanticizest._semanticizer import create_model
+
+
+def test_async_semanticizer():
+    if six.PY2:
+        raise SkipTest
+    import asyncio
+    from semanticizest.aio import AsyncSemanticizer
+
+    tempfile = NamedTemporaryFile()
+    create_model(join(dirname(__file__),
+                      'nlwiki-20140927-pages-articles-sample.xml'),
+                 tempfile.name)
+    sem = Semanticizer(tempfile.name)
+
+    with open(join(dirname(__file__), 'nlwiki', 'in', 'Alpen')) as f:
+        tokens = f.read().split()
+    docs = [tokens[i:i + 50] for i in range(0, len(tokens), 10)]
+    expected = [list(sem.all_candidates(doc)) for doc in docs]
+
+    loop = asyncio.new_event_loop()
+    asem = AsyncSemanticizer(sem, max_batch_size=8, max_delay=.01, loop=loop)
+    try:
+        futures = [asem.all_candidates(doc) for doc in docs]
+        actual = loop.run_until_complete(asyncio.gather(*futures))
+    finally:
+        asem.close()
+        loop.close()
+
+    assert_equal(expected, actual)
+    assert_equal(asem.n_requests, len(docs))
+    assert_less(asem.n_batches, len(docs))
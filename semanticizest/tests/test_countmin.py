@@ -0,0 +1,64 @@
+from collections import Counter
+import random
+import sqlite3
+import struct
+
+from nose.tools import assert_equal, assert_greater_equal, assert_raises
+
+from semanticizest._countmin import CountMinSketch, load_sketch, save_sketch
+from semanticizest._semanticizer import createtables_path
+
+
+def _random_counts(n, seed):
+    rng = random.Random(seed)
+    return Counter(u"key%d" % rng.randint(0, n) for _ in range(10 * n))
+
+
+def test_countmin_overestimates():
+    counts = _random_counts(1000, 42)
+    sketch = CountMinSketch(4096, 4)
+    for key, count in counts.items():
+        sketch.add(key, count)
+
+    for key, count in counts.items():
+        assert_greater_equal(sketch[key], count)
+
+    exact = sum(1 for key, count in counts.items() if sketch[key] == count)
+    assert_greater_equal(exact, len(counts) // 2)
+
+
+def test_countmin_merge():
+    a, b = CountMinSketch(64, 3), CountMinSketch(64, 3)
+    a.add(u"foo", 3)
+    b.add(u"foo", 2)
+    b.add(u"bar")
+    a.merge(b)
+    assert_greater_equal(a[u"foo"], 5)
+    assert_greater_equal(a[u"bar"], 1)
+
+    assert_raises(ValueError, a.merge, CountMinSketch(32, 3))
+
+
+def test_countmin_persistence():
+    db = sqlite3.connect(':memory:')
+    with open(createtables_path()) as create:
+        db.executescript(create.read())
+
+    sketch = CountMinSketch(100, 5)
+    for key, count in _random_counts(100, 1).items():
+        sketch.add(key, count)
+    save_sketch(db, 'tf', sketch)
+
+    loaded = load_sketch(db, 'tf')
+    assert_equal((loaded.width, loaded.depth), (100, 5))
+    assert_equal(list(loaded.counts), list(sketch.counts))
+    assert_equal(load_sketch(db, 'df'), None)
+
+
+def test_countmin_byte_format():
+    # Little-endian 8-byte counters, whatever the platform.
+    sketch = CountMinSketch(2, 1)
+    sketch.counts[1] = 1 << 40
+    assert_equal(sketch.tobytes(), struct.pack('<qq', 0, 1 << 40))
+    loaded = CountMinSketch(2, 1, struct.pack('<qq', 7, 1 << 40))
+    assert_equal(list(loaded.counts), [7, 1 << 40])
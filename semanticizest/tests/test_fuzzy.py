@@ -0,0 +1,71 @@
+from os.path import dirname, join
+import shutil
+from tempfile import mkdtemp
+
+from nose.tools import assert_equal, assert_raises, assert_true
+
+from semanticizest import Semanticizer
+from semanticizest._fuzzy import _distance, build_fuzzy_index
+from semanticizest._semanticizer import create_model
+
+
+def test_distance():
+    for a, b, d in [(u'planeet', u'planeet', 0), (u'planeet', u'planet', 1),
+                    (u'Mars', u'Mras', 1), (u'Mars', u'Msra', 2),
+                    (u'', u'ab', 2), (u'abc', u'xyz', 3)]:
+        assert_equal(_distance(a, b, 3), d)
+        assert_equal(_distance(b, a, 3), d)
+    assert_equal(_distance(u'abc', u'xyz', 1), 2)
+
+
+def test_fuzzy_candidates():
+    tmpdir = mkdtemp()
+    try:
+        model = join(tmpdir, 'model.db')
+        create_model(join(dirname(__file__),
+                          'nlwiki-20140927-pages-articles-sample.xml'), model)
+        sem = Semanticizer(model)
+        assert_raises(IOError, Semanticizer, model, fuzzy=True)
+        assert_raises(ValueError, sem.fuzzy_candidates, u"Mars")
+
+        build_fuzzy_index(model, max_distance=2)
+        fuzzy = Semanticizer(model, fuzzy=True)
+        assert_true(fuzzy.memory_report()['fuzzy'] > 0)
+
+        tokens = u"de planet Mras en Amstredam".split()
+        found = set((i, j, target, d)
+                    for i, j, target, _, d in fuzzy.fuzzy_candidates(tokens))
+        assert_true((1, 2, u'Planeet', 1) in found)
+        assert_true((2, 3, u'Mars (planeet)', 1) in found)
+        assert_true((4, 5, u'Amsterdam', 1) in found)
+        assert_equal(list(fuzzy.fuzzy_candidates(tokens, max_distance=0)),
+                     list(sem.all_candidates(tokens)))
+
+        # Exact matches are as in all_candidates, at distance 0.
+        tokens = u"de planeet Mars en de stad Amsterdam".split()
+        assert_equal([c + (0,) for c in sem.all_candidates(tokens)],
+                     [c for c in fuzzy.fuzzy_candidates(tokens)
+                      if c[4] == 0])
+
+        # With folding, exact matches are as in all_candidates, too.
+        folded = Semanticizer(model, fuzzy=True, fold=True)
+        tokens = u"de PLANEET Mras en de stad Amsterdam".split()
+        assert_equal([c + (0,) for c in folded.all_candidates(tokens)],
+                     [c for c in folded.fuzzy_candidates(tokens)
+                      if c[4] == 0])
+        assert_true((2, 3, u'Mars (planeet)', 1) in
+                    set((i, j, target, d) for i, j, target, _, d
+                        in folded.fuzzy_candidates(tokens)))
+
+        # Every anchor at distance one of a misspelling is found.
+        anchors = list(sem.commonness)
+        for anchor in anchors[::50]:
+            typo = u'x' + anchor[1:]
+            if len(typo) < 4 or typo in sem.commonness:
+                continue
+            expected = sorted((_distance(typo, a, 1), a) for a in anchors
+                              if _distance(typo, a, 1) <= 1)
+            actual = [(d, a) for a, d in fuzzy._fuzzy.lookup(typo, 1)]
+            assert_equal(expected, actual)
+    finally:
+        shutil.rmtree(tmpdir)
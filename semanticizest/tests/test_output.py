@@ -0,0 +1,94 @@
+from glob import glob
+from io import BytesIO, StringIO
+import json
+from os.path import dirname, join
+from tempfile import NamedTemporaryFile
+
+from nose.tools import assert_almost_equal, assert_equal
+import six
+
+from semanticizest import Semanticizer
+from semanticizest._semanticizer import create_model
+from semanticizest.output import read_binary, write_binary, write_jsonl, write_tsv
+
+tempfile = NamedTemporaryFile()
+create_model(join(dirname(__file__),
+                  'nlwiki-20140927-pages-articles-sample.xml'),
+             tempfile.name, N=7)
+sem = Semanticizer(tempfile.name)
+
+docs = []
+for fname in sorted(glob(join(dirname(__file__), 'nlwiki', 'in', '*'))):
+    with open(fname) as f:
+        docs.append(f.read().split())
+docs.insert(1, [])
+
+
+def _expected():
+    return [list(sem.all_candidates(doc)) for doc in docs]
+
+
+def _text_file():
+    return six.BytesIO() if six.PY2 else StringIO()
+
+
+def test_candidate_arrays():
+    candidates = sem.candidate_arrays(docs)
+    assert_equal(candidates.n_docs, len(docs))
+
+    entities = sem.entities
+    assert_equal(entities, sorted(entities))
+    for d, expected in enumerate(_expected()):
+        lo, hi = candidates.document(d)
+        actual = [(candidates.start[k], candidates.end[k],
+                   entities[candidates.entity[k]], candidates.prob[k])
+                  for k in range(lo, hi)]
+        assert_equal(expected, actual)
+
+    # Appending continues the document numbering.
+    lo, hi = candidates.document(0)
+    first = candidates.entity[lo:hi]
+    more = sem.candidate_arrays(docs[:2], out=candidates)
+    assert_equal(more.n_docs, len(docs) + 2)
+    lo, hi = more.document(len(docs))
+    assert_equal(more.entity[lo:hi], first)
+
+
+def test_write_jsonl():
+    candidates = sem.candidate_arrays(docs)
+    f = _text_file()
+    write_jsonl(candidates, f, entities=sem.entities)
+    lines = f.getvalue().splitlines()
+    assert_equal(len(lines), len(docs))
+
+    for d, (line, expected) in enumerate(zip(lines, _expected())):
+        obj = json.loads(line)
+        assert_equal(obj['doc'], d)
+        actual = list(zip(obj['start'], obj['end'], obj['entity'],
+                          obj['prob']))
+        assert_equal(expected, actual)
+
+
+def test_write_tsv():
+    candidates = sem.candidate_arrays(docs)
+    f = _text_file()
+    write_tsv(candidates, f)
+    rows = [line.split('\t') for line in f.getvalue().splitlines()]
+    assert_equal(len(rows), len(candidates))
+    for k in (0, len(rows) // 2, len(rows) - 1):
+        doc, start, end, entity, prob = rows[k]
+        assert_equal(int(doc), candidates.doc[k])
+        assert_equal(int(entity), candidates.entity[k])
+        assert_almost_equal(float(prob), candidates.prob[k])
+
+
+def test_binary_roundtrip():
+    candidates = sem.candidate_arrays(docs)
+    f = BytesIO()
+    write_binary(candidates, f)
+    f.seek(0)
+    copy = read_binary(f)
+
+    assert_equal(copy.n_docs, candidates.n_docs)
+    for a, b in zip(candidates._columns(), copy._columns()):
+        assert_equal(a, b)
@@ -0,0 +1,146 @@
+from os.path import dirname, join
+from tempfile import NamedTemporaryFile
+from threading import Lock, Thread
+import time
+
+from nose.tools import assert_equal, assert_raises, assert_true
+
+from semanticizest import registry, Semanticizer
+from semanticizest._semanticizer import create_model
+from semanticizest.registry import ModelHandle, ModelRegistry
+
+tempfile = NamedTemporaryFile()
+create_model(join(dirname(__file__),
+                  'nlwiki-20140927-pages-articles-sample.xml'),
+             tempfile.name)
+
+
+def test_registry():
+    models = dict((lang, tempfile.name) for lang in ['nl', 'af', 'fy'])
+    registry = ModelRegistry(models)
+    nbytes = registry.get('nl').memory_report()['total']
+
+    # Room for two models.
+    registry = ModelRegistry(models, max_memory=int(2.5 * nbytes))
+    nl = registry.get('nl')
+    registry.get('af')
+    assert_true(registry['nl'] is nl)
+    registry.get('fy')
+    # af was used least recently.
+    assert_equal(registry.loaded(), ['nl', 'fy'])
+
+    info = registry.info()
+    assert_equal((info.hits, info.loads, info.evictions, info.models),
+                 (1, 3, 1, 2))
+    assert_equal(info.nbytes, 2 * nbytes)
+    assert_true(info.load_time > 0)
+
+    assert_raises(KeyError, registry.get, 'en')
+
+
+class _SlowLoads(object):
+    """Stand-in for Semanticizer in the registry that takes a while to load.
+
+    Records the largest number of loads that were in progress at once.
+    """
+
+    def __init__(self):
+        self.active = self.peak = self.calls = 0
+        self._lock = Lock()
+
+    def __call__(self, fname, **kwargs):
+        with self._lock:
+            self.calls += 1
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            time.sleep(.2)
+            return Semanticizer(fname, **kwargs)
+        finally:
+            with self._lock:
+                self.active -= 1
+
+    def __enter__(self):
+        registry.Semanticizer = self
+        return self
+
+    def __exit__(self, *exc_info):
+        registry.Semanticizer = Semanticizer
+
+
+def _get_all(registry, keys):
+    results = {}
+    threads = [Thread(target=lambda i, key: results.__setitem__(
+                          i, registry.get(key)), args=(i, key))
+               for i, key in enumerate(keys)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return [results[i] for i in range(len(keys))]
+
+
+def test_registry_concurrent_loads():
+    # Threads that want a model that is being loaded wait for that load.
+    with _SlowLoads() as loads:
+        reg = ModelRegistry({'nl': tempfile.name})
+        results = _get_all(reg, ['nl'] * 8)
+    assert_equal(loads.calls, 1)
+    assert_true(all(sem is results[0] for sem in results))
+    info = reg.info()
+    assert_equal((info.loads, info.hits), (1, 0))
+
+    # Two loads that together exceed the budget do not run at once.
+    models = dict((lang, tempfile.name) for lang in ['nl', 'af', 'fy'])
+    nbytes = reg.info().nbytes
+    reg = ModelRegistry(models, max_memory=int(1.5 * nbytes))
+    for lang in models:
+        reg.get(lang)
+        reg.evict(lang)
+    with _SlowLoads() as loads:
+        _get_all(reg, ['nl', 'af'])
+    assert_equal(loads.peak, 1)
+    assert_equal(len(reg.loaded()), 1)
+
+    # Loads that fit do, once sizes are known.
+    reg.max_memory = 3 * nbytes
+    for lang in reg.loaded():
+        reg.evict(lang)
+    with _SlowLoads() as loads:
+        _get_all(reg, ['af', 'fy'])
+    assert_equal(loads.peak, 2)
+    assert_equal(reg.info().models, 2)
+
+    # Models not loaded before are loaded one at a time.
+    reg = ModelRegistry(models, max_memory=3 * nbytes)
+    with _SlowLoads() as loads:
+        _get_all(reg, list(models))
+    assert_equal(loads.peak, 1)
+
+
+def test_model_handle():
+    handle = ModelHandle(tempfile.name, cache_size=10)
+    old = handle.get()
+    docs = [u"de planeet Mars", u"Amsterdam"]
+    expected = [list(old.all_candidates(doc)) for doc in docs]
+
+    handle.swap().join()
+    new = handle.get()
+    assert_true(new is not old)
+    assert_equal([list(new.all_candidates(doc)) for doc in docs], expected)
+    # Still in use by the old reference, then released.
+    assert_equal(handle.info().retired, 1)
+    del old
+    assert_equal(handle.info().retired, 0)
+
+    # A failed load keeps the current model.
+    assert_raises(Exception, handle.swap, tempfile.name + '/missing',
+                  background=False)
+    assert_true(handle.get() is new)
+    handle.swap(tempfile.name + '/missing').join()
+    assert_true(handle.get() is new)
+
+    info = handle.info()
+    assert_equal((info.fname, info.loads, info.swaps, info.failures),
+                 (tempfile.name, 2, 1, 2))
+    assert_true(info.load_time >= info.last_load_time > 0)
@@ -1,13 +1,22 @@
+import gc
+import io
+import json
 import re
 from os.path import join, dirname
+import subprocess
+import sys
 from tempfile import NamedTemporaryFile
 from glob import glob
 from os.path import basename
+from threading import Thread
 
-from nose.tools import assert_equal, assert_multi_line_equal, assert_true
+from nose.tools import (assert_almost_equal, assert_equal,
+                        assert_multi_line_equal, assert_raises, assert_true)
 
 from semanticizest import Semanticizer
 from semanticizest._semanticizer import create_model
+from semanticizest._tiered import read_access_log, write_access_log
+from semanticizest._util import tokenize
 
 tempfile = NamedTemporaryFile()
 db = create_model(join(dirname(__file__),
@@ -40,6 +49,342 @@ def test_semanticizer_redirect():
     assert_equal(expected, actual)
 
 
+def test_stream_candidates():
+    for doc in glob(join(dirname(__file__), 'nlwiki', 'in', '*')):
+        with io.open(doc, encoding='utf-8') as f:
+            tokens = tokenize(f.read())
+        expected = list(sem.all_candidates(tokens))
+        actual = list(sem.stream_candidates(iter(tokens)))
+        assert_equal(expected, actual)
+        assert_equal(expected, list(sem.stream_candidates(" ".join(tokens))))
+
+
+def test_link_probability():
+    tempfile = NamedTemporaryFile()
+    create_model(join(dirname(__file__),
+                      'nlwiki-20140927-pages-articles-sample.xml'),
+                 tempfile.name, countmin=(1 << 16, 4))
+    approx = Semanticizer(tempfile.name)
+
+    assert_equal(sem.link_probability(u'zzyzx'), None)
+    for anchor in ['Architekt', 'Planeet', 'Amsterdam', 'wetenschap']:
+        p = sem.link_probability(anchor)
+        assert_true(0 < p <= 1, p)
+        # Count-min sketches overestimate, so this can't be larger.
+        assert_true(0 < approx.link_probability(anchor) <= p)
+
+
+def test_semanticizer_threads():
+    tokens = u"de planeet Mars en de stad Amsterdam".split()
+    anchors = ['Planeet', 'Amsterdam', 'wetenschap']
+    expected = (list(sem.all_candidates(tokens)),
+                [sem.link_probability(a) for a in anchors])
+
+    results = []
+
+    def work():
+        for _ in range(20):
+            results.append((list(sem.all_candidates(tokens)),
+                            [sem.link_probability(a) for a in anchors]))
+
+    threads = [Thread(target=work) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert_equal(len(results), 80)
+    for r in results:
+        assert_equal(expected, r)
+
+
+def test_sentence_cache():
+    cached = Semanticizer(tempfile.name, cache_size=50)
+    assert_equal(sem.cache_info().maxsize, 0)
+
+    docs = []
+    for doc in sorted(glob(join(dirname(__file__), 'nlwiki', 'in', '*'))):
+        with open(doc) as f:
+            docs.append(f.read().split())
+    # Sentence boundaries inside anchors, a lone boundary, repetition.
+    docs += [u"de planeet. Mars is een planeet. Mars is een planeet.".split(),
+             u"Mars . ! ? Planeet".split(), [u"."], []]
+
+    for tokens in docs + docs[::-1]:
+        assert_equal(list(sem.all_candidates(tokens)),
+                     list(cached.all_candidates(tokens)))
+
+    info = cached.cache_info()
+    assert_true(info.hits > 0)
+    assert_equal(info.currsize, 50)
+    assert_true(info.nbytes > 0)
+
+    # Strings are tokenized without punctuation, but still split into
+    # sentences for the cache.
+    cached = Semanticizer(tempfile.name, cache_size=50)
+    texts = [u"De planeet Mars. Amsterdam is een stad.",
+             u"Een Architekt! De planeet Mars."]
+    for text in texts:
+        assert_equal(list(sem.all_candidates(text)),
+                     list(cached.all_candidates(text)))
+    assert_equal(cached.cache_info().hits, 1)
+
+
+def test_punctuated_anchors():
+    # Anchors are tokenized like queries, so punctuation within them does
+    # not matter.
+    for query in [u"Sint-Petersburg", u"Sint Petersburg"]:
+        assert_equal(list(sem.all_candidates(query)),
+                     [(0, 2, u'Sint-Petersburg', 1.0)])
+    targets = set(t for _, _, t, _ in sem.all_candidates(
+        u"In 's-Hertogenbosch, Noord-Brabant."))
+    assert_equal(targets, set([u"'s-Hertogenbosch (hoofdbetekenis)",
+                               u"Noord-Brabant"]))
+
+
+def test_char_candidates():
+    cached = Semanticizer(tempfile.name, cache_size=50)
+    text = (u"Aangezien de aarde een planeet is, kunnen de aardwetenschappen"
+            u" ook als een tak van de planetologie beschouwd worden.\n"
+            u"Wetenschap (kennis) in 1902: een Architekt, op de planeet Mars."
+            u" Van Sint-Petersburg naar Noord-Brabant.")
+    candidates = sem.char_candidates(text)
+    assert_equal(len(candidates), len(list(sem.all_candidates(text))))
+    assert_true(u"Mars (planeet)" in [t for _, _, t, _ in candidates])
+    assert_true((text.index(u"Sint"), text.index(u" naar"),
+                 u"Sint-Petersburg", 1.0) in candidates)
+    for start, end, target, prob in candidates:
+        anchor = u" ".join(tokenize(text[start:end]))
+        assert_true((target, prob) in sem.commonness[anchor])
+    assert_equal(candidates, cached.char_candidates(text))
+    assert_equal(sem.char_candidates(u""), [])
+
+
+def test_fold():
+    folded = Semanticizer(tempfile.name, fold=True)
+
+    tokens = u"de PLANEET mars en een ARCHIT\xc9KT".split()
+    assert_equal(set(t for _, _, t, _ in folded.all_candidates(tokens)),
+                 set(['Planeet', 'Mars (planeet)', 'Architect']))
+    assert_equal(list(sem.all_candidates([u"PLANEET", u"ARCHIT\xc9KT"])),
+                 [])
+
+    for doc in glob(join(dirname(__file__), 'nlwiki', 'in', '*')):
+        with open(doc) as f:
+            tokens = f.read().split()
+        spans = set((i, j) for i, j, _, _ in sem.all_candidates(tokens))
+        probs = {}
+        for i, j, _, p in folded.all_candidates(tokens):
+            probs[i, j] = probs.get((i, j), 0) + p
+        assert_true(spans <= set(probs))
+        for p in probs.values():
+            assert_almost_equal(p, 1.)
+
+    assert_true(folded.memory_report()['folded'] > 0)
+
+
+def test_memory_budget():
+    report = sem.memory_report()
+    assert_equal(report['total'],
+                 sum(v for k, v in report.items() if k != 'total'))
+    assert_true(report['anchors'] > 0 and report['senses'] > 0)
+
+    assert_equal(Semanticizer(tempfile.name, max_memory=1 << 30).commonness,
+                 sem.commonness)
+
+    budget = report['total'] // 3
+    small = Semanticizer(tempfile.name, max_memory=budget)
+    assert_true(small.memory_report()['total'] <= budget)
+    assert_true(0 < len(small.commonness) < len(sem.commonness))
+    for anchor, senses in small.commonness.items():
+        # Kept senses have the same commonness as in the full model.
+        assert_true(set(senses) <= set(sem.commonness[anchor]))
+
+
+def test_hot_anchors():
+    docs = []
+    for doc in sorted(glob(join(dirname(__file__), 'nlwiki', 'in', '*'))):
+        with open(doc) as f:
+            docs.append(f.read().split())
+
+    tiered = Semanticizer(tempfile.name, hot_anchors=20, promote_after=2)
+    assert_equal(len(tiered.commonness), 20)
+    for doc in docs + docs:
+        assert_equal(list(sem.all_candidates(doc)),
+                     list(tiered.all_candidates(doc)))
+    assert_equal(list(sem.stream_candidates(docs[0])),
+                 list(tiered.stream_candidates(docs[0])))
+    info = tiered.tier_info()
+    assert_equal(info.hot + info.cold, len(sem.commonness))
+    assert_true(info.promoted > 0 and info.hits > 0 and info.lookups > 0)
+    assert_true(tiered.memory_report()['total'] <
+                sem.memory_report()['total'])
+    assert_raises(ValueError, tiered.link, docs[0])
+
+    # Promotion stays within max_promoted, and so do lookup counts.
+    capped = Semanticizer(tempfile.name, hot_anchors=20, promote_after=2,
+                          max_promoted=5)
+    for doc in docs + docs:
+        assert_equal(list(sem.all_candidates(doc)),
+                     list(capped.all_candidates(doc)))
+    info = capped.tier_info()
+    assert_equal(info.promoted, 5)
+    assert_true(info.demoted > 0)
+    assert_true(len(capped._cold._lookups) <= 4 * 5)
+    assert_raises(ValueError, Semanticizer, tempfile.name, hot_anchors=20,
+                  fold=True)
+
+    allowed = [u'Planeet', u'Mars (planeet)', u'Amsterdam', u'Architect']
+    restricted = Semanticizer(tempfile.name, allowed_entities=allowed)
+    tiered = Semanticizer(tempfile.name, allowed_entities=allowed,
+                          hot_anchors=1)
+    for doc in docs:
+        assert_equal(list(restricted.all_candidates(doc)),
+                     list(tiered.all_candidates(doc)))
+
+    log = NamedTemporaryFile()
+    logged = Semanticizer(tempfile.name, access_log=log.name)
+    for doc in docs:
+        list(logged.all_candidates(doc))
+    logged.save_access_log()
+    with open(log.name) as f:
+        count, anchor = f.readline().rstrip('\n').split('\t')
+    assert_true(int(count) > 1)
+    # The most looked up anchor is kept in memory, whatever its links.
+    tiered = Semanticizer(tempfile.name, access_log=log.name, hot_anchors=1)
+    assert_equal(list(tiered.commonness), [anchor])
+
+    # Logged anchors that are not in the model do not take up room.
+    counts = read_access_log(log.name)
+    counts[u'geen anker'] = 1000
+    write_access_log(log.name, counts)
+    tiered = Semanticizer(tempfile.name, access_log=log.name, hot_anchors=1)
+    assert_equal(list(tiered.commonness), [anchor])
+
+
+def test_access_log_threads():
+    docs = []
+    for doc in sorted(glob(join(dirname(__file__), 'nlwiki', 'in', '*'))):
+        with open(doc) as f:
+            docs.append(f.read().split())
+
+    def total_logged(run):
+        log = NamedTemporaryFile()
+        logged = Semanticizer(tempfile.name, access_log=log.name)
+        run(logged)
+        logged.save_access_log()
+        return sum(read_access_log(log.name).values())
+
+    def once(logged):
+        for doc in docs:
+            list(logged.all_candidates(doc))
+
+    def concurrently(logged):
+        # Save while other threads look anchors up; no lookup may be lost.
+        threads = [Thread(target=once, args=(logged,)) for _ in range(4)]
+        for t in threads:
+            t.start()
+        while any(t.is_alive() for t in threads):
+            logged.save_access_log()
+        for t in threads:
+            t.join()
+
+    assert_equal(total_logged(concurrently), 4 * total_logged(once))
+
+
+def test_load_in_thread_keeps_gc():
+    # A model loaded while other threads run leaves the collector on.
+    thread = Thread(target=Semanticizer, args=(tempfile.name,))
+    enabled = set()
+    thread.start()
+    while thread.is_alive():
+        enabled.add(gc.isenabled())
+    thread.join()
+    assert_equal(enabled, set([True]))
+
+
+def test_allowed_entities():
+    allowed = [u'Planeet', u'Mars (planeet)', u'Amsterdam', u'Architect']
+    restricted = Semanticizer(tempfile.name, allowed_entities=allowed)
+    assert_equal(Semanticizer(tempfile.name,
+                              allowed_entities=allowed.__contains__).commonness,
+                 restricted.commonness)
+
+    assert_true(0 < len(restricted.commonness) < len(sem.commonness))
+    for anchor, senses in restricted.commonness.items():
+        assert_true(senses)
+        assert_equal(senses, tuple(s for s in sem.commonness[anchor]
+                                   if s[0] in allowed))
+
+    renormalized = Semanticizer(tempfile.name, allowed_entities=allowed,
+                                renormalize=True)
+    assert_equal(set(renormalized.commonness), set(restricted.commonness))
+    for senses in renormalized.commonness.values():
+        assert_almost_equal(sum(p for _, p in senses), 1.)
+
+
+def test_link():
+    for doc in glob(join(dirname(__file__), 'nlwiki', 'in', '*')):
+        with open(doc) as f:
+            tokens = f.read().split()
+        # Best sense per span, then leftmost-longest spans.
+        best = {}
+        for i, j, target, p in sem.all_candidates(tokens):
+            if (i, j) not in best or p > best[i, j][1]:
+                best[i, j] = target, p
+        expected = []
+        for (i, j), (target, p) in sorted(best.items(),
+                                          key=lambda x: (x[0][0], -x[0][1])):
+            if not expected or i >= expected[-1][1]:
+                expected.append((i, j, target, p))
+        assert_equal(sem.link(tokens), expected)
+
+    tokens = u"de planeet Mars en de stad Amsterdam".split()
+    links = sem.link(tokens, min_commonness=.6, min_link_probability=.01)
+    assert_true(links)
+    for i, j, target, p in links:
+        assert_true(p >= .6)
+        assert_true(sem.link_probability(" ".join(tokens[i:j])) >= .01)
+    assert_equal(sem.link(tokens, min_commonness=1.1), [])
+
+
+def test_relatedness():
+    assert_raises(ValueError, sem.relatedness, u'Planeet', u'Mars (planeet)')
+
+    tempfile = NamedTemporaryFile()
+    create_model(join(dirname(__file__),
+                      'nlwiki-20140927-pages-articles-sample.xml'),
+                 tempfile.name, link_graph=True)
+    graph = Semanticizer(tempfile.name)
+
+    assert_true(0 < graph.relatedness(u'Planeet', u'Mars (planeet)') < 1)
+    assert_equal(graph.relatedness(u'Planeet', u'zzyzx'), 0)
+
+    with open(join(dirname(__file__), 'nlwiki', 'in', 'Aardwetenschappen')) as f:
+        tokens = f.read().split()
+    entities = sorted(set(e for _, _, e, _ in graph.all_candidates(tokens)))
+    r = graph.relatedness_matrix(entities)
+    assert_equal(len(r), len(entities))
+    for i in range(0, len(entities), 7):
+        assert_equal(r[i][i], 1.)
+        for j in range(i):
+            assert_equal(r[i][j], r[j][i])
+            assert_almost_equal(r[i][j],
+                                graph.relatedness(entities[i], entities[j]))
+
+
+def test_import_is_lightweight():
+    # Matching should not need any of the dump-building machinery.
+    heavy = ['semanticizest.parse_wikidump', 'xml.etree.ElementTree', 'bz2',
+             'gzip', 'subprocess', 'urllib.request', 'urllib2', 'docopt']
+    code = ("import json, sys, semanticizest;"
+            "print(json.dumps(sorted(sys.modules)))")
+    out = subprocess.check_output([sys.executable, '-c', code],
+                                  cwd=join(dirname(__file__), '..', '..'))
+    modules = set(json.loads(out.decode('ascii')))
+    assert_equal([m for m in heavy if m in modules], [])
+
+
 def test_semanticizer_nlwiki():
     tempfile = NamedTemporaryFile()
     db = create_model(join(dirname(__file__),
@@ -58,11 +403,12 @@ def test_semanticizer_nlwiki():
 
     for doc in input_test_cases:
         fname = basename(doc)
-        with open(doc) as f:
+        with io.open(doc, encoding='utf-8') as f:
             with open(join(dirs['actual'], fname), 'w') as out:
-                tokens = f.read().split()
+                # Tokenized as the text that the model was built from.
+                text = f.read()
                 out.write("\n".join(str(cand)
-                                    for cand in sem.all_candidates(tokens)))
+                                    for cand in sem.all_candidates(text)))
         with open(join(dirs['expected'], fname)) as f:
             expected = f.read()
         with open(join(dirs['actual'], fname)) as f:
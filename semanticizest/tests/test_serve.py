@@ -0,0 +1,145 @@
+import json
+from os.path import dirname, join
+from tempfile import NamedTemporaryFile
+from threading import Thread
+
+from nose.tools import assert_equal, assert_in, assert_true
+from six.moves import http_client
+
+from semanticizest import Semanticizer
+from semanticizest._semanticizer import create_model
+from semanticizest.registry import ModelHandle
+from semanticizest.serve import _reload, make_server, Metrics
+
+
+def test_serve():
+    tempfile = NamedTemporaryFile()
+    create_model(join(dirname(__file__),
+                      'nlwiki-20140927-pages-articles-sample.xml'),
+                 tempfile.name)
+    sem = Semanticizer(tempfile.name)
+
+    server = make_server(Semanticizer(tempfile.name, cache_size=10), port=0)
+    thread = Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        conn = http_client.HTTPConnection(*server.server_address)
+
+        docs = [u"de planeet Mars", u"Amsterdam".split(), []]
+        # Two requests over the same keep-alive connection.
+        for _ in range(2):
+            conn.request('POST', '/candidates', json.dumps(docs))
+            response = conn.getresponse()
+            assert_equal(response.status, 200)
+            lines = response.read().decode('utf-8').splitlines()
+            assert_equal([json.loads(l) for l in lines],
+                         [[list(c) for c in sem.all_candidates(doc)]
+                          for doc in docs])
+
+        # The body of a request to an unknown path does not end up in the
+        # next request.
+        conn.request('POST', '/unknown', json.dumps(docs))
+        response = conn.getresponse()
+        assert_equal(response.status, 404)
+        response.read()
+        conn.request('POST', '/candidates', json.dumps(docs))
+        response = conn.getresponse()
+        assert_equal(response.status, 200)
+        response.read()
+
+        conn.request('POST', '/candidates', '{"not": "a list"}')
+        response = conn.getresponse()
+        assert_equal(response.status, 400)
+        assert_in('error', json.loads(response.read().decode('utf-8')))
+
+        conn.request('GET', '/metrics')
+        metrics = json.loads(conn.getresponse().read().decode('utf-8'))
+        assert_equal(metrics['requests'], 4)
+        assert_equal(metrics['documents'], 9)
+        assert_equal(metrics['errors'], 1)
+        # The first request fills the cache for the others.
+        assert_equal(metrics['cache_hits'], 4)
+        assert_equal(metrics['cache_misses'], 2)
+        assert_equal(metrics['cache_hit_rate'], 4 / 6.)
+        assert_equal(sum(c for _, c in metrics['latency']['buckets']), 4)
+        conn.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def test_serve_swap():
+    tempfile = NamedTemporaryFile()
+    create_model(join(dirname(__file__),
+                      'nlwiki-20140927-pages-articles-sample.xml'),
+                 tempfile.name)
+    handle = ModelHandle(tempfile.name)
+    metrics = Metrics()
+    server = make_server(handle, port=0, metrics=metrics)
+    thread = Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        conn = http_client.HTTPConnection(*server.server_address)
+        docs = [u"de planeet Mars"]
+        expected = [[list(c) for c in handle.get().all_candidates(doc)]
+                    for doc in docs]
+
+        old = handle.get()
+        _reload(handle, metrics).join()
+        assert_true(handle.get() is not old)
+        del old
+        conn.request('POST', '/candidates', json.dumps(docs))
+        lines = conn.getresponse().read().decode('utf-8').splitlines()
+        assert_equal([json.loads(l) for l in lines], expected)
+        assert_equal(handle.info().retired, 0)
+
+        conn.request('GET', '/metrics')
+        metrics = json.loads(conn.getresponse().read().decode('utf-8'))
+        assert_equal((metrics['loads'], metrics['swaps'],
+                      metrics['swap_errors']), (1, 1, 0))
+        assert_true(metrics['load_time_mean'] > 0)
+        conn.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+class _Failing(object):
+    """Semanticizer stand-in that fails on the document "fail"."""
+
+    def all_candidates(self, doc):
+        if doc == u"fail":
+            raise RuntimeError("no candidates")
+        return []
+
+    def cache_info(self):
+        return None
+
+
+def test_serve_error():
+    server = make_server(_Failing(), port=0)
+    thread = Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        conn = http_client.HTTPConnection(*server.server_address)
+        # The error ends the stream, which the connection survives.
+        for _ in range(2):
+            conn.request('POST', '/candidates',
+                         json.dumps([u"ok", u"fail", u"ok"]))
+            response = conn.getresponse()
+            assert_equal(response.status, 200)
+            lines = response.read().decode('utf-8').splitlines()
+            assert_equal([json.loads(l) for l in lines],
+                         [[], {'error': 'no candidates'}])
+
+        conn.request('GET', '/metrics')
+        metrics = json.loads(conn.getresponse().read().decode('utf-8'))
+        assert_equal((metrics['requests'], metrics['documents'],
+                      metrics['errors']), (2, 2, 2))
+        conn.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
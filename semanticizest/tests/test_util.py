@@ -1,6 +1,9 @@
 from collections import Counter
 
-from semanticizest._util import ngrams, ngrams_with_pos, url_from_title
+from semanticizest._util import (fold, iter_tokens, ngrams, ngrams_with_pos,
+                                 ngrams_with_pos_iter, sentence_ends,
+                                 text_sentence_ends, tokenize,
+                                 tokenize_with_offsets, url_from_title)
 
 from nose.tools import assert_equal, assert_in, assert_true, raises
 
@@ -88,6 +91,20 @@ def test_ngrams_order_string():
     list(ngrams_with_pos(tokens, 'foobar'))
 
 
+def test_ngrams_with_pos_iter():
+    tokens = "a b c d e".split()
+    for N in range(1, 7):
+        for length in range(len(tokens) + 1):
+            expected = list(ngrams_with_pos(tokens[:length], N))
+            actual = list(ngrams_with_pos_iter(iter(tokens[:length]), N))
+            assert_equal(expected, actual)
+
+
+@raises(TypeError)
+def test_ngrams_with_pos_iter_order_none():
+    list(ngrams_with_pos_iter(iter("a b c".split()), None))
+
+
 def test_url_from_title():
     """Test article title -> Wikipedia URL conversion."""
     assert_equal(url_from_title('L. R. Ford, Jr.', 'en'),
@@ -102,3 +119,31 @@ def test_url_from_title():
                  'https://nds-nl.wikipedia.org/wiki/Iezergeteri-je')
     assert_equal(url_from_title(u'Zw\xe4rte W\xe4ter', 'nds-nl'),
                  'https://nds-nl.wikipedia.org/wiki/Zw%C3%A4rte_W%C3%A4ter')
+
+
+def test_sentence_ends():
+    tokens = u'Hallo ! Dit is een zin. En "nog een." Tot slot'.split()
+    assert_equal(list(sentence_ends(tokens)), [2, 6, 9, 11])
+    assert_equal(list(sentence_ends(tokens[:9])), [2, 6, 9])
+    assert_equal(list(sentence_ends([])), [])
+
+
+def test_tokenize_with_offsets():
+    text = u'Hallo! Dit is een zin. En "nog een." Tot\nslot, caf\xe9'
+    tokens, starts, ends = tokenize_with_offsets(text)
+    assert_equal(tokens, [u'Hallo', u'Dit', u'is', u'een', u'zin', u'En',
+                          u'nog', u'een', u'Tot', u'slot', u'caf\xe9'])
+    assert_equal(tokens, tokenize(text))
+    assert_equal(tokens, list(iter_tokens(text)))
+    assert_equal(tokens, [text[i:j] for i, j in zip(starts, ends)])
+
+    assert_equal(list(text_sentence_ends(text, starts, ends)), [1, 5, 8, 11])
+    assert_equal(list(text_sentence_ends(u'', [], [])), [])
+
+
+def test_fold():
+    assert_equal(fold(u'Caf\xe9 M\xfcNCHEN'), u'cafe munchen')
+    # Spacing diacritics go without leaving a space; spaces stay.
+    assert_equal(fold(u'M\xa8unchen'), u'munchen')
+    assert_equal(fold(u'\xb4s Hertogenbosch'), u's hertogenbosch')
+    assert_equal(fold(u'Stra\xdfe\xa0\ufb01'), u'stra\xdfe fi')
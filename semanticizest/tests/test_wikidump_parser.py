@@ -1,20 +1,28 @@
 # -*- coding: utf-8 -*-
 
+from bz2 import BZ2File
+from collections import Counter
+from gzip import GzipFile
+
 from cytoolz import compose
 import six
 
+import os
 from os.path import abspath, dirname, join
+import re
+import shutil
 import sqlite3
 import tempfile
 
 from nose import SkipTest
 from nose.tools import (assert_equal, assert_greater, assert_in, assert_not_in,
-                        assert_true)
+                        assert_raises, assert_true)
 
 from semanticizest.parse_wikidump.__main__ import main as parse_wikidump_main
 from semanticizest.parse_wikidump import (clean_text, extract_links,
                                           extract_pages, page_statistics,
-                                          parse_dump, remove_links)
+                                          parse_dump, remove_links,
+                                          update_model, _open, _which)
 from semanticizest._semanticizer import createtables_path
 
 
@@ -110,6 +118,33 @@ def test_extract_pages_unicode():
                 assert_true(isinstance(s, unicode))
 
 
+def test_open_compressed():
+    dump = _test_dump_path()
+    expected = [page.title for page in extract_pages(dump)]
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        with open(dump, 'rb') as f:
+            data = f.read()
+        for ext, compressed_file, command in [('.bz2', BZ2File, 'bzip2'),
+                                              ('.gz', GzipFile, 'gzip')]:
+            fname = join(tmpdir, 'dump.xml' + ext)
+            out = compressed_file(fname, 'wb')
+            out.write(data)
+            out.close()
+
+            decompressors = [None, 'thread', 'auto']
+            if _which([command]) is not None:
+                decompressors.append(command)
+            for decompressor in decompressors:
+                f = _open(fname, decompressor)
+                actual = [page.title for page in extract_pages(f)]
+                f.close()
+                assert_equal(expected, actual)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
 def test_page_statistics():
     page = """
         Wikisyntax is the [[syntax (to be parsed)|syntax]] used on
@@ -121,6 +156,9 @@ def test_page_statistics():
 
         Let's repeat the [[text]] to get more interesting [[statistic]]s.
         And the [[book]] too.
+
+        Anchors are tokenized: [[Sint-Petersburg]],
+        [[Den Bosch|'s-Hertogenbosch]].
     """
 
     expected_links = {('Syntax (to be parsed)', 'syntax'): 1,
@@ -130,7 +168,9 @@ def test_page_statistics():
                       ('Book', 'book'): 2,
                       ('Wikipedia', 'completely'): 1,
                       ('Hack', 'different'): 1,
-                      ('Statistic', 'statistics'): 1}
+                      ('Statistic', 'statistics'): 1,
+                      ('Sint-Petersburg', 'Sint Petersburg'): 1,
+                      ('Den Bosch', 's Hertogenbosch'): 1}
 
     links, ngrams = page_statistics(page, N=2)
 
@@ -177,6 +217,62 @@ def test_parse_dump():
     assert_in('Heinrich Tessenow', link_count)
 
 
+def test_parse_dump_pruning():
+    def linkstats(**thresholds):
+        db = sqlite3.connect(':memory:')
+        cur = db.cursor()
+        with open(createtables_path()) as create:
+            cur.executescript(create.read())
+        report = parse_dump(_test_dump_path(), db, N=None, **thresholds)
+        rows = list(cur.execute('''select ngram, target, count
+                                   from linkstats, ngrams
+                                   where ngram_id = ngrams.id;'''))
+        return rows, report
+
+    full, _ = linkstats()
+    pruned, report = linkstats(min_link_count=2, min_anchor_links=3,
+                               min_target_inlinks=4)
+
+    anchor_links = Counter()
+    target_inlinks = Counter()
+    for anchor, target, count in full:
+        anchor_links[anchor] += count
+        target_inlinks[target] += count
+    expected = [(anchor, target, count) for anchor, target, count in full
+                if count >= 2 and anchor_links[anchor] >= 3
+                and target_inlinks[target] >= 4]
+
+    assert_equal(sorted(expected), sorted(pruned))
+    assert_equal(report['rows'], len(full))
+    assert_equal(report['removed'], len(full) - len(pruned))
+    assert_greater(report['bytes'], 0)
+
+
+def test_parse_dump_sample():
+    def build(**kwargs):
+        db = sqlite3.connect(':memory:')
+        cur = db.cursor()
+        with open(createtables_path()) as create:
+            cur.executescript(create.read())
+        parse_dump(_test_dump_path(), db, N=2, **kwargs)
+        return (dict(cur.execute('select key, value from parameters')),
+                list(cur.execute('select * from redirects')),
+                list(cur.execute('select * from linkstats')))
+
+    assert_raises(ValueError, build, sample=0)
+    assert_raises(ValueError, build, scale=True)
+    full_params, full_redirects, full = build()
+    params, redirects, sample = build(sample=.5)
+    assert_equal(params['sample'], '0.5')
+    assert_equal(redirects, full_redirects)
+    assert_true(0 < int(params['articles']) < int(full_params['articles']))
+    assert_true(0 < len(sample) < len(full))
+    # The sample is the same every time, and scaling doubles the counts.
+    _, _, scaled = build(sample=.5, scale=True)
+    assert_equal([(ngram_id, target, 2 * count)
+                  for ngram_id, target, count in sample], scaled)
+
+
 def test_parse_wikidump():
     tmpfile = 'abcdefXXXXX'
     dump = join(dirname(abspath(__file__)),
@@ -187,10 +283,87 @@ def test_parse_wikidump():
         db = sqlite3.connect(model_file.name)
         cur = db.cursor()
         actual = list(cur.execute('select count(*) from ngrams;'))[0][0]
-        expected = 22864
+        expected = 22779
         assert_equal(expected, actual)
 
 
+def _model_contents(fname):
+    cur = sqlite3.connect(fname).cursor()
+    return [list(cur.execute('select * from %s;' % table))
+            for table in ['ngrams', 'linkstats', 'redirects', 'inlinks']]
+
+
+def test_merge_shards():
+    dump = _test_dump_path()
+
+    with tempfile.NamedTemporaryFile() as single, \
+            tempfile.NamedTemporaryFile() as merged, \
+            tempfile.NamedTemporaryFile() as shard1, \
+            tempfile.NamedTemporaryFile() as shard2, \
+            tempfile.NamedTemporaryFile() as shard3:
+        parse_wikidump_main(["--ngram=2", "--link-graph", "--min-link-count=2", dump,
+                             single.name])
+        parse_wikidump_main(["--ngram=2", "--link-graph", "--page-ids=:8", dump,
+                             shard1.name])
+        parse_wikidump_main(["--ngram=2", "--link-graph", "--page-ids=8:17", dump,
+                             shard2.name])
+        parse_wikidump_main(["--ngram=2", "--link-graph", "--page-ids=17:", dump,
+                             shard3.name])
+        parse_wikidump_main(["merge", "--min-link-count=2", merged.name,
+                             shard1.name, shard2.name, shard3.name])
+
+        expected = _model_contents(single.name)
+        actual = _model_contents(merged.name)
+        assert_greater(len(expected[1]), 0)
+        assert_greater(len(expected[3]), 0)
+        assert_equal(expected, actual)
+
+
+def test_update_model():
+    dump = _test_dump_path()
+    with open(dump) as f:
+        new = f.read()
+    pages = re.findall(r'  <page>.*?</page>\n', new, re.DOTALL)
+    turing = [p for p in pages if '<title>Alan Turing</title>' in p][0]
+    # Delete a page, edit one and change the target of a redirect.
+    old = (new.replace(pages[4], '')
+              .replace(turing, turing.replace('Turing', 'Touring'))
+              .replace('<redirect title="Architect" />',
+                       '<redirect title="Acteur" />'))
+
+    # A second page with the id of Alan Turing, which should be skipped.
+    dup = new.replace(turing, turing + turing.replace('Turing', 'Tjoering'))
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        old_dump = join(tmpdir, 'old.xml')
+        dup_dump = join(tmpdir, 'dup.xml')
+        for fname, content in [(old_dump, old), (dup_dump, dup)]:
+            with open(fname, 'w') as f:
+                f.write(content)
+
+        # Update in both directions, so pages are added and deleted.
+        for before, after in [(old_dump, dump), (dump, old_dump),
+                              (old_dump, dup_dump)]:
+            model = join(tmpdir, 'model.db')
+            fresh = join(tmpdir, 'fresh.db')
+            for fname, d in [(model, before), (fresh, after)]:
+                if os.path.exists(fname):
+                    os.remove(fname)
+                parse_wikidump_main(["--ngram=2", "--link-graph",
+                                     "--incremental", "--min-link-count=2",
+                                     d, fname])
+
+            db = sqlite3.connect(model)
+            report = update_model(after, db)
+            db.close()
+            assert_equal(report['changed'], 2)
+            assert_equal(report['added'] + report['deleted'], 1)
+            assert_equal(_model_contents(model), _model_contents(fresh))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
 def test_remove_links():
     text = """
         Wikisyntax is the [[syntax (to be parsed)|syntax]] used on